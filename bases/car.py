@@ -1,118 +1,158 @@
-import math
-import random
-
 from .primitives import SimulateMixin, Point
 
 DEFAULT_CAR_LENGTH = 1
 DEFAULT_CAR_SPEED = 1.5
 DEFAULT_CAR_ACCELERATION_SPEED = 1.0
 DEFAULT_CAR_DELAY = 0.25
+CAR_GAP = DEFAULT_CAR_LENGTH + 0.5  # дистанция до впереди идущего авто
 
 
 class Car(SimulateMixin):
-    CAR_COUNT = 0
+    __slots__ = (
+        'average_wait_time', 'offset', 'drive_line', 'next_drive_line', 'id', 'speed', 'state', 'delay_passed',
+        'wait_time', 'dirty', 'spawned', 'destination', 'exit_time',
+    )
     STATE_STOPPED = 1
     STATE_RUNNING = 2
     average_wait_time: float
-    position: Point
+    offset: float  # расстояние от начала полосы движения (drive_line.line.p1)
+    exit_time: float  # на мезоскопической полосе: время полосы, когда авто доедет до ее конца
     length = DEFAULT_CAR_LENGTH  # стандартная длина авто
     id: int
 
-    def __init__(self, position: Point, drive_line=None):
+    def __init__(self, drive_line=None, offset: float = 0.0, car_id: int = None):
+        """
+        :param car_id: id авто, выданный контекстом модели (см. acquire)
+        """
+        self.reset(drive_line, offset, car_id)
+
+    def reset(self, drive_line=None, offset: float = 0.0, car_id: int = None):
         self.average_wait_time = 0.0
-        self.position = position
+        self.offset = offset
         self.drive_line = drive_line
         self.next_drive_line = None
-        self.id = Car.inc_car_count()
+        self.id = car_id
         self.speed = 0.0
         self.state = self.STATE_STOPPED
         self.delay_passed = 0.0
+        self.wait_time = 0.0  # суммарное время простоя
+        self.dirty = True  # положение изменилось с момента последней публикации
+        self.spawned = True  # авто еще не публиковалось
+        self.destination = None  # полоса-выезд, к которой едет авто; None - случайный выбор пути
+        self.exit_time = 0.0
 
     @classmethod
-    def inc_car_count(cls):
-        cls.CAR_COUNT += 1
-        return cls.CAR_COUNT
+    def acquire(cls, drive_line, offset: float = 0.0, car_id: int = None):
+        """
+        Новое авто на drive_line: объект берется из пула контекста полосы, если он не пуст
+        :param car_id: id авто, переданного из другого участка модели; None - новый id из контекста полосы
+        """
+        context = drive_line.context
+        if car_id is None:
+            car_id = context.next_car_id()
+        if context.car_pool:
+            car = context.car_pool.pop()
+            car.reset(drive_line, offset, car_id)
+            return car
+        return cls(drive_line=drive_line, offset=offset, car_id=car_id)
+
+    @classmethod
+    def recycle(cls, car):
+        """
+        Возвращает в пул контекста его полосы авто, покинувшее модель; ссылок на него оставаться не должно
+        """
+        context = car.drive_line.context
+        car.drive_line = None
+        car.next_drive_line = None
+        car.destination = None
+        if len(context.car_pool) < context.MAX_POOL_SIZE:
+            context.car_pool.append(car)
+
+    @property
+    def position(self) -> Point:
+        start = self.drive_line.start
+        vector = self.drive_line.line_vector
+        return Point(start.x + vector.x * self.offset, start.y + vector.y * self.offset)
 
     def simulate(self, timedelta: float, queue_position: int = None, drive_line=None):
-        moved = False
-        next_car = None
         if not self.drive_line:
             assert drive_line
             self.drive_line = drive_line
-        if queue_position == 0:
-            drive_line_distance = self.drive_line.line.distance()
+        line = self.drive_line
+        if self.state == self.STATE_STOPPED:
+            self.wait_time += timedelta
+        if queue_position:
+            queue = line.queue
+            leader = queue.cars[queue.head + queue_position - 1]
+            limit = leader.offset - CAR_GAP
+            # авто стоит вплотную за остановившимся авто
+            if leader.state == self.STATE_STOPPED and self.offset >= limit:
+                return False
         else:
-            next_car = self.drive_line.queue[queue_position - 1]
-            drive_line_distance = math.dist(
-                (self.drive_line.line.p1.x, self.drive_line.line.p1.y),
-                (next_car.position.x, next_car.position.y)
-            )
-            if next_car.state == Car.STATE_STOPPED and math.dist(
-                    (self.position.x, self.position.y), (next_car.position.x, next_car.position.y)
-            ) == DEFAULT_CAR_LENGTH + 0.5:
-                return moved
+            leader = None
+            limit = line.length
         if self.state == self.STATE_STOPPED:
             self.delay_passed += timedelta
-            if self.delay_passed >= DEFAULT_CAR_DELAY:
-                self.delay_passed = 0.0
-                self.state = self.STATE_RUNNING
-            else:
-                return moved
+            if self.delay_passed < line.context.car_delay:
+                return False
+            self.delay_passed = 0.0
+            self.state = self.STATE_RUNNING
 
-        line_start_point = self.drive_line.line.p1
-        distance_p1 = math.dist(
-            (self.position.x, self.position.y), (line_start_point.x, line_start_point.y)
-        )
-        try:
-            # проверка на то, что авто находится внутри полосы движения (между точки p1 и p2)
-            assert distance_p1 < drive_line_distance
-            new_position = Point(
-                self.position.x + self.drive_line.line_vector.x * timedelta * self.speed,
-                self.position.y + self.drive_line.line_vector.y * timedelta * self.speed
-            )
-            distance_new_pos = math.dist(
-                (new_position.x, new_position.y), (line_start_point.x, line_start_point.y)
-            )
-            # новая точка все еще находится внутри полосы
-            if queue_position == 0 and distance_new_pos >= drive_line_distance:
-                if self.drive_line.can_release():
-                    if len(self.drive_line.paths) == 0:
-                        self.drive_line.release_car()
-                    else:
-                        if not self.next_drive_line:
-                            self.next_drive_line = self.drive_line.paths[
-                                random.randint(0, len(self.drive_line.paths) - 1)
-                            ]
-                        if self.next_drive_line.can_recv():
-                            self.drive_line.release_car()
-                            self.drive_line = self.next_drive_line
-                            self.next_drive_line = None
-                            self.drive_line.add_car(self)
-                            self.position = self.drive_line.line.p1
-                            moved = True
-                            return moved
-            else:
-                assert distance_new_pos < drive_line_distance
-            # между машинами соблюдается дистанция
-            assert distance_new_pos < drive_line_distance - int(bool(next_car)) * (DEFAULT_CAR_LENGTH + 0.5)
-            self.position = new_position
-            moved = True
-        except AssertionError:
+        new_offset = self.offset + self.speed * timedelta
+        if new_offset >= limit:
+            if not leader and self.leave_line(line):
+                return True
+            # авто останавливается у стоп-линии или на дистанции от впереди идущего авто
+            moved = limit > self.offset
+            if moved:
+                self.offset = limit
+                self.dirty = True
+                line.dirty = True
             self.state = self.STATE_STOPPED
             self.speed = 0.0
             return moved
-        if self.speed < DEFAULT_CAR_SPEED:
-            self.speed += timedelta * DEFAULT_CAR_ACCELERATION_SPEED
-            if self.speed > DEFAULT_CAR_SPEED:
-                self.speed = DEFAULT_CAR_SPEED
-        return moved
+
+        if new_offset != self.offset:
+            self.offset = new_offset
+            self.dirty = True
+            line.dirty = True
+        context = line.context
+        if self.speed < context.car_speed:
+            self.speed += timedelta * context.car_acceleration
+            if self.speed > context.car_speed:
+                self.speed = context.car_speed
+        return True
+
+    def leave_line(self, line) -> bool:
+        """
+        Головное авто у конца полосы line переезжает на следующую полосу или покидает модель
+        :return: уехало ли авто с полосы
+        """
+        if not line.can_release():
+            return False
+        if not line.paths:
+            line.remove_car()
+            return True
+        if not self.next_drive_line and self.destination is not None and line.router is not None:
+            self.next_drive_line = line.router.next_lane(line, self.destination)
+        if not self.next_drive_line:
+            self.next_drive_line = line.paths[line.context.random.randint(0, len(line.paths) - 1)]
+        if self.next_drive_line.can_recv():
+            line.release_car()
+            self.drive_line = self.next_drive_line
+            self.next_drive_line = None
+            self.offset = 0.0
+            self.drive_line.add_car(self)
+            return True
+        return False
 
     def to_dict(self):
+        start = self.drive_line.start
+        vector = self.drive_line.line_vector
         return {
             'id': self.id,
             'position': {
-                'x': self.position.x,
-                'y': self.position.y,
+                'x': start.x + vector.x * self.offset,
+                'y': start.y + vector.y * self.offset,
             }
         }
-
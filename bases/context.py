@@ -0,0 +1,130 @@
+"""
+Контекст модели: счетчики id объектов, генератор случайных чисел, пул авто и параметры симуляции.
+
+Дороги, полосы, перекрестки и светофоры при создании запоминают текущий контекст (current_context) и берут
+из него id; авто получают id, выбирают путь и возвращаются в пул через контекст своей полосы. Модели,
+построенные в разных контекстах (with context.activate()), не имеют общего изменяемого состояния, поэтому
+их можно симулировать одновременно в потоках одного процесса. Текущий контекст хранится в contextvars
+и у каждого потока свой; вне activate используется DEFAULT_CONTEXT с генератором модуля random.
+"""
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import random
+
+from .car import DEFAULT_CAR_SPEED, DEFAULT_CAR_ACCELERATION_SPEED, DEFAULT_CAR_DELAY, CAR_GAP
+
+DEFAULT_TIME_SWITCH = 30.0
+DEFAULT_SPAWN_INTERVAL = 10.0
+
+
+class ModelContext:
+    # параметры, которые можно задать контексту (см. simulation.runner)
+    PARAMETERS = ('time_switch', 'spawn_interval', 'car_speed', 'car_acceleration', 'car_delay')
+    MAX_POOL_SIZE = 10000
+
+    def __init__(
+            self,
+            seed=None,
+            rng: random.Random = None,
+            car_id_step: int = 1,
+            car_count: int = 0,
+            time_switch: float = DEFAULT_TIME_SWITCH,
+            spawn_interval: float = DEFAULT_SPAWN_INTERVAL,
+            car_speed: float = DEFAULT_CAR_SPEED,
+            car_acceleration: float = DEFAULT_CAR_ACCELERATION_SPEED,
+            car_delay: float = DEFAULT_CAR_DELAY,
+    ):
+        """
+        :param seed: зерно генератора случайных чисел, None - случайное
+        :param rng: готовый генератор (например, модуль random), тогда seed не используется
+        :param car_id_step: шаг id авто; при разбиении модели на участки у каждого участка свой ряд id
+        :param car_count: id, после которого выдаются id авто
+        :param time_switch: время между переключениями светофоров перекрестка, секунд
+        :param spawn_interval: время между появлениями авто на полосах auto_add_car, секунд
+        """
+        if car_speed <= 0.0:
+            raise ValueError('Car speed must be positive')
+        self.random = rng if rng is not None else random.Random(seed)
+        self.car_id_step = car_id_step
+        self.car_count = car_count
+        self.road_count = 0
+        self.cross_road_count = 0
+        self.drive_line_count = 0
+        self.semaphore_count = 0
+        self.car_pool = []  # авто, покинувшие модель, для повторного использования (см. Car.acquire, recycle)
+        self.time_switch = time_switch
+        self.spawn_interval = spawn_interval
+        self.car_speed = car_speed
+        self.car_acceleration = car_acceleration
+        self.car_delay = car_delay
+        # мезоскопические полосы: авто выезжают с полосы не чаще одного за meso_headway секунд
+        # (задержка трогания и проезд дистанции до впереди идущего авто)
+        self.meso_headway = car_delay + CAR_GAP / car_speed
+
+    def next_car_id(self) -> int:
+        self.car_count += self.car_id_step
+        return self.car_count
+
+    def next_road_id(self) -> int:
+        self.road_count += 1
+        return self.road_count
+
+    def next_cross_road_id(self) -> int:
+        self.cross_road_count += 1
+        return self.cross_road_count
+
+    def next_drive_line_id(self) -> int:
+        self.drive_line_count += 1
+        return self.drive_line_count
+
+    def next_semaphore_id(self) -> int:
+        self.semaphore_count += 1
+        return self.semaphore_count
+
+    def counters(self):
+        return self.car_count, self.road_count, self.cross_road_count, self.drive_line_count, self.semaphore_count
+
+    def reserve_ids(
+            self,
+            car_count: int = None,
+            road_count: int = None,
+            cross_road_count: int = None,
+            drive_line_count: int = None,
+            semaphore_count: int = None,
+    ):
+        """
+        Новые объекты не получат id, не превышающие переданные (объекты загруженной сети или контрольной точки);
+        None - счетчик не меняется
+        """
+        if car_count is not None:
+            self.car_count = max(self.car_count, car_count)
+        if road_count is not None:
+            self.road_count = max(self.road_count, road_count)
+        if cross_road_count is not None:
+            self.cross_road_count = max(self.cross_road_count, cross_road_count)
+        if drive_line_count is not None:
+            self.drive_line_count = max(self.drive_line_count, drive_line_count)
+        if semaphore_count is not None:
+            self.semaphore_count = max(self.semaphore_count, semaphore_count)
+
+    @contextlib.contextmanager
+    def activate(self):
+        """
+        Объекты, созданные внутри with, принадлежат этому контексту
+        """
+        token = CURRENT_CONTEXT.set(self)
+        try:
+            yield self
+        finally:
+            CURRENT_CONTEXT.reset(token)
+
+
+# контекст объектов, созданных вне activate; общий для всех потоков
+DEFAULT_CONTEXT = ModelContext(rng=random)
+CURRENT_CONTEXT = contextvars.ContextVar('model_context', default=DEFAULT_CONTEXT)
+
+
+def current_context() -> ModelContext:
+    return CURRENT_CONTEXT.get()
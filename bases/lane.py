@@ -0,0 +1,101 @@
+from itertools import islice
+
+
+def search_offset(cars, offset: float, lo: int, inclusive: bool = True) -> int:
+    """
+    Двоичный поиск в списке авто, упорядоченном по убыванию offset (bisect с key есть только с Python 3.10)
+    :param inclusive: True - первое авто с offset <= offset, False - первое авто с offset < offset
+    :return: индекс авто, len(cars) - такого авто нет
+    """
+    hi = len(cars)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        car_offset = cars[mid].offset
+        if car_offset > offset or (not inclusive and car_offset == offset):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class LaneQueue:
+    """
+    Очередь авто на полосе: от головного авто (ближе всего к концу полосы) к последнему въехавшему.
+
+    Авто на полосе не обгоняют друг друга, поэтому очередь упорядочена по убыванию offset и запросы
+    по положению на полосе выполняются двоичным поиском. Головное авто уходит с полосы за O(1):
+    вместо сдвига списка увеличивается head, освободившееся начало списка удаляется, когда
+    занимает больше половины списка. Индексы отсчитываются от головного авто, как у списка.
+    """
+    __slots__ = ('cars', 'head')
+    COMPACT_SIZE = 32  # не сжимать список, пока освободилось меньше элементов
+
+    def __init__(self, cars=None):
+        self.cars = list(cars) if cars else []
+        self.head = 0  # индекс головного авто в cars
+
+    def __len__(self):
+        return len(self.cars) - self.head
+
+    def __bool__(self):
+        return len(self.cars) > self.head
+
+    def __iter__(self):
+        return islice(self.cars, self.head, None)
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            if -index > len(self.cars) - self.head:
+                raise IndexError('Lane queue index out of range')
+            return self.cars[index]
+        index += self.head
+        if index >= len(self.cars):
+            raise IndexError('Lane queue index out of range')
+        return self.cars[index]
+
+    def append(self, car):
+        self.cars.append(car)
+
+    def popleft(self):
+        """
+        Снимает головное авто
+        """
+        cars = self.cars
+        head = self.head
+        if head >= len(cars):
+            raise IndexError('Pop from empty lane queue')
+        car = cars[head]
+        cars[head] = None
+        head += 1
+        if head >= self.COMPACT_SIZE and head * 2 >= len(cars):
+            del cars[:head]
+            head = 0
+        self.head = head
+        return car
+
+    def clear(self):
+        self.cars = []
+        self.head = 0
+
+    def entry_gap(self, length: float):
+        """
+        Свободное место в начале полосы: смещение последнего авто, length - полоса пуста
+        """
+        if len(self.cars) > self.head:
+            return self.cars[-1].offset
+        return length
+
+    def leader(self, offset: float):
+        """
+        :return: ближайшее авто впереди точки offset, None - впереди авто нет
+        """
+        i = search_offset(self.cars, offset, self.head)
+        return self.cars[i - 1] if i > self.head else None
+
+    def between(self, start: float, end: float):
+        """
+        :return: авто с offset от start до end включительно, от головного
+        """
+        lo = search_offset(self.cars, end, self.head)
+        hi = search_offset(self.cars, start, lo, inclusive=False)
+        return self.cars[lo:hi]
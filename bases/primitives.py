@@ -2,6 +2,7 @@ import math
 
 
 class Point:
+    __slots__ = ('x', 'y')
     x: float
     y: float
 
@@ -11,6 +12,7 @@ class Point:
 
 
 class Line:
+    __slots__ = ('p1', 'p2')
     p1: Point
     p2: Point
 
@@ -23,5 +25,7 @@ class Line:
 
 
 class SimulateMixin:
+    __slots__ = ()
+
     def simulate(self, time_delta: float, **kwargs):
         raise NotImplementedError
\ No newline at end of file
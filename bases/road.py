@@ -2,15 +2,17 @@ from __future__ import annotations
 
 import math
 from typing import List
-from .car import Car, DEFAULT_CAR_LENGTH
+from .car import Car, DEFAULT_CAR_LENGTH, CAR_GAP
+from .context import ModelContext, current_context, DEFAULT_TIME_SWITCH, DEFAULT_SPAWN_INTERVAL
+from .lane import LaneQueue
 from .primitives import Point, Line
 
 
-DEFAULT_TIME_SWITCH = 30.0
+GEOMETRY_EPSILON = 1e-9
 
 
 class Semaphore:
-    SEMAPHORE_COUNT = 0
+    __slots__ = ('state', 'time_passed', 'position', 'id', 'dirty', 'context')
     GREEN = 1
     RED = 2
 
@@ -18,35 +20,38 @@ class Semaphore:
     position: Point
     time_passed: float
     id: int
+    context: ModelContext
 
     def __init__(self, position: Point):
         self.state = self.RED
         self.time_passed = 0.0
         self.position = position
-        self.id = Semaphore.inc_semaphore_count()
-
-    @classmethod
-    def inc_semaphore_count(cls):
-        cls.SEMAPHORE_COUNT += 1
-        return cls.SEMAPHORE_COUNT
+        self.context = current_context()
+        self.id = self.context.next_semaphore_id()
+        self.dirty = True  # состояние изменилось с момента последней публикации
 
     def switch(self):
         if self.state == self.GREEN:
             self.state = self.RED
         else:
             self.state = self.GREEN
+        self.dirty = True
 
     def simulate(self, timedelta: float):
         self.time_passed += timedelta
-        if self.time_passed >= DEFAULT_TIME_SWITCH:
+        if self.time_passed >= self.context.time_switch:
             self.time_passed = 0.0
             self.switch()
 
     def enable(self):
-        self.state = self.GREEN
+        if self.state != self.GREEN:
+            self.state = self.GREEN
+            self.dirty = True
 
     def disable(self):
-        self.state = self.RED
+        if self.state != self.RED:
+            self.state = self.RED
+            self.dirty = True
 
     def to_dict(self):
         return {
@@ -60,8 +65,6 @@ class Semaphore:
 
 
 class CrossRoad:
-    CROSS_ROAD_COUNT = 0
-
     ENABLED_X_LINES = 1
     ENABLED_Y_LINES = 2
     X_TYPE = 1  # Х-образный перекресток
@@ -78,31 +81,13 @@ class CrossRoad:
     x_vector_lines: List[DriveLine]
     y_vector_lines: List[DriveLine]
     state: int # enabled 1 - x_vector_lines, 2 - y_vector_lines
+    conflicts: List[int]  # для каждой полосы lines - битовая маска конфликтующих с ней полос
+    occupied: int  # битовая маска полос lines, на которых есть авто
     id: int
+    context: ModelContext
 
     def __init__(self, roads: List[RoadPart], position: Point):
-        count = len(roads)
-        if count < 3:
-            raise ValueError('Required at least 3 roads')
-        elif count == 3:
-            self.type = self.T_TYPE
-        elif count == 4:
-            self.type = self.X_TYPE
-        elif count > 4:
-            raise ValueError('Max roads is 4')
-
-        self.position = position
-        self.roads = roads
-        self.time_to_switch = DEFAULT_TIME_SWITCH
-
-        self.incoming_lines = []
-        self.outcoming_lines = []
-        self.y_vector_lines = []
-        self.x_vector_lines = []
-        self.lines = []
-        self.state = self.ENABLED_X_LINES
-        self.switch_time_passed = 0.0
-        self.id = CrossRoad.inc_cross_road_count()
+        self.init_state(roads, position)
 
         for i in range(len(self.roads)):
             road = self.roads[i]
@@ -142,15 +127,109 @@ class CrossRoad:
                 incoming_line.add_path(cross_line)
                 self.lines.append(cross_line)
 
+        self.build_conflicts()
         self.switch_state()
 
+    @classmethod
+    def from_lines(
+            cls,
+            roads: List[RoadPart],
+            position: Point,
+            incoming_lines: List[DriveLine],
+            outcoming_lines: List[DriveLine],
+            x_vector_lines: List[DriveLine],
+            y_vector_lines: List[DriveLine],
+            lines: List[DriveLine],
+    ) -> CrossRoad:
+        """
+        Перекресток с заранее вычисленными полосами: поиск входящих и исходящих полос не выполняется,
+        пути между полосами должны быть уже заданы
+        """
+        cross_road = cls.__new__(cls)
+        cross_road.init_state(roads, position)
+        cross_road.incoming_lines = incoming_lines
+        cross_road.outcoming_lines = outcoming_lines
+        cross_road.x_vector_lines = x_vector_lines
+        cross_road.y_vector_lines = y_vector_lines
+        cross_road.lines = lines
+        for i in range(len(incoming_lines)):
+            incoming_lines[i].set_semaphore(Semaphore(position=incoming_lines[i].line.p2))
+        cross_road.build_conflicts()
+        cross_road.switch_state()
+        return cross_road
+
+    def init_state(self, roads: List[RoadPart], position: Point):
+        count = len(roads)
+        if count < 3:
+            raise ValueError('Required at least 3 roads')
+        elif count == 3:
+            self.type = self.T_TYPE
+        elif count == 4:
+            self.type = self.X_TYPE
+        elif count > 4:
+            raise ValueError('Max roads is 4')
+
+        self.position = position
+        self.roads = roads
+        self.context = current_context()
+        self.time_to_switch = self.context.time_switch
+
+        self.incoming_lines = []
+        self.outcoming_lines = []
+        self.y_vector_lines = []
+        self.x_vector_lines = []
+        self.lines = []
+        self.conflicts = []
+        self.occupied = 0
+        self.state = self.ENABLED_X_LINES
+        self.switch_time_passed = 0.0
+        self.id = self.context.next_cross_road_id()
+        self.dirty = True  # светофоры переключались с момента последней публикации
+
+    def build_conflicts(self):
+        """
+        Матрица конфликтов движений по полосам перекрестка строится один раз; при въезде на полосу
+        проверяется только пересечение масок conflicts и occupied
+        """
+        count = len(self.lines)
+        self.conflicts = [0] * count
+        for i in range(count):
+            for j in range(i + 1, count):
+                if self.lines[i].is_conflict(self.lines[j]):
+                    self.conflicts[i] |= 1 << j
+                    self.conflicts[j] |= 1 << i
+        for i in range(count):
+            self.lines[i].cross_road = self
+            self.lines[i].conflict_bit = 1 << i
+            self.lines[i].conflict_mask = self.conflicts[i]
+        self.refresh_occupied()
+
+    def refresh_occupied(self):
+        """
+        Пересчет occupied по очередям полос (после замены очередей в обход add_car и release_car)
+        """
+        occupied = 0
+        for i in range(len(self.lines)):
+            if self.lines[i].queue:
+                occupied |= 1 << i
+        self.occupied = occupied
+
     def simulate(self, timedelta: float):
         for i in range(len(self.lines)):
             self.lines[i].simulate(timedelta=timedelta)
+        self.simulate_signals(timedelta)
+
+    def simulate_signals(self, timedelta: float) -> bool:
+        """
+        Отсчет времени до переключения светофоров, без движения авто по полосам перекрестка
+        :return: True, если светофоры переключились
+        """
         self.switch_time_passed += timedelta
         if self.switch_time_passed >= self.time_to_switch:
             self.switch_time_passed = 0.0
             self.switch_state()
+            return True
+        return False
 
     def get_cars(self):
         cars = []
@@ -160,6 +239,19 @@ class CrossRoad:
                 cars.append(queue[j].to_dict())
         return cars
 
+    def collect_changes(self, semaphores: list):
+        """
+        Собирает светофоры, переключившиеся с момента последнего вызова
+        """
+        if not self.dirty:
+            return
+        for i in range(len(self.incoming_lines)):
+            semaphore = self.incoming_lines[i].semaphore
+            if semaphore.dirty:
+                semaphores.append({'id': semaphore.id, 'state': semaphore.state})
+                semaphore.dirty = False
+        self.dirty = False
+
     def disable_lines(self, line_type):
         if line_type == self.ENABLED_X_LINES:
             for i in range(len(self.x_vector_lines)):
@@ -184,11 +276,7 @@ class CrossRoad:
             self.state = self.ENABLED_X_LINES
 
         self.enable_lines(self.state)
-
-    @classmethod
-    def inc_cross_road_count(cls):
-        cls.CROSS_ROAD_COUNT += 1
-        return cls.CROSS_ROAD_COUNT
+        self.dirty = True
 
     def to_dict(self):
         return {
@@ -201,32 +289,62 @@ class CrossRoad:
 
 
 class DriveLine:
+    __slots__ = (
+        'id', 'direction', 'road', 'line', 'start', 'length', 'line_vector', 'queue', 'auto_add_car', 'time_passed',
+        'paths', 'semaphore', 'dirty', 'removed_car_ids', 'spawned_count', 'removed_count', 'removed_wait_time',
+        'active_lanes', 'router', 'cross_road', 'conflict_bit', 'conflict_mask', 'mesoscopic', 'meso_time',
+        'meso_release_time', 'meso_arrived', 'context',
+    )
     direction: bool
     road: RoadPart
-    queue: List[Car]
+    queue: LaneQueue
     # line.p1 начало, line.p2 конец
     line: Line
-    line_vector: Point
+    line_vector: Point  # единичный вектор направления
+    start: Point
+    length: float
     auto_add_car: bool
     semaphore: Semaphore
     paths: List[DriveLine]
+    id: int
+    context: ModelContext  # контекст модели: id авто, выбор пути, пул авто и параметры движения
 
     def __init__(self, direction: bool, auto_add: bool = False, line: Line = None):
         """
         :param direction: направление движения полосы относительно участка дороги
         """
+        self.context = current_context()
+        self.id = self.context.next_drive_line_id()
         self.direction = direction
+        self.road = None
         self.line = line
-        self.line_vector = self.get_line_vector()
-        self.queue = []
+        self.update_geometry()
+        self.queue = LaneQueue()
         self.auto_add_car = auto_add
         self.time_passed = 0.0
         self.paths = []
         self.semaphore = None
+        self.dirty = False  # на полосе есть изменения с момента последней публикации
+        self.removed_car_ids = []  # авто, покинувшие модель с этой полосы
+        self.spawned_count = 0
+        self.removed_count = 0
+        self.removed_wait_time = 0.0  # суммарное время простоя авто, покинувших модель
+        # активные полосы движка (с авто или отсчетом времени до появления авто), None - не отслеживаются
+        self.active_lanes = None
+        self.router = None  # simulation.routing.Router, если авто едут к пунктам назначения
+        # для полос перекрестка: перекресток, бит полосы и биты конфликтующих полос (см. CrossRoad.build_conflicts)
+        self.cross_road = None
+        self.conflict_bit = 0
+        self.conflict_mask = 0
+        # мезоскопическая полоса: авто не движутся по шагам, а выезжают в рассчитанное при въезде время
+        self.mesoscopic = False
+        self.meso_time = 0.0  # время полосы, идет, пока полоса симулируется
+        self.meso_release_time = 0.0  # не раньше этого времени с полосы может выехать следующее авто
+        self.meso_arrived = 0  # авто от головного, доехавшие до конца полосы и ждущие выезда
 
     def set_road(self, road: RoadPart):
         self.road = road
-        self.queue = []
+        self.queue = LaneQueue()
         if self.direction:
             self.line = Line(road.line.p1, road.line.p2)
         else:
@@ -238,78 +356,287 @@ class DriveLine:
         x = 1.5 * (self.line_vector.x * math.cos(angle) - self.line_vector.y * math.sin(angle))
         y = 1.5 * (self.line_vector.y * math.cos(angle) + self.line_vector.x * math.sin(angle))
         self.line = Line(Point(self.line.p1.x + x, self.line.p1.y + y), Point(self.line.p2.x + x, self.line.p2.y + y))
+        self.update_geometry()
+
+    def set_geometry(self, line: Line, length: float, line_vector: Point):
+        """
+        Геометрия, вычисленная заранее (например, при компиляции сети)
+        """
+        self.line = line
+        self.start = line.p1
+        self.length = length
+        self.line_vector = line_vector
+
+    def update_geometry(self):
+        """
+        Геометрия полосы считается один раз: положение авто хранится как смещение от start вдоль line_vector
+        """
+        if self.line:
+            self.start = self.line.p1
+            self.length = self.line.distance()
+            self.line_vector = self.get_line_vector()
+        else:
+            self.start = None
+            self.length = 0.0
+            self.line_vector = None
 
     def set_semaphore(self, semaphore):
         self.semaphore = semaphore
 
     def get_line_vector(self):
+        """
+        :return: единичный вектор направления полосы
+        """
         if self.line:
             diff_x = self.line.p2.x - self.line.p1.x
             diff_y = self.line.p2.y - self.line.p1.y
-            vector_x = 1.0 if diff_x > 0 else 0 if diff_x == 0.0 else -1
-            vector_y = 1.0 if diff_y > 0 else 0 if diff_y == 0.0 else -1
-            return Point(vector_x, vector_y)
+            length = math.hypot(diff_x, diff_y)
+            if not length:
+                return Point(0.0, 0.0)
+            return Point(diff_x / length, diff_y / length)
         return None
 
     def can_recv(self):
-        if self.direction:
-            return not self.queue or Line(self.queue[-1].position, self.line.p1).distance() > DEFAULT_CAR_LENGTH
-        return not self.queue or Line(self.queue[-1].position, self.line.p1).distance() > DEFAULT_CAR_LENGTH
+        # на перекрестке нельзя въехать на полосу, пересекающую занятую полосу
+        if self.conflict_mask and self.cross_road.occupied & self.conflict_mask:
+            return False
+        if self.mesoscopic:
+            # вместимость полосы: авто, стоящие друг за другом на дистанции CAR_GAP
+            return len(self.queue) < max(1, int(self.length / CAR_GAP))
+        return self.queue.entry_gap(self.length) > DEFAULT_CAR_LENGTH
 
     def can_release(self):
         return not bool(self.semaphore) or self.semaphore.state == self.semaphore.GREEN
 
     def release_car(self):
-        return self.queue.pop(0)
+        self.dirty = True
+        car = self.queue.popleft()
+        if not self.queue:
+            if self.conflict_bit:
+                self.cross_road.occupied &= ~self.conflict_bit
+            if not self.auto_add_car and self.active_lanes is not None:
+                self.active_lanes.pop(self, None)
+        return car
+
+    def remove_car(self):
+        """
+        Авто покидает модель (конец тупиковой полосы), объект авто возвращается в пул
+        """
+        car = self.release_car()
+        self.removed_car_ids.append(car.id)
+        self.removed_count += 1
+        self.removed_wait_time += car.wait_time
+        Car.recycle(car)
 
     def simulate(self, timedelta: float):
-        for i in range(len(self.queue)):
-            if i + 1 <= len(self.queue):
-                car = self.queue[i]
-                car.simulate(timedelta=timedelta, queue_position=i)
+        self.simulate_cars(timedelta)
         if self.auto_add_car:
             self.time_passed += timedelta
-            if self.time_passed >= 10.0:
+            if self.time_passed >= self.context.spawn_interval:
                 self.time_passed = 0.0
                 if self.can_recv():
-                    self.queue.append(
-                        Car(
-                            position=self.line.p1,
-                            drive_line=self,
-                        )
-                    )
+                    self.spawn_car()
+
+    def simulate_cars(self, timedelta: float):
+        """
+        Движение авто по полосе, без отсчета времени до появления нового авто
+        """
+        if self.mesoscopic:
+            self.simulate_meso(timedelta)
+            return
+        queue = self.queue
+        for i in range(len(queue.cars) - queue.head):
+            # головное авто могло уехать с полосы: индексы отсчитываются от нового головного авто
+            if queue.head + i < len(queue.cars):
+                car = queue.cars[queue.head + i]
+                car.simulate(timedelta=timedelta, queue_position=i)
+
+    def simulate_meso(self, timedelta: float):
+        """
+        Шаг мезоскопической полосы: проверяется только головное авто и авто, доехавшие до конца полосы
+        """
+        self.meso_time += timedelta
+        now = self.meso_time
+        queue = self.queue
+        while queue.head < len(queue.cars) and now >= self.meso_release_time:
+            car = queue.cars[queue.head]
+            if car.exit_time > now:
+                break
+            # простой до текущего момента начисляется сразу, даже если выехать не получится
+            car.wait_time += now - car.exit_time
+            car.exit_time = now
+            if not car.leave_line(self):
+                break
+            if self.meso_arrived:
+                self.meso_arrived -= 1
+            self.meso_release_time = now + self.context.meso_headway
+        # доехавшие до конца полосы авто стоят в очереди на выезд
+        cars = queue.cars
+        i = queue.head + self.meso_arrived
+        while i < len(cars) and cars[i].exit_time <= now:
+            cars[i].state = Car.STATE_STOPPED
+            cars[i].speed = 0.0
+            self.meso_arrived += 1
+            i += 1
+
+    def set_mesoscopic(self, enabled: bool):
+        """
+        Переключает полосу между мезоскопической и поштучной (микроскопической) симуляцией авто
+        """
+        if enabled == self.mesoscopic:
+            return
+        if enabled:
+            self.mesoscopic = True
+            self.aggregate_cars()
+        else:
+            self.place_cars()
+            self.mesoscopic = False
+
+    def aggregate_cars(self):
+        """
+        Время выезда авто полосы по их положению: оставшийся путь с наибольшей скоростью контекста
+        """
+        self.meso_arrived = 0
+        self.meso_release_time = self.meso_time
+        car_speed = self.context.car_speed
+        for car in self.queue:
+            car.exit_time = self.meso_time + max(0.0, self.length - car.offset) / car_speed
+            if car.exit_time > self.meso_time:
+                car.state = Car.STATE_RUNNING
+                car.speed = car_speed
+
+    def meso_positions(self):
+        """
+        Положение авто по времени выезда без изменения полосы и авто (см. place_cars)
+        :return: для каждого авто очереди (offset, speed, state, delay_passed, wait_time)
+        """
+        now = self.meso_time
+        limit = self.length
+        car_speed = self.context.car_speed
+        positions = []
+        for car in self.queue:
+            remaining = car.exit_time - now
+            if remaining > 0.0:
+                offset = self.length - remaining * car_speed
+                position = (car_speed, Car.STATE_RUNNING, car.delay_passed, car.wait_time)
+            else:
+                offset = self.length
+                position = (0.0, Car.STATE_STOPPED, 0.0, car.wait_time - remaining)
+            offset = max(0.0, min(offset, limit))
+            positions.append((offset,) + position)
+            limit = offset - CAR_GAP
+        return positions
+
+    def place_cars(self):
+        """
+        Положение авто по времени выезда: едущие авто - на оставшемся до конца полосы пути,
+        ждущие выезда - друг за другом у конца полосы
+        """
+        now = self.meso_time
+        positions = self.meso_positions()
+        i = 0
+        for car in self.queue:
+            car.offset, car.speed, car.state, car.delay_passed, car.wait_time = positions[i]
+            if car.exit_time < now:
+                car.exit_time = now
+            car.dirty = True
+            i += 1
+        self.meso_arrived = 0
+        self.dirty = True
+
+    def spawn_car(self, destination: DriveLine = None):
+        """
+        :param destination: полоса-выезд, к которой едет авто; None - выбирает маршрутизатор, если он есть
+        """
+        car = Car.acquire(drive_line=self)
+        if destination is not None:
+            car.destination = destination
+        elif self.router is not None:
+            car.destination = self.router.choose_destination(self)
+        self.add_car(car)
+        self.spawned_count += 1
 
     def add_car(self, car: Car):
         if self.can_recv():
+            if self.mesoscopic:
+                car.exit_time = self.meso_time + self.length / self.context.car_speed
+                car.state = Car.STATE_RUNNING
+                car.speed = self.context.car_speed
             self.queue.append(car)
+            car.dirty = True
+            self.dirty = True
+            if self.conflict_bit:
+                self.cross_road.occupied |= self.conflict_bit
+            if self.active_lanes is not None:
+                self.active_lanes[self] = None
         else:
             raise ValueError('Check before add!!!')
 
+    def collect_changes(self, spawned: list, moved: list, removed: list):
+        """
+        Собирает изменения полосы с момента последнего вызова и сбрасывает признаки изменений
+        """
+        if not self.dirty:
+            return
+        for car in self.queue:
+            if car.dirty:
+                if car.spawned:
+                    spawned.append(car.to_dict())
+                    car.spawned = False
+                else:
+                    moved.append(car.to_dict())
+                car.dirty = False
+        if self.removed_car_ids:
+            removed.extend(self.removed_car_ids)
+            self.removed_car_ids = []
+        self.dirty = False
+
     def add_path(self, drive_line: DriveLine):
         self.paths.append(drive_line)
 
     def is_intersect(self, line2: DriveLine):
-        xdiff = (self.line.p1.x - self.line.p2.x, line2.line.p1.x - line2.line.p2.x)
-        ydiff = (self.line.p1.y - self.line.p2.y, line2.line.p1.y - line2.line.p2.y)
-
-        def det(a, b):
-            return a[0] * b[1] - a[1] * b[0]
+        """
+        Пересекаются ли отрезки полос; касание концом тоже считается пересечением
+        """
+        p1, p2 = self.line.p1, self.line.p2
+        q1, q2 = line2.line.p1, line2.line.p2
+
+        def orientation(a, b, c):
+            value = (b.x - a.x) * (c.y - a.y) - (b.y - a.y) * (c.x - a.x)
+            if math.fabs(value) < GEOMETRY_EPSILON:
+                return 0
+            return 1 if value > 0 else -1
+
+        def on_segment(a, b, c):
+            # c лежит на прямой ab; проверяется, что c между a и b
+            return (
+                min(a.x, b.x) - GEOMETRY_EPSILON <= c.x <= max(a.x, b.x) + GEOMETRY_EPSILON
+                and min(a.y, b.y) - GEOMETRY_EPSILON <= c.y <= max(a.y, b.y) + GEOMETRY_EPSILON
+            )
 
-        div = det(xdiff, ydiff)
-        if div == 0:
+        o1 = orientation(p1, p2, q1)
+        o2 = orientation(p1, p2, q2)
+        o3 = orientation(q1, q2, p1)
+        o4 = orientation(q1, q2, p2)
+        if o1 != o2 and o3 != o4:
+            return True
+        return (
+            (not o1 and on_segment(p1, p2, q1)) or (not o2 and on_segment(p1, p2, q2))
+            or (not o3 and on_segment(q1, q2, p1)) or (not o4 and on_segment(q1, q2, p2))
+        )
+
+    def is_conflict(self, line2: DriveLine):
+        """
+        Конфликт движений по полосам перекрестка: пути пересекаются или сливаются; полосы,
+        расходящиеся с одной входящей полосы, не конфликтуют
+        """
+        start, start2 = self.line.p1, line2.line.p1
+        if math.fabs(start.x - start2.x) < GEOMETRY_EPSILON and math.fabs(start.y - start2.y) < GEOMETRY_EPSILON:
             return False
-        return True
-        # d = (
-        #     det((self.line.p1.x, self.line.p1.y), (self.line.p2.x, self.line.p2.y)),
-        #     det((line2.line.p1.x, line2.line.p1.y), (self.line.p2.x, self.line.p2.y))
-        # )
-        # x = det(d, xdiff) / div
-        # y = det(d, ydiff) / div
-        # return Point(x, y)
+        return self.is_intersect(line2)
 
 
 class RoadPart:
-    ROAD_COUNT = 0
     line: Line
     forward_road_lines: List[DriveLine]
     backward_road_lines: List[DriveLine]
@@ -317,6 +644,7 @@ class RoadPart:
     width: float
     id: int
     rotation_angle: float
+    context: ModelContext
 
     def __init__(
             self,
@@ -324,16 +652,19 @@ class RoadPart:
             point_2: Point,
             lines: List[DriveLine] = [],
             auto_create_for_direction=None,
-            rotation_angle=None
+            rotation_angle=None,
+            place_lines: bool = True,
     ):
         """
         :param lines: полосы движения назад
         :param length: длина в метрах
+        :param place_lines: сместить переданные полосы от центра дороги; False - полосы уже расположены
         """
         self.forward_road_lines = []
         self.backward_road_lines = []
         self.rotation_angle = rotation_angle
-        self.id = RoadPart.inc_road_count()
+        self.context = current_context()
+        self.id = self.context.next_road_id()
         if lines:
             for line in lines:
                 if line.direction:
@@ -352,15 +683,11 @@ class RoadPart:
         self.width = (len(self.forward_road_lines) + len(self.backward_road_lines)) * 2.5
         self.length = self.line.distance()
 
-        for line in self.forward_road_lines:
-            line.set_road(road=self)
-        for line in self.backward_road_lines:
-            line.set_road(road=self)
-
-    @classmethod
-    def inc_road_count(cls):
-        cls.ROAD_COUNT += 1
-        return cls.ROAD_COUNT
+        for line in self.forward_road_lines + self.backward_road_lines:
+            if place_lines:
+                line.set_road(road=self)
+            else:
+                line.road = self
 
     def get_direction_lines(self, direction: bool) -> List[DriveLine]:
         if direction:
@@ -4,3 +4,47 @@ env = os.environ
 
 REDIS_HOST = env.get('REDIS_HOST', 'localhost')
 REDIS_PORT = env.get('REDIS_PORT', '6379')
+# 1 - объектный движок, 2 - векторизованный движок на NumPy, 3 - событийный движок (см. CityModel.ENGINE_*)
+SIMULATION_ENGINE = int(env.get('SIMULATION_ENGINE', '1'))
+# full - полный снимок в traffic_model_data на каждом шаге, binary - бинарный кадр в traffic_model_frame,
+# delta - топология один раз и изменения по шагам
+PUBLISH_MODE = env.get('PUBLISH_MODE', 'full')
+# 1 - реальное время, 2 - ускорение в SIMULATION_SPEED раз, 3 - без ожидания (см. Scheduler.MODE_*)
+SIMULATION_MODE = int(env.get('SIMULATION_MODE', '1'))
+SIMULATION_SPEED = float(env.get('SIMULATION_SPEED', '1.0'))
+SIMULATION_STEP = float(env.get('SIMULATION_STEP', str(1 / 60)))
+PUBLISH_RATE = float(env.get('PUBLISH_RATE', '60.0'))
+# 1 - отправка в Redis из отдельного потока с очередью на PUBLISH_QUEUE_SIZE кадров (simulation.publishing)
+PUBLISH_ASYNC = env.get('PUBLISH_ASYNC', '1') == '1'
+PUBLISH_QUEUE_SIZE = int(env.get('PUBLISH_QUEUE_SIZE', '4'))
+REDIS_MAX_CONNECTIONS = int(env.get('REDIS_MAX_CONNECTIONS', '4'))
+# каталог с результатами пакетных запусков (simulation.runner)
+RUNNER_CACHE_DIR = env.get('RUNNER_CACHE_DIR', '.cache/runs')
+# каталог со скомпилированными сетями дорог (simulation.network)
+NETWORK_CACHE_DIR = env.get('NETWORK_CACHE_DIR', '.cache/networks')
+# JSON-описание сети дорог, пустое значение - встроенный город (simulation.scenarios.build_default_city)
+NETWORK_FILE = env.get('NETWORK_FILE', '')
+# количество процессов-участков для сети из NETWORK_FILE (simulation.sharding), 1 - без разбиения
+SIMULATION_SHARDS = int(env.get('SIMULATION_SHARDS', '1'))
+# 1 - новые авто едут к случайному выезду из модели по таблицам маршрутизации (simulation.routing)
+ROUTING_ENABLED = env.get('ROUTING_ENABLED', '0') == '1'
+# JSON-описание спроса (simulation.demand) вместо появления авто раз в 10 секунд, пустое значение - без него
+DEMAND_FILE = env.get('DEMAND_FILE', '')
+# файл сети neural.core.Network для переключения светофоров (simulation.signals), пустое значение - по таймеру
+SIGNAL_NETWORK_FILE = env.get('SIGNAL_NETWORK_FILE', '')
+# файл контрольной точки (simulation.checkpoint): восстанавливается при запуске, если есть, и сохраняется
+# при остановке; пустое значение - без контрольных точек
+CHECKPOINT_FILE = env.get('CHECKPOINT_FILE', '')
+# файл записи хода симуляции (simulation.trace), кадры пишутся с частотой публикации; пустое значение - без записи
+TRACE_FILE = env.get('TRACE_FILE', '')
+# 1 - замеры времени фаз шага (simulation.metrics): ключ traffic_model_metrics в Redis и HTTP на METRICS_PORT
+METRICS_ENABLED = env.get('METRICS_ENABLED', '0') == '1'
+METRICS_HOST = env.get('METRICS_HOST', '127.0.0.1')
+# 0 - без HTTP-сервера
+METRICS_PORT = int(env.get('METRICS_PORT', '9100'))
+# 1 - кадры областей просмотра клиентов из хеша traffic_model_viewports (simulation.viewports)
+VIEWPORTS_ENABLED = env.get('VIEWPORTS_ENABLED', '0') == '1'
+# размер ячейки сетки пространственного индекса полос
+VIEWPORT_CELL_SIZE = float(env.get('VIEWPORT_CELL_SIZE', '100.0'))
+# 1 - полосы вне областей просмотра симулируются мезоскопически (simulation.detail), нужен VIEWPORTS_ENABLED
+LEVEL_OF_DETAIL = env.get('LEVEL_OF_DETAIL', '0') == '1'
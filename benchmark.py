@@ -0,0 +1,187 @@
+"""
+Замер производительности ядра симуляции на сетках разного размера и плотности.
+
+Для каждого сочетания сетки, плотности и движка измеряются шаги в секунду, перцентили
+времени шага, стоимость to_dict + json.dumps и to_frame, а также память на одно авто
+(по tracemalloc и по оценке simulation.memory) и на одну полосу.
+Результаты записываются в JSON; при указании --baseline выводится сравнение с сохраненным запуском.
+
+    python benchmark.py --grids 5x5 10x10 --densities 0.2 0.5 --engines 1 2 --output bench_results.json
+    python benchmark.py --baseline bench_results.json
+"""
+import argparse
+import datetime
+import gc
+import json
+import platform
+import random
+import time
+import tracemalloc
+
+import numpy as np
+
+from simulation import CityModel
+from simulation.memory import memory_report
+from simulation.scenarios import build_grid_city, populate_city
+
+BENCHMARK_VERSION = 1
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def build(rows, cols, density, engine, seed):
+    random.seed(seed)
+    model = build_grid_city(rows, cols, engine=engine, seed=seed)
+    populate_city(model, density)
+    return model
+
+
+def measure_memory(rows, cols, density, engine, seed, step):
+    """
+    :return: байт на одно авто (авто создаются и переносятся в движок при отслеживании выделений)
+    """
+    model = build_grid_city(rows, cols, engine=engine, seed=seed)
+    model.simulate(timedelta=step)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    cars = populate_city(model, density)
+    model.simulate(timedelta=step)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / cars if cars else 0.0
+
+
+def run_case(rows, cols, density, engine, ticks, warmup, step, seed, serialize_samples):
+    model = build(rows, cols, density, engine, seed)
+    for _ in range(warmup):
+        model.simulate(timedelta=step)
+
+    tick_times = []
+    gc.collect()
+    started = time.perf_counter()
+    for _ in range(ticks):
+        tick_started = time.perf_counter()
+        model.simulate(timedelta=step)
+        tick_times.append(time.perf_counter() - tick_started)
+    elapsed = time.perf_counter() - started
+
+    to_dict_times = []
+    json_times = []
+    frame_times = []
+    for _ in range(serialize_samples):
+        t0 = time.perf_counter()
+        data = model.to_dict()
+        t1 = time.perf_counter()
+        json.dumps(data)
+        t2 = time.perf_counter()
+        model.to_frame()
+        t3 = time.perf_counter()
+        to_dict_times.append(t1 - t0)
+        json_times.append(t2 - t1)
+        frame_times.append(t3 - t2)
+
+    stats = model.stats()
+    memory = memory_report(model)
+    return {
+        'grid': '{}x{}'.format(rows, cols),
+        'density': density,
+        'engine': engine,
+        'cars': stats['cars'],
+        'lanes': len(model.get_drive_lines()),
+        'ticks': ticks,
+        'ticks_per_sec': ticks / elapsed if elapsed else 0.0,
+        'tick_ms': {
+            'p50': percentile(tick_times, 50) * 1e3,
+            'p90': percentile(tick_times, 90) * 1e3,
+            'p99': percentile(tick_times, 99) * 1e3,
+            'max': max(tick_times) * 1e3 if tick_times else 0.0,
+        },
+        'to_dict_ms': percentile(to_dict_times, 50) * 1e3,
+        'json_ms': percentile(json_times, 50) * 1e3,
+        'frame_ms': percentile(frame_times, 50) * 1e3,
+        'memory_per_car': measure_memory(rows, cols, density, engine, seed, step),
+        'bytes_per_car': memory['bytes_per_car'],
+        'bytes_per_lane': memory['bytes_per_lane'],
+    }
+
+
+def case_key(result):
+    return result['grid'], result['density'], result['engine']
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: количество случаев, где шагов в секунду стало меньше более чем на tolerance
+    """
+    previous = {case_key(result): result for result in baseline['results']}
+    regressions = 0
+    for result in results:
+        old = previous.get(case_key(result))
+        if not old or not old['ticks_per_sec']:
+            continue
+        ratio = result['ticks_per_sec'] / old['ticks_per_sec']
+        mark = ''
+        if ratio < 1.0 - tolerance:
+            mark = ' REGRESSION'
+            regressions += 1
+        print('{} density={} engine={}: {:.1f} -> {:.1f} ticks/s ({:+.1%}){}'.format(
+            result['grid'], result['density'], result['engine'],
+            old['ticks_per_sec'], result['ticks_per_sec'], ratio - 1.0, mark,
+        ))
+    return regressions
+
+
+parser = argparse.ArgumentParser(description='Замер производительности ядра симуляции')
+parser.add_argument('--grids', nargs='+', default=['2x2', '5x5', '10x10'], help='размеры сеток, RxC')
+parser.add_argument('--densities', type=float, nargs='+', default=[0.1, 0.5])
+parser.add_argument('--engines', type=int, nargs='+', default=[CityModel.ENGINE_OBJECT, CityModel.ENGINE_NUMPY])
+parser.add_argument('--ticks', type=int, default=600)
+parser.add_argument('--warmup', type=int, default=60)
+parser.add_argument('--step', type=float, default=1 / 60)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--serialize-samples', type=int, default=20)
+parser.add_argument('--output', default='bench_results.json')
+parser.add_argument('--baseline', help='сохраненный ранее файл результатов для сравнения')
+parser.add_argument('--tolerance', type=float, default=0.1, help='допустимое снижение шагов в секунду')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    results = []
+    for grid in args.grids:
+        rows, cols = [int(value) for value in grid.lower().split('x')]
+        for density in args.densities:
+            for engine in args.engines:
+                result = run_case(
+                    rows, cols, density, engine, args.ticks, args.warmup, args.step, args.seed,
+                    args.serialize_samples,
+                )
+                results.append(result)
+                print(
+                    '{grid} density={density} engine={engine}: cars={cars} {ticks_per_sec:.1f} ticks/s '
+                    'p99={p99:.3f}ms to_dict={to_dict_ms:.3f}ms json={json_ms:.3f}ms frame={frame_ms:.3f}ms '
+                    'mem/car={memory_per_car:.0f}B car={bytes_per_car:.0f}B lane={bytes_per_lane:.0f}B'.format(
+                        p99=result['tick_ms']['p99'], **result
+                    )
+                )
+
+    report = {
+        'version': BENCHMARK_VERSION,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if baseline and compare(results, baseline, args.tolerance):
+        raise SystemExit(1)
@@ -1,96 +1,110 @@
-import json
-import math
-import time
+import os
+import signal
 
 import redis
 
 from bases import settings
-from bases.road import DriveLine, RoadPart, CrossRoad
-from bases.car import Car
-from utils import gen_lines_around
-from bases.primitives import Point, Line
-from time import sleep
-from simulation import CityModel
-
-roads = [
-    RoadPart(point_1=Point(2.5, 0.0), point_2=Point(17.5, 0.0)),
-    RoadPart(point_1=Point(-2.5, 0.0), point_2=Point(-17.5, 0.0), auto_create_for_direction=False),
-    RoadPart(
-        point_1=Point(x=0.0, y=-2.5),
-        point_2=Point(x=0.0, y=-17.5),
-        rotation_angle=math.pi/2,
-    ),
-    RoadPart(
-        point_1=Point(x=0.0, y=2.5),
-        point_2=Point(x=0.0, y=17.5),
-        rotation_angle=-math.pi/2,
-    ),
-]
-
-line1, line2, line3, line4 = gen_lines_around(Point(0.0, 20.0))
-roads.append(RoadPart(point_1=line1.p1, point_2=line1.p2))  # 4
-roads.append(RoadPart(point_1=line2.p1, point_2=line2.p2, auto_create_for_direction=False))  # 5
-roads.append(RoadPart(point_1=line4.p1, point_2=line4.p2, auto_create_for_direction=False, rotation_angle=math.pi/2))  # 6
-
-line1, line2, line3, line4 = gen_lines_around(Point(0.0, -20.0))
-
-roads.append(RoadPart(point_1=line1.p1, point_2=line1.p2, auto_create_for_direction=False))  # 7
-roads.append(RoadPart(point_1=line2.p1, point_2=line2.p2, auto_create_for_direction=False))  # 8
-roads.append(RoadPart(point_1=line3.p1, point_2=line3.p2, auto_create_for_direction=False, rotation_angle=math.pi/2))  # 9
-
-line1, line2, line3, line4 = gen_lines_around(Point(20.0, 0.0))
-
-roads.append(RoadPart(point_1=line1.p1, point_2=line1.p2, auto_create_for_direction=False))  # 10
-roads.append(RoadPart(point_1=line3.p1, point_2=line3.p2, rotation_angle=math.pi/2))  # 11
-roads.append(RoadPart(point_1=line4.p1, point_2=line4.p2, rotation_angle=math.pi/2))  # 12
-
-line1, line2, line3, line4 = gen_lines_around(Point(20.0, 20.0))
-
-roads.append(RoadPart(point_1=line1.p1, point_2=line1.p2, auto_create_for_direction=False))  # 13
-roads.append(
-    RoadPart(
-        point_1=line4.p1, point_2=line4.p2, auto_create_for_direction=False, rotation_angle=math.pi/2
-    )
-)  # 14
-
-for i in range(len(roads)):
-    road = roads[i]
-    if road.line.p1.x in [17.5, 2.5] and road.line.p2.x in [2.5, 17.5] and road.line.p1.y in [20.0]:
-        print(i)
-
-
-cross_roads = [
-    CrossRoad(position=Point(0.0, 0.0), roads=[roads[0], roads[1], roads[2], roads[3]]),
-    CrossRoad(position=Point(0.0, 20.0), roads=[roads[3], roads[4], roads[5], roads[6]]),
-    CrossRoad(position=Point(0.0, -20.0), roads=[roads[2], roads[7], roads[8], roads[9]]),
-    CrossRoad(position=Point(20.0, 0.0), roads=[roads[0], roads[10], roads[11], roads[12]]),
-    CrossRoad(position=Point(20.0, 20.0), roads=[roads[13], roads[4], roads[12], roads[14]]),
-]
-
-simulation_model = CityModel()
-for i in range(len(roads)):
-    simulation_model.add_road(roads[i])
-
-for i in range(len(cross_roads)):
-    simulation_model.add_cross_road(cross_roads[i])
-
-redis_instance = redis.StrictRedis(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+from neural.core import Network
+from simulation.checkpoint import save_checkpoint, load_checkpoint
+from simulation.demand import load_demand
+from simulation.detail import LevelOfDetail
+from simulation.metrics import Metrics, MetricsServer
+from simulation.network import load_network
+from simulation.scenarios import build_default_city
+from simulation.sharding import load_sharded_network
+from simulation.scheduler import Scheduler
+from simulation.publishing import FullPublisher, BinaryPublisher, DeltaPublisher, AsyncPublisher
+from simulation.trace import TraceRecorder
+from simulation.viewports import ViewportPublisher
+
+if settings.CHECKPOINT_FILE and settings.NETWORK_FILE and settings.SIMULATION_SHARDS > 1:
+    # состояние участков хранится в их процессах, ShardedEngine не поддерживает контрольные точки
+    raise ValueError('CHECKPOINT_FILE is not supported with SIMULATION_SHARDS > 1')
+if settings.NETWORK_FILE and settings.SIMULATION_SHARDS > 1:
+    simulation_model = load_sharded_network(settings.NETWORK_FILE, shards=settings.SIMULATION_SHARDS)
+elif settings.NETWORK_FILE:
+    simulation_model = load_network(settings.NETWORK_FILE, engine=settings.SIMULATION_ENGINE)
+else:
+    simulation_model = build_default_city(engine=settings.SIMULATION_ENGINE)
+if settings.ROUTING_ENABLED:
+    simulation_model.enable_routing()
+if settings.SIGNAL_NETWORK_FILE:
+    simulation_model.enable_signal_control(Network.load(settings.SIGNAL_NETWORK_FILE))
+if settings.CHECKPOINT_FILE and os.path.exists(settings.CHECKPOINT_FILE):
+    load_checkpoint(simulation_model, settings.CHECKPOINT_FILE)
+# расписание спроса считается с восстановленного модельного времени
+if settings.DEMAND_FILE:
+    simulation_model.set_demand(load_demand(settings.DEMAND_FILE, simulation_model))
+
+redis_pool = redis.ConnectionPool(
+    host=settings.REDIS_HOST, port=settings.REDIS_PORT, max_connections=settings.REDIS_MAX_CONNECTIONS
+)
+redis_instance = redis.StrictRedis(connection_pool=redis_pool)
 redis_instance.delete('cars')
-
-current_time = 0.0
-prev_time = 0.0
-
-while True:
-    current_time = time.perf_counter_ns() * 1e-9
-    simulation_model.simulate(timedelta=current_time - prev_time)
-    prev_time = current_time
-    simulation_model_dict = simulation_model.to_dict()
-
-    redis_instance.set(
-        'traffic_model_data',
-        json.dumps(simulation_model_dict)
-    )
-    sleep_time = 0.167 - time.perf_counter_ns() - current_time
-    if sleep_time > 0.0:
-        sleep(sleep_time)
-        # симуляция 60 раз в секунду
+metrics = None
+metrics_server = None
+if settings.METRICS_ENABLED:
+    metrics = Metrics(redis_instance)
+    metrics.watch_gc()
+    simulation_model.set_metrics(metrics)
+    if settings.METRICS_PORT:
+        metrics_server = MetricsServer(metrics, host=settings.METRICS_HOST, port=settings.METRICS_PORT)
+        metrics_server.start()
+if settings.PUBLISH_MODE == 'delta':
+    publisher = DeltaPublisher(redis_instance, metrics=metrics)
+elif settings.PUBLISH_MODE == 'binary':
+    publisher = BinaryPublisher(redis_instance, metrics=metrics)
+else:
+    publisher = FullPublisher(redis_instance, metrics=metrics)
+publishers = [publisher]
+if settings.VIEWPORTS_ENABLED:
+    level_of_detail = LevelOfDetail(simulation_model) if settings.LEVEL_OF_DETAIL else None
+    publishers.append(ViewportPublisher(
+        redis_instance, cell_size=settings.VIEWPORT_CELL_SIZE, metrics=metrics, level_of_detail=level_of_detail
+    ))
+if settings.PUBLISH_ASYNC:
+    publishers = [
+        AsyncPublisher(publisher, redis_instance, queue_size=settings.PUBLISH_QUEUE_SIZE) for publisher in publishers
+    ]
+recorder = None
+if settings.TRACE_FILE:
+    recorder = TraceRecorder(settings.TRACE_FILE)
+
+
+def publish(model):
+    if recorder:
+        recorder.record(model)
+    for publisher in publishers:
+        publisher.publish(model)
+
+
+scheduler = Scheduler(
+    simulation_model,
+    step=settings.SIMULATION_STEP,
+    mode=settings.SIMULATION_MODE,
+    speed=settings.SIMULATION_SPEED,
+    publish=publish,
+    publish_rate=settings.PUBLISH_RATE,
+    metrics=metrics,
+)
+# остановка по SIGTERM (например, при перезапуске) завершает шаг и сохраняет контрольную точку
+signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+try:
+    scheduler.run()
+finally:
+    # ошибка сохранения не должна оставлять потоки публикации, записи и метрик незавершенными
+    try:
+        if settings.CHECKPOINT_FILE:
+            save_checkpoint(simulation_model, settings.CHECKPOINT_FILE)
+    finally:
+        if settings.PUBLISH_ASYNC:
+            for publisher in publishers:
+                publisher.close()
+        if recorder:
+            recorder.close()
+        if metrics_server:
+            metrics_server.close()
+        if metrics:
+            metrics.close()
+        # процессы участков завершаются последними: публикация и метрики могли обращаться к модели
+        simulation_model.close()
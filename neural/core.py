@@ -1,4 +1,36 @@
+"""
+Полносвязная сеть прямого распространения.
+
+Веса и смещения всех слоев хранятся в одном непрерывном массиве Network.params, у слоев -
+представления (view) его частей. Поэтому сеть сохраняется и загружается одной записью/чтением,
+а вход - матрица (пример x признак), так что все примеры считаются одним умножением на слой.
+"""
+import json
 import random
+import struct
+from typing import List
+
+import numpy as np
+
+
+def relu(x):
+    return np.maximum(x, 0.0)
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def identity(x):
+    return x
+
+
+ACTIVATIONS = {
+    'relu': relu,
+    'sigmoid': sigmoid,
+    'tanh': np.tanh,
+    'identity': identity,
+}
 
 
 class Layer:
@@ -7,11 +39,16 @@ class Layer:
     TYPE_OUTPUT = 3
 
     def __init__(self, l_type, count, activation_func=None):
+        """
+        :param activation_func: имя функции из ACTIVATIONS, функция или None (без активации)
+        """
         self.l_type = l_type
-        if self.l_type == self.TYPE_HIDDEN:
-            self.weights = [random.uniform(0.0, 1.0) for _ in range(0, count)]
+        if isinstance(activation_func, str):
+            activation_func = ACTIVATIONS[activation_func]
         self.activation_func = activation_func
         self.count = count
+        self.weights = None  # (количество нейронов предыдущего слоя, count), часть Network.params
+        self.biases = None  # (count,), часть Network.params
         self.values = []
         self.results = []
         self.next = None
@@ -24,3 +61,114 @@ class Layer:
 
     def set_next_layer(self, layer):
         self.next = layer
+
+    def parameters_count(self, previous_count: int):
+        return previous_count * self.count + self.count
+
+    def bind(self, params: np.ndarray, previous_count: int):
+        """
+        Привязывает веса и смещения слоя к началу params
+        """
+        size = previous_count * self.count
+        self.weights = params[:size].reshape(previous_count, self.count)
+        self.biases = params[size:size + self.count]
+
+    def forward(self, values: np.ndarray):
+        """
+        :param values: (количество примеров, количество нейронов предыдущего слоя)
+        """
+        self.values = values
+        results = values @ self.weights + self.biases
+        if self.activation_func:
+            results = self.activation_func(results)
+        self.results = results
+        return results
+
+
+class Network:
+    FILE_MAGIC = b'TMNN'
+    FILE_VERSION = 1
+    FILE_HEADER = '<4sHI'  # magic, версия, длина описания сети в JSON
+
+    layers: List[Layer]
+    params: np.ndarray
+
+    def __init__(self, sizes: List[int], activations: List[str] = None, dtype=np.float32, seed: int = None):
+        """
+        :param sizes: количество нейронов в слоях, начиная с входного
+        :param activations: имена функций из ACTIVATIONS для каждого слоя после входного
+        """
+        if len(sizes) < 2:
+            raise ValueError('Required at least input and output layers')
+        if activations is None:
+            activations = ['tanh'] * (len(sizes) - 2) + ['sigmoid']
+        if len(activations) != len(sizes) - 1:
+            raise ValueError('Required activation for every layer except input')
+        self.sizes = list(sizes)
+        self.activations = list(activations)
+        self.layers = [Layer(Layer.TYPE_INPUT, sizes[0])]
+        for i in range(1, len(sizes)):
+            l_type = Layer.TYPE_OUTPUT if i == len(sizes) - 1 else Layer.TYPE_HIDDEN
+            layer = Layer(l_type, sizes[i], activations[i - 1])
+            self.layers[-1].set_next_layer(layer)
+            self.layers.append(layer)
+
+        total = 0
+        for i in range(1, len(self.layers)):
+            total += self.layers[i].parameters_count(sizes[i - 1])
+        rng = np.random.default_rng(seed if seed is not None else random.getrandbits(32))
+        self.params = np.empty(total, dtype=dtype)
+        self.bind()
+        for i in range(1, len(self.layers)):
+            # равномерная инициализация с масштабом 1 / sqrt(входов слоя)
+            scale = 1.0 / np.sqrt(sizes[i - 1])
+            self.layers[i].weights[:] = rng.uniform(-scale, scale, self.layers[i].weights.shape)
+            self.layers[i].biases[:] = 0.0
+
+    def bind(self):
+        offset = 0
+        for i in range(1, len(self.layers)):
+            size = self.layers[i].parameters_count(self.sizes[i - 1])
+            self.layers[i].bind(self.params[offset:offset + size], self.sizes[i - 1])
+            offset += size
+
+    def set_params(self, params: np.ndarray):
+        """
+        Заменяет все веса сразу (например, при обучении или загрузке)
+        """
+        if params.shape != self.params.shape:
+            raise ValueError('Wrong parameters count')
+        self.params[:] = params
+
+    def forward(self, inputs) -> np.ndarray:
+        """
+        :param inputs: (количество примеров, sizes[0])
+        :return: (количество примеров, sizes[-1])
+        """
+        values = np.asarray(inputs, dtype=self.params.dtype)
+        self.layers[0].input_values(values)
+        for i in range(1, len(self.layers)):
+            values = self.layers[i].forward(values)
+        return values
+
+    def save(self, path: str):
+        description = json.dumps({
+            'sizes': self.sizes,
+            'activations': self.activations,
+            'dtype': self.params.dtype.str,
+        }).encode()
+        with open(path, 'wb') as f:
+            f.write(struct.pack(self.FILE_HEADER, self.FILE_MAGIC, self.FILE_VERSION, len(description)))
+            f.write(description)
+            f.write(self.params.tobytes())
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, 'rb') as f:
+            magic, version, length = struct.unpack(cls.FILE_HEADER, f.read(struct.calcsize(cls.FILE_HEADER)))
+            if magic != cls.FILE_MAGIC or version != cls.FILE_VERSION:
+                raise ValueError('Unknown network file format')
+            description = json.loads(f.read(length))
+            network = cls(description['sizes'], description['activations'], dtype=np.dtype(description['dtype']))
+            network.set_params(np.fromfile(f, dtype=network.params.dtype, count=len(network.params)))
+        return network
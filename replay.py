@@ -0,0 +1,21 @@
+import argparse
+
+import redis
+
+from bases import settings
+from simulation.trace import TraceReader, TraceReplay
+
+parser = argparse.ArgumentParser(description='Воспроизведение записи симуляции (simulation.trace) в Redis')
+parser.add_argument('path', help='файл записи')
+parser.add_argument('--speed', type=float, default=1.0, help='ускорение относительно модельного времени')
+parser.add_argument('--start-tick', type=int, default=None)
+parser.add_argument('--end-tick', type=int, default=None)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    reader = TraceReader(args.path)
+    redis_instance = redis.StrictRedis(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+    replay = TraceReplay(reader, redis_instance, speed=args.speed)
+    print('frames={}'.format(len(reader)))
+    replay.run(start_tick=args.start_tick, end_tick=args.end_tick)
+    print('published={}'.format(replay.published))
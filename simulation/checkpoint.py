@@ -0,0 +1,140 @@
+"""
+Контрольные точки: сохранение и восстановление динамического состояния модели.
+
+Сохраняются очереди полос, смещения, скорости, состояния и задержки авто, таймеры появления авто,
+фазы и таймеры перекрестков, состояния светофоров, а также счетчики id объектов контекста модели. Топология
+(дороги, перекрестки, геометрия) не сохраняется: контрольная точка восстанавливается в модель,
+построенную из того же описания сети (проверяется по id полос).
+
+Все значения little-endian. Заголовок (104 байта):
+    magic                4s   b'TMCP'
+    version              u16  CHECKPOINT_VERSION
+    flags                u16  зарезервировано
+    tick                 i64  номер шага
+    time                 f64  время симуляции, секунды
+    lanes                u32  количество полос
+    cars                 u32  количество авто
+    cross_roads          u32  количество перекрестков
+    reserved             u32
+    car_count            i64  ModelContext.car_count
+    road_count           i64  ModelContext.road_count
+    cross_road_count     i64  ModelContext.cross_road_count
+    drive_line_count     i64  ModelContext.drive_line_count
+    semaphore_count      i64  ModelContext.semaphore_count
+    spawned              i64  появившиеся авто
+    cleared              i64  покинувшие модель авто
+    cleared_wait_time    f64  время простоя покинувших модель авто
+За заголовком подряд идут массивы LANE_COLUMNS[lanes], CAR_COLUMNS[cars], CROSS_ROAD_COLUMNS[cross_roads];
+каждый массив дополнен до границы 8 байт. При восстановлении файл отображается в память (mmap)
+и массивы читаются без копирования.
+"""
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from .simulate import CityModel
+
+CHECKPOINT_MAGIC = b'TMCP'
+CHECKPOINT_VERSION = 1
+CHECKPOINT_HEADER = struct.Struct('<4sHHqdIIIIqqqqqqqd')
+ALIGNMENT = 8
+
+LANE_COLUMNS = (
+    ('lane_ids', np.dtype('<i8')),
+    ('lane_cars', np.dtype('<i8')),  # количество авто в очереди полосы
+    ('lane_time_passed', np.dtype('<f8')),  # время с последнего появления авто
+    ('lane_spawned', np.dtype('<i8')),
+    ('lane_removed', np.dtype('<i8')),
+    ('lane_removed_wait_time', np.dtype('<f8')),
+    ('lane_semaphore_state', np.dtype('i1')),  # 0 - нет светофора
+    ('lane_semaphore_time', np.dtype('<f8')),
+)
+CAR_COLUMNS = (
+    ('car_ids', np.dtype('<i8')),
+    ('car_offset', np.dtype('<f8')),
+    ('car_speed', np.dtype('<f8')),
+    ('car_state', np.dtype('i1')),
+    ('car_delay_passed', np.dtype('<f8')),
+    ('car_wait_time', np.dtype('<f8')),
+    ('car_next_lane', np.dtype('<i4')),  # номер полосы в порядке CityModel.get_drive_lines, -1 - не выбрана
+    ('car_destination', np.dtype('<i4')),  # номер полосы-выезда, -1 - без пункта назначения
+)
+CROSS_ROAD_COLUMNS = (
+    ('cross_road_state', np.dtype('i1')),
+    ('cross_road_switch_time_passed', np.dtype('<f8')),
+    ('cross_road_time_to_switch', np.dtype('<f8')),
+)
+
+
+def padding(size: int) -> int:
+    return -size % ALIGNMENT
+
+
+def save_checkpoint(model: CityModel, path: str):
+    """
+    Файл записывается во временный и переименовывается, поэтому прерванная запись не портит
+    предыдущую контрольную точку
+    """
+    state = model.export_state()
+    lanes = len(state['lane_ids'])
+    cars = len(state['car_ids'])
+    cross_roads = len(state['cross_road_state'])
+    header = CHECKPOINT_HEADER.pack(
+        CHECKPOINT_MAGIC, CHECKPOINT_VERSION, 0, state['tick'], state['time'], lanes, cars, cross_roads, 0,
+        *model.context.counters(), state['spawned'], state['cleared'], state['cleared_wait_time'],
+    )
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.write(b'\0' * padding(len(header)))
+        for columns, count in ((LANE_COLUMNS, lanes), (CAR_COLUMNS, cars), (CROSS_ROAD_COLUMNS, cross_roads)):
+            for name, dtype in columns:
+                data = np.asarray(state[name]).astype(dtype, copy=False).tobytes()
+                f.write(data)
+                f.write(b'\0' * padding(len(data)))
+    os.replace(temp_path, path)
+
+
+def read_checkpoint(data) -> dict:
+    """
+    Разбор контрольной точки без копирования: массивы являются представлениями над data
+    """
+    (
+        magic, version, _, tick, time, lanes, cars, cross_roads, _, car_count, road_count, cross_road_count,
+        drive_line_count, semaphore_count, spawned, cleared, cleared_wait_time,
+    ) = CHECKPOINT_HEADER.unpack_from(data, 0)
+    if magic != CHECKPOINT_MAGIC:
+        raise ValueError('Not a traffic model checkpoint')
+    if version != CHECKPOINT_VERSION:
+        raise ValueError('Unsupported checkpoint version {}'.format(version))
+    state = {
+        'tick': tick,
+        'time': time,
+        'spawned': spawned,
+        'cleared': cleared,
+        'cleared_wait_time': cleared_wait_time,
+        'counters': (car_count, road_count, cross_road_count, drive_line_count, semaphore_count),
+    }
+    offset = CHECKPOINT_HEADER.size + padding(CHECKPOINT_HEADER.size)
+    for columns, count in ((LANE_COLUMNS, lanes), (CAR_COLUMNS, cars), (CROSS_ROAD_COLUMNS, cross_roads)):
+        for name, dtype in columns:
+            state[name] = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += dtype.itemsize * count + padding(dtype.itemsize * count)
+    return state
+
+
+def load_checkpoint(model: CityModel, path: str):
+    """
+    Восстанавливает состояние модели и счетчики id ее контекста; модель должна быть построена из того же
+    описания сети
+    """
+    with open(path, 'rb') as f:
+        # отображение закрывается сборщиком мусора вместе с последним массивом-представлением
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    state = read_checkpoint(data)
+    model.import_state(state)
+    # id новых объектов не должны совпадать с id восстановленных
+    model.context.reserve_ids(*state['counters'])
+    return model
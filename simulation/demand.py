@@ -0,0 +1,264 @@
+"""
+Генератор спроса: появление авто на въездах в модель по заданной интенсивности.
+
+Спрос задается интенсивностью (авто в секунду) для полос-въездов или матрицей корреспонденций
+(въезд, выезд) -> интенсивность; каждая пара или полоса - поток. Интенсивность всех потоков умножается
+на суточный профиль - коэффициенты для интервалов по profile_interval секунд, профиль повторяется.
+Моменты появления авто - пуассоновский поток (PROCESS_POISSON) или равные интервалы (PROCESS_DETERMINISTIC).
+
+Моменты появления считаются массивами сразу для всех потоков на batch секунд вперед и складываются
+в расписание, упорядоченное по времени. На шаге симуляции из расписания берутся наступившие моменты,
+авто ставятся в очередь своего въезда (авто за пределами модели), а въезжают, когда в начале полосы
+есть место: за шаг - не больше одного авто на полосу. Полосы с пустой очередью на шаге не проверяются.
+
+Описание в JSON (load_demand), полосы задаются id (DriveLine.id):
+    {
+        "process": "poisson",
+        "seed": 1,
+        "profile": [0.3, 0.2, ..., 1.0],
+        "profileInterval": 3600.0,
+        "rate": 0.5,
+        "entries": [{"lane": 12, "rate": 1.5}],
+        "od": [{"from": 12, "to": 40, "rate": 0.2}]
+    }
+rate без entries и od - одна интенсивность для всех полос, на которых появляются авто (auto_add_car).
+"""
+import json
+from collections import deque
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from bases.road import DriveLine
+
+
+class Demand:
+    PROCESS_POISSON = 1
+    PROCESS_DETERMINISTIC = 2
+    PROCESSES = {'poisson': PROCESS_POISSON, 'deterministic': PROCESS_DETERMINISTIC}
+    DEFAULT_BATCH = 60.0  # на сколько секунд вперед считается расписание
+    DEFAULT_PROFILE_INTERVAL = 3600.0
+
+    entries: List[DriveLine]  # полосы-въезды
+    destinations: List[DriveLine]  # полосы-выезды матрицы корреспонденций
+
+    def __init__(
+            self,
+            rates: Dict[DriveLine, float] = None,
+            od_matrix: Dict[Tuple[DriveLine, DriveLine], float] = None,
+            profile: List[float] = None,
+            profile_interval: float = DEFAULT_PROFILE_INTERVAL,
+            process: int = PROCESS_POISSON,
+            seed: int = None,
+            batch: float = DEFAULT_BATCH,
+            start_time: float = 0.0,
+    ):
+        """
+        :param rates: интенсивность появления авто на полосе-въезде, авто в секунду
+        :param od_matrix: интенсивность для пары (въезд, выезд); авто едут к выезду (нужна маршрутизация)
+        :param profile: коэффициенты интенсивности по интервалам profile_interval секунд, None - постоянная
+        :param start_time: модельное время, с которого считается расписание
+        """
+        if not rates and not od_matrix:
+            raise ValueError('Demand needs arrival rates or an origin-destination matrix')
+        if process not in (self.PROCESS_POISSON, self.PROCESS_DETERMINISTIC):
+            raise ValueError('Unknown arrival process')
+        if batch <= 0.0 or profile_interval <= 0.0:
+            raise ValueError('Batch and profile interval must be positive')
+        profile = [1.0] if profile is None else [float(factor) for factor in profile]
+        if not profile or min(profile) < 0.0 or not sum(profile):
+            raise ValueError('Profile factors must be non-negative and not all zero')
+        self.profile = np.array(profile)
+        self.profile_interval = profile_interval
+        self.process = process
+        self.batch = batch
+        self.rng = np.random.default_rng(seed)
+
+        self.entries = []
+        self.destinations = []
+        entry_index = {}
+        destination_index = {}
+        stream_entry = []
+        stream_destination = []
+        stream_rate = []
+        streams = [(drive_line, None, rate) for drive_line, rate in (rates or {}).items()]
+        streams += [(origin, destination, rate) for (origin, destination), rate in (od_matrix or {}).items()]
+        for drive_line, destination, rate in streams:
+            if rate < 0.0:
+                raise ValueError('Arrival rate must be non-negative')
+            if drive_line not in entry_index:
+                entry_index[drive_line] = len(self.entries)
+                self.entries.append(drive_line)
+            k = -1
+            if destination is not None:
+                if destination not in destination_index:
+                    destination_index[destination] = len(self.destinations)
+                    self.destinations.append(destination)
+                k = destination_index[destination]
+            stream_entry.append(entry_index[drive_line])
+            stream_destination.append(k)
+            stream_rate.append(rate)
+        self.stream_entry = np.array(stream_entry, dtype=np.int64)
+        self.stream_destination = np.array(stream_destination, dtype=np.int64)
+        self.stream_rate = np.array(stream_rate)
+        if not self.stream_rate.sum():
+            raise ValueError('Demand needs a positive arrival rate')
+        # PROCESS_DETERMINISTIC: остаток интенсивности до следующего авто каждого потока
+        self.stream_residual = np.zeros(len(stream_rate))
+
+        self.times = np.zeros(0)
+        self.streams = np.zeros(0, dtype=np.int64)
+        self.position = 0  # первый ненаступивший момент расписания
+        self.generated_until = start_time
+        self.waiting = {}  # номер въезда -> очередь номеров выездов (-1 - без выезда), только непустые
+        self.generated = 0
+        self.admitted = 0
+        self.max_waiting = 0
+
+    @property
+    def has_destinations(self):
+        return bool(self.destinations)
+
+    def intensity(self, start: float, end: float):
+        """
+        Накопленный коэффициент профиля на отрезке [start, end]: точки излома и значения в них
+        """
+        interval = self.profile_interval
+        first = int(np.floor(start / interval))
+        last = int(np.ceil(end / interval))
+        knots = np.arange(first, last + 1) * interval
+        knots[0] = start
+        knots[-1] = end
+        factors = self.profile[np.arange(first, last) % len(self.profile)]
+        cumulative = np.concatenate(([0.0], np.cumsum(factors * np.diff(knots))))
+        return knots, cumulative
+
+    def generate(self):
+        """
+        Добавляет в расписание моменты появления авто следующих batch секунд
+        """
+        start = self.generated_until
+        end = start + self.batch
+        knots, cumulative = self.intensity(start, end)
+        total = cumulative[-1]
+        rates = self.stream_rate
+        if self.process == self.PROCESS_POISSON:
+            # при заданном количестве события пуассоновского потока распределены равномерно
+            counts = self.rng.poisson(rates * total)
+            levels = self.rng.uniform(0.0, total, int(counts.sum()))
+        else:
+            # авто потока - через 1 / rate накопленного коэффициента
+            residual = self.stream_residual
+            safe_rates = np.where(rates > 0.0, rates, 1.0)
+            counts = np.where(rates > 0.0, np.ceil((total - residual) * safe_rates), 0).astype(np.int64)
+            counts = np.maximum(counts, 0)
+            starts = np.cumsum(counts) - counts
+            steps = np.arange(int(counts.sum())) - np.repeat(starts, counts)
+            levels = np.repeat(residual, counts) + steps / np.repeat(safe_rates, counts)
+            self.stream_residual = np.where(rates > 0.0, residual + counts / safe_rates - total, 0.0)
+        streams = np.repeat(np.arange(len(rates)), counts)
+        times = np.interp(levels, cumulative, knots)
+        order = np.argsort(times, kind='stable')
+        self.times = np.concatenate((self.times[self.position:], times[order]))
+        self.streams = np.concatenate((self.streams[self.position:], streams[order]))
+        self.position = 0
+        self.generated_until = end
+        self.generated += len(times)
+
+    def next_arrival_time(self):
+        """
+        :return: время следующего появления авто, None - авто ждут въезда в модель
+        """
+        if self.waiting:
+            return None
+        while self.position >= len(self.times):
+            self.generate()
+        return float(self.times[self.position])
+
+    def simulate(self, model, timedelta: float):
+        """
+        Вызывается после шага движка: авто, чей момент наступил к концу шага, ставятся в очередь въезда,
+        головные авто очередей въезжают в модель
+        """
+        now = model.time + timedelta
+        while self.generated_until < now:
+            self.generate()
+        end = int(np.searchsorted(self.times, now, side='right'))
+        if end > self.position:
+            streams = self.streams[self.position:end]
+            entries = self.stream_entry[streams].tolist()
+            destinations = self.stream_destination[streams].tolist()
+            waiting = self.waiting
+            for i in range(len(entries)):
+                queue = waiting.get(entries[i])
+                if queue is None:
+                    queue = waiting[entries[i]] = deque()
+                queue.append(destinations[i])
+            self.position = end
+        if not self.waiting:
+            return
+        indices = list(self.waiting)
+        drive_lines = [self.entries[i] for i in indices]
+        destinations = []
+        for i in indices:
+            k = self.waiting[i][0]
+            destinations.append(self.destinations[k] if k >= 0 else None)
+        admitted = model.engine.admit_cars(drive_lines, destinations)
+        waiting_count = 0
+        for j in range(len(indices)):
+            queue = self.waiting[indices[j]]
+            if admitted[j]:
+                queue.popleft()
+                self.admitted += 1
+                if not queue:
+                    del self.waiting[indices[j]]
+                    continue
+            waiting_count += len(queue)
+        if waiting_count > self.max_waiting:
+            self.max_waiting = waiting_count
+
+    def stats(self):
+        return {
+            'demand_generated': self.generated,
+            'demand_admitted': self.admitted,
+            'demand_waiting': sum([len(queue) for queue in self.waiting.values()]),
+            'demand_max_waiting': self.max_waiting,
+        }
+
+
+def load_demand(source: Union[str, dict], model) -> Demand:
+    """
+    :param source: путь к JSON-описанию спроса или уже прочитанное описание
+    """
+    if isinstance(source, str):
+        with open(source) as f:
+            source = json.load(f)
+    lanes = {drive_line.id: drive_line for drive_line in model.get_drive_lines()}
+
+    def lane(lane_id):
+        if lane_id not in lanes:
+            raise ValueError('Unknown lane {}'.format(lane_id))
+        return lanes[lane_id]
+
+    rates = {}
+    for entry in source.get('entries', []):
+        rates[lane(entry['lane'])] = float(entry['rate'])
+    od_matrix = {}
+    for pair in source.get('od', []):
+        od_matrix[(lane(pair['from']), lane(pair['to']))] = float(pair['rate'])
+    if not rates and not od_matrix and 'rate' in source:
+        for drive_line in lanes.values():
+            if drive_line.auto_add_car:
+                rates[drive_line] = float(source['rate'])
+    process = source.get('process', 'poisson')
+    if process not in Demand.PROCESSES:
+        raise ValueError('Unknown arrival process {}'.format(process))
+    return Demand(
+        rates=rates,
+        od_matrix=od_matrix,
+        profile=source.get('profile'),
+        profile_interval=float(source.get('profileInterval', Demand.DEFAULT_PROFILE_INTERVAL)),
+        process=Demand.PROCESSES[process],
+        seed=source.get('seed'),
+        start_time=model.time,
+    )
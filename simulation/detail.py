@@ -0,0 +1,89 @@
+"""
+Уровень детализации: полосы, за которыми никто не наблюдает, симулируются мезоскопически.
+
+На мезоскопической полосе авто не движется по шагам: при въезде ему назначается время выезда (длина полосы
+при скорости car_speed контекста модели), а выезжают авто по одному не чаще, чем раз в meso_headway секунд, если
+следующая полоса их принимает. Вместимость полосы - авто, стоящие друг за другом на дистанции CAR_GAP.
+Шаг такой полосы проверяет только авто у ее конца, поэтому не зависит от количества авто на ней.
+
+Наблюдаемые полосы - полосы областей просмотра (simulation.viewports) и зондов (set_probe) - и upstream
+полос перед ними симулируются поштучно: въезжающие в область авто уже имеют точные положения.
+Когда полоса снова становится наблюдаемой, авто расставляются на ней по оставшемуся до выезда времени.
+"""
+from typing import List
+
+from bases.road import DriveLine
+from .simulate import CityModel
+
+
+class LevelOfDetail:
+    DEFAULT_UPSTREAM = 1
+
+    def __init__(self, model: CityModel, upstream: int = DEFAULT_UPSTREAM):
+        """
+        :param upstream: сколько полос перед наблюдаемыми тоже симулируются поштучно
+        """
+        self.model = model
+        self.upstream = upstream
+        self.watched = []  # полосы областей просмотра
+        self.probes = {}  # имя зонда -> полосы
+        self.topology_version = None
+        self.lanes = []
+        self.predecessors = {}
+        self.detailed = set()
+
+    def compile(self):
+        self.topology_version = self.model.topology_version
+        self.lanes = self.model.get_drive_lines()
+        self.predecessors = {drive_line: [] for drive_line in self.lanes}
+        for drive_line in self.lanes:
+            for path in drive_line.paths:
+                if path in self.predecessors:
+                    self.predecessors[path].append(drive_line)
+
+    def set_probe(self, name: str, drive_lines: List[DriveLine]):
+        self.probes[name] = list(drive_lines)
+        self.apply()
+
+    def remove_probe(self, name: str):
+        if self.probes.pop(name, None) is not None:
+            self.apply()
+
+    def update(self, watched: List[DriveLine]):
+        """
+        :param watched: полосы, за которыми наблюдают клиенты
+        """
+        self.watched = list(watched)
+        self.apply()
+
+    def apply(self):
+        if self.topology_version != self.model.topology_version:
+            self.compile()
+        detailed = set(self.watched)
+        for drive_lines in self.probes.values():
+            detailed.update(drive_lines)
+        frontier = list(detailed)
+        for _ in range(self.upstream):
+            previous = []
+            for drive_line in frontier:
+                for predecessor in self.predecessors.get(drive_line, ()):
+                    if predecessor not in detailed:
+                        detailed.add(predecessor)
+                        previous.append(predecessor)
+            frontier = previous
+        self.detailed = detailed
+        microscopic = [drive_line for drive_line in self.lanes if drive_line in detailed and drive_line.mesoscopic]
+        mesoscopic = [
+            drive_line for drive_line in self.lanes if drive_line not in detailed and not drive_line.mesoscopic
+        ]
+        if microscopic:
+            self.model.set_mesoscopic(microscopic, False)
+        if mesoscopic:
+            self.model.set_mesoscopic(mesoscopic, True)
+
+    def stats(self):
+        return {
+            'lanes': len(self.lanes),
+            'detailed_lanes': len(self.detailed),
+            'mesoscopic_lanes': sum([1 for drive_line in self.lanes if drive_line.mesoscopic]),
+        }
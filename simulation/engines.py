@@ -0,0 +1,353 @@
+import heapq
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from bases import RoadPart, CrossRoad, SimulateMixin
+from bases.car import Car
+from bases.lane import LaneQueue
+from bases.road import DriveLine
+
+
+class ObjectEngine(SimulateMixin):
+    """
+    Эталонный движок: каждое авто - объект Car, шаг симуляции выполняется через DriveLine.simulate.
+
+    Симулируются только активные полосы - с авто или с отсчетом времени до появления авто.
+    Полоса попадает в active при въезде авто (DriveLine.add_car) и покидает его, когда с нее
+    уезжает последнее авто (DriveLine.release_car). Порядок полос в шаге тот же, что при обходе
+    всех полос: первые полосы дорог, затем полосы перекрестков.
+    """
+    roads: List[RoadPart]
+    cross_roads: List[CrossRoad]
+    lanes: List[DriveLine]
+    order: Dict[DriveLine, int]
+    active: Dict[DriveLine, None]  # упорядоченное множество активных полос
+
+    def __init__(self, roads: List[RoadPart], cross_roads: List[CrossRoad]):
+        self.roads = roads
+        self.cross_roads = cross_roads
+        self.compiled = False
+        self.lanes = []
+        self.order = {}
+        self.active = {}
+        self.router = None
+        self.road_lanes_count = 0
+        self.metrics = None  # simulation.metrics.Metrics - время фаз шага, None - без замеров
+        # итоги контрольной точки, не разнесенные по полосам (контрольная точка VectorizedEngine)
+        self.restored_spawned = 0
+        self.restored_cleared = 0
+        self.restored_cleared_wait_time = 0.0
+
+    def topology_changed(self):
+        self.compiled = False
+
+    def set_router(self, router):
+        """
+        :param router: simulation.routing.Router - авто с пунктом назначения выбирают путь по его таблицам
+        """
+        self.router = router
+        self.compiled = False
+
+    def compile(self):
+        self.lanes = self.get_drive_lines()
+        self.order = {self.lanes[i]: i for i in range(len(self.lanes))}
+        self.road_lanes_count = len(self.lanes) - sum([len(cross_road.lines) for cross_road in self.cross_roads])
+        self.active = {}
+        for drive_line in self.lanes:
+            drive_line.active_lanes = self.active
+            if drive_line.queue or drive_line.auto_add_car:
+                self.active[drive_line] = None
+        if self.router:
+            self.router.compile(self.lanes)
+        self.compiled = True
+
+    def simulate(self, timedelta: float, **kwargs):
+        if not self.compiled:
+            self.compile()
+        metrics = self.metrics
+        if metrics is not None:
+            started = time.perf_counter()
+        pending = [self.order[drive_line] for drive_line in self.active]
+        heapq.heapify(pending)
+        queued = set(pending)
+        # полосы дорог идут раньше полос перекрестков, поэтому шаг делится на две фазы
+        self.step_lanes(pending, queued, timedelta, self.road_lanes_count)
+        if metrics is not None:
+            roads_done = time.perf_counter()
+            metrics.observe('road_lanes', roads_done - started)
+        self.step_lanes(pending, queued, timedelta, len(self.lanes))
+        for j in range(len(self.cross_roads)):
+            self.cross_roads[j].simulate_signals(timedelta)
+        if metrics is not None:
+            cross_roads_done = time.perf_counter()
+            metrics.observe('cross_roads', cross_roads_done - roads_done)
+        if self.router:
+            self.router.simulate(timedelta)
+            if metrics is not None:
+                metrics.observe('router', time.perf_counter() - cross_roads_done)
+
+    def step_lanes(self, pending: list, queued: set, timedelta: float, limit: int):
+        """
+        Шаг активных полос из кучи pending с порядковыми номерами меньше limit
+        """
+        while pending and pending[0] < limit:
+            i = heapq.heappop(pending)
+            drive_line = self.lanes[i]
+            drive_line.simulate(timedelta=timedelta)
+            # авто, въехавшее на полосу дальше по порядку, движется в этом же шаге
+            paths = drive_line.paths
+            for j in range(len(paths)):
+                k = self.order.get(paths[j])
+                if k is not None and k > i and k not in queued and paths[j] in self.active:
+                    heapq.heappush(pending, k)
+                    queued.add(k)
+
+    def get_drive_lines(self):
+        drive_lines = []
+        for road in self.roads:
+            for drive_line in [road.get_first_line(True), road.get_first_line(False)]:
+                if drive_line:
+                    drive_lines.append(drive_line)
+        for cross_road in self.cross_roads:
+            drive_lines.extend(cross_road.lines)
+        return drive_lines
+
+    def collect_changes(self):
+        spawned = []
+        moved = []
+        removed = []
+        for drive_line in self.get_drive_lines():
+            drive_line.collect_changes(spawned, moved, removed)
+        return spawned, moved, removed
+
+    def stats(self):
+        """
+        :return: общие показатели: авто в модели, остановившиеся авто, наибольшая очередь на полосе,
+        появившиеся и покинувшие модель авто, суммарное время простоя
+        """
+        cars = 0
+        stopped = 0
+        max_queue = 0
+        spawned = 0
+        cleared = 0
+        cleared_wait_time = 0.0
+        wait_time = 0.0
+        for drive_line in self.get_drive_lines():
+            queue_length = 0
+            for car in drive_line.queue:
+                if car.state == car.STATE_STOPPED:
+                    queue_length += 1
+                wait_time += car.wait_time
+            cars += len(drive_line.queue)
+            stopped += queue_length
+            if queue_length > max_queue:
+                max_queue = queue_length
+            spawned += drive_line.spawned_count
+            cleared += drive_line.removed_count
+            cleared_wait_time += drive_line.removed_wait_time
+        return {
+            'cars': cars,
+            'stopped': stopped,
+            'max_queue': max_queue,
+            'spawned': spawned + self.restored_spawned,
+            'cleared': cleared + self.restored_cleared,
+            'cleared_wait_time': cleared_wait_time + self.restored_cleared_wait_time,
+            'wait_time': wait_time,
+        }
+
+    def lane_stats(self, lanes: List[DriveLine]):
+        """
+        :return: количество стоящих авто и суммарное время их простоя на каждой из lanes в виде массивов
+        """
+        stopped = np.zeros(len(lanes))
+        wait_time = np.zeros(len(lanes))
+        for i in range(len(lanes)):
+            for car in lanes[i].queue:
+                if car.state == car.STATE_STOPPED:
+                    stopped[i] += 1
+                    wait_time[i] += car.wait_time
+        return stopped, wait_time
+
+    def switch_signals(self, cross_roads: List[CrossRoad]):
+        """
+        Внеочередное переключение светофоров перекрестков (например, по решению simulation.signals)
+        """
+        for j in range(len(cross_roads)):
+            cross_roads[j].switch_state()
+            cross_roads[j].switch_time_passed = 0.0
+
+    def admit_cars(self, drive_lines: List[DriveLine], destinations: List[DriveLine]):
+        """
+        Авто извне модели (simulation.demand) въезжают в начало полос, если там есть место
+        :param destinations: полоса-выезд авто для каждой полосы, None - без пункта назначения
+        :return: въехало ли авто на каждую полосу
+        """
+        admitted = []
+        for i in range(len(drive_lines)):
+            drive_line = drive_lines[i]
+            if drive_line.can_recv():
+                drive_line.spawn_car(destinations[i])
+                admitted.append(True)
+            else:
+                admitted.append(False)
+        return admitted
+
+    def set_mesoscopic(self, drive_lines: List[DriveLine], enabled: bool):
+        """
+        Переключает полосы между мезоскопической и поштучной симуляцией авто (см. DriveLine.simulate_meso)
+        """
+        for drive_line in drive_lines:
+            drive_line.set_mesoscopic(enabled)
+
+    def export_state(self, lanes: List[DriveLine]):
+        """
+        Состояние полос и авто для контрольной точки (см. simulation.checkpoint)
+        :return: массивы по полосам lanes и по авто в порядке полос и очередей
+        """
+        index = {lanes[i]: i for i in range(len(lanes))}
+        cars = []
+        positions = []
+        lane_cars = np.zeros(len(lanes), dtype=np.int64)
+        lane_time_passed = np.zeros(len(lanes))
+        lane_spawned = np.zeros(len(lanes), dtype=np.int64)
+        lane_removed = np.zeros(len(lanes), dtype=np.int64)
+        lane_removed_wait_time = np.zeros(len(lanes))
+        for i in range(len(lanes)):
+            drive_line = lanes[i]
+            lane_cars[i] = len(drive_line.queue)
+            lane_time_passed[i] = drive_line.time_passed
+            lane_spawned[i] = drive_line.spawned_count
+            lane_removed[i] = drive_line.removed_count
+            lane_removed_wait_time[i] = drive_line.removed_wait_time
+            if drive_line.mesoscopic:
+                # в контрольную точку попадают положения авто; у мезоскопических полос они считаются
+                # по времени выезда без изменения самих авто, чтобы сохранение не влияло на симуляцию
+                positions.extend(drive_line.meso_positions())
+            else:
+                positions.extend(
+                    (car.offset, car.speed, car.state, car.delay_passed, car.wait_time) for car in drive_line.queue
+                )
+            cars.extend(drive_line.queue)
+        state = {
+            'lane_cars': lane_cars,
+            'lane_time_passed': lane_time_passed,
+            'lane_spawned': lane_spawned,
+            'lane_removed': lane_removed,
+            'lane_removed_wait_time': lane_removed_wait_time,
+            'car_ids': np.array([car.id for car in cars], dtype=np.int64),
+            'car_offset': np.array([position[0] for position in positions], dtype=np.float64),
+            'car_speed': np.array([position[1] for position in positions], dtype=np.float64),
+            'car_state': np.array([position[2] for position in positions], dtype=np.int8),
+            'car_delay_passed': np.array([position[3] for position in positions], dtype=np.float64),
+            'car_wait_time': np.array([position[4] for position in positions], dtype=np.float64),
+            'car_next_lane': np.array(
+                [index.get(car.next_drive_line, -1) for car in cars], dtype=np.int32
+            ),
+            'car_destination': np.array(
+                [index.get(car.destination, -1) for car in cars], dtype=np.int32
+            ),
+        }
+        return state
+
+    def import_state(self, lanes: List[DriveLine], state: dict):
+        """
+        Заменяет авто на полосах состоянием из export_state; авто публикуются заново как появившиеся
+        """
+        columns = [
+            state[name].tolist() for name in (
+                'car_ids', 'car_offset', 'car_speed', 'car_state', 'car_delay_passed', 'car_wait_time',
+                'car_next_lane', 'car_destination',
+            )
+        ]
+        ids, offsets, speeds, states, delays, wait_times, next_lanes, destinations = columns
+        lane_cars = state['lane_cars'].tolist()
+        k = 0
+        for i in range(len(lanes)):
+            drive_line = lanes[i]
+            for car in drive_line.queue:
+                Car.recycle(car)
+            queue = []
+            for j in range(k, k + lane_cars[i]):
+                car = Car.acquire(drive_line=drive_line, offset=offsets[j], car_id=ids[j])
+                car.speed = speeds[j]
+                car.state = states[j]
+                car.delay_passed = delays[j]
+                car.wait_time = wait_times[j]
+                if next_lanes[j] >= 0:
+                    car.next_drive_line = lanes[next_lanes[j]]
+                if destinations[j] >= 0:
+                    car.destination = lanes[destinations[j]]
+                queue.append(car)
+            k += lane_cars[i]
+            drive_line.queue = LaneQueue(queue)
+            drive_line.dirty = bool(queue)
+            drive_line.removed_car_ids = []
+            if drive_line.mesoscopic:
+                drive_line.aggregate_cars()
+        time_passed = state['lane_time_passed'].tolist()
+        spawned = state['lane_spawned'].tolist()
+        removed = state['lane_removed'].tolist()
+        removed_wait_time = state['lane_removed_wait_time'].tolist()
+        for i in range(len(lanes)):
+            lanes[i].time_passed = time_passed[i]
+            lanes[i].spawned_count = spawned[i]
+            lanes[i].removed_count = removed[i]
+            lanes[i].removed_wait_time = removed_wait_time[i]
+        # VectorizedEngine не ведет счетчики по полосам: итоги берутся из заголовка контрольной точки
+        self.restored_spawned = int(state['spawned']) - sum(spawned)
+        self.restored_cleared = int(state['cleared']) - sum(removed)
+        self.restored_cleared_wait_time = float(state['cleared_wait_time']) - sum(removed_wait_time)
+        for cross_road in self.cross_roads:
+            cross_road.refresh_occupied()
+        # активные полосы и очередь событий строятся заново
+        self.compiled = False
+
+    def car_arrays(self, drive_lines: List[DriveLine] = None):
+        """
+        :param drive_lines: полосы, авто которых нужны, None - все полосы
+        :return: id, x, y и id полосы авто в виде массивов
+        """
+        if drive_lines is None:
+            drive_lines = self.get_drive_lines()
+        ids = []
+        xs = []
+        ys = []
+        lanes = []
+        for drive_line in drive_lines:
+            queue = drive_line.queue
+            if not queue:
+                continue
+            start = drive_line.start
+            vector = drive_line.line_vector
+            for car in queue:
+                ids.append(car.id)
+                xs.append(start.x + vector.x * car.offset)
+                ys.append(start.y + vector.y * car.offset)
+            lanes.extend([drive_line.id] * len(queue))
+        return (
+            np.array(ids, dtype=np.int64),
+            np.array(xs, dtype=np.float64),
+            np.array(ys, dtype=np.float64),
+            np.array(lanes, dtype=np.int64),
+        )
+
+    def lane_car_arrays(self, groups: List[List[DriveLine]]):
+        """
+        :param groups: списки полос
+        :return: для каждого списка - массивы car_arrays авто на его полосах
+        """
+        return [self.car_arrays(drive_lines) for drive_lines in groups]
+
+    def get_cars(self):
+        cars = []
+        for road in self.roads:
+            road_cars = road.get_cars()
+            for car in road_cars:
+                cars.append(car)
+        for cross_road in self.cross_roads:
+            cross_road_cars = cross_road.get_cars()
+            for car in cross_road_cars:
+                cars.append(car)
+        return cars
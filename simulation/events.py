@@ -0,0 +1,423 @@
+"""
+Событийный движок: переключения светофоров, появление авто и окончание задержки перед троганием
+выполняются по очереди событий, а не накоплением времени в каждом объекте на каждом шаге.
+
+Полоса, на которой все авто стоят и не тронутся сами (авто стоит вплотную за остановившимся авто,
+первое авто - у стоп-линии на красный), засыпает и не симулируется. Полоса просыпается, когда
+на нее въезжает или появляется авто, когда ее светофор переключается на зеленый или когда
+заканчивается задержка стоящего авто (событие EVENT_WAKE). Время простоя спящих авто
+начисляется при пробуждении.
+
+Полоса, на которой все авто едут с наибольшей скоростью car_speed контекста модели и не догоняют впереди
+идущих, тоже не симулируется (coasting): положения авто линейны по времени и вычисляются при
+пробуждении или при запросе кадра, состояния и статистики. Время, когда головное авто доедет до конца
+полосы, известно заранее - на него планируется EVENT_WAKE. Полоса просыпается и перед тем, как на нее
+может въехать авто: у головного авто предыдущей полосы на этом шаге кончается полоса.
+Пропускаются только такие полосы: полоса, на которой хотя бы одно авто разгоняется, тормозит или ждет
+окончания задержки перед троганием, симулируется по шагам, как в ObjectEngine.
+
+Если все полосы спят или едут без взаимодействия, состояние модели до ближайшего события меняется
+только линейно и модель можно перемотать (см. CityModel.fast_forward).
+
+Отличие от ObjectEngine: первое авто, ждущее зеленого у стоп-линии, трогается через полную
+задержку car_delay после переключения (в ObjectEngine - через остаток задержки).
+Из-за этого пути отдельных авто расходятся с ObjectEngine, а совпадают только итоги. Сверка проводилась
+на сетке 8x8 с шагом сетки 100 и 300 м, 240 с модельного времени, шаг симуляции 1/60 и 1/10 с. Число авто,
+выехавших авто и суммарный простой отличались от ObjectEngine не больше чем на 3%, простой выехавших
+авто - не больше чем на 9%, число стоящих авто в момент замера - не больше чем на 8.3%. Такие же
+отклонения были у движка до пропуска полос без взаимодействия.
+"""
+import heapq
+import time
+from typing import Dict, List
+
+from bases import RoadPart, CrossRoad
+from bases.car import Car, CAR_GAP
+from bases.road import DriveLine
+from .engines import ObjectEngine
+
+
+class EventQueue:
+    """
+    Очередь событий по модельному времени; события с одинаковым временем - в порядке добавления
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.seq = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, time: float, kind: int, target):
+        heapq.heappush(self.heap, (time, self.seq, kind, target))
+        self.seq += 1
+
+    def next_time(self):
+        return self.heap[0][0] if self.heap else None
+
+    def pop_until(self, time: float):
+        """
+        :return: события со временем не позже time - (время, тип, объект)
+        """
+        events = []
+        while self.heap and self.heap[0][0] <= time:
+            event_time, _, kind, target = heapq.heappop(self.heap)
+            events.append((event_time, kind, target))
+        return events
+
+
+class EventEngine(ObjectEngine):
+    EVENT_SWITCH = 1  # переключение светофоров перекрестка
+    EVENT_SPAWN = 2  # появление авто на полосе
+    EVENT_WAKE = 3  # окончание задержки стоящего авто
+    TIME_EPSILON = 1e-9  # запас на погрешность суммы шагов
+    COAST_MARGIN = 1e-6  # полоса без взаимодействия авто просыпается немного раньше расчетного времени, метров
+
+    # active - полосы, которые не спят (пустая полоса спит)
+    sleeping: Dict[DriveLine, tuple]  # полоса -> (время засыпания, количество авто, время пробуждения)
+    coasting: Dict[DriveLine, tuple]  # полоса -> (время, до которого сдвинуты авто, количество авто, время пробуждения)
+
+    def __init__(self, roads: List[RoadPart], cross_roads: List[CrossRoad]):
+        super().__init__(roads, cross_roads)
+        self.time = 0.0
+        self.sleeping = {}
+        self.coasting = {}
+        self.events = EventQueue()
+
+    def compile(self):
+        # очередь строится заново по таймерам объектов: в них записывается время до событий старой очереди
+        self.store_timers()
+        for drive_line in list(self.sleeping):
+            self.wake(drive_line, self.time)
+        for drive_line in list(self.coasting):
+            self.wake_coasting(drive_line, self.time)
+        self.lanes = self.get_drive_lines()
+        self.order = {self.lanes[i]: i for i in range(len(self.lanes))}
+        self.road_lanes_count = len(self.lanes) - sum([len(cross_road.lines) for cross_road in self.cross_roads])
+        self.active = {}
+        for drive_line in self.lanes:
+            # активность полос определяется сном, а не наличием авто
+            drive_line.active_lanes = None
+            self.active[drive_line] = None
+        self.events = EventQueue()
+        if self.router:
+            self.router.compile(self.lanes)
+        for cross_road in self.cross_roads:
+            self.events.push(
+                self.time + cross_road.time_to_switch - cross_road.switch_time_passed, self.EVENT_SWITCH, cross_road
+            )
+        for drive_line in self.lanes:
+            if drive_line.auto_add_car:
+                self.events.push(
+                    self.time + drive_line.context.spawn_interval - drive_line.time_passed, self.EVENT_SPAWN, drive_line
+                )
+        self.compiled = True
+
+    def wake(self, drive_line: DriveLine, time: float):
+        """
+        :param time: время, до которого начисляется простой авто спящей полосы
+        """
+        since, count, _ = self.sleeping.pop(drive_line)
+        self.active[drive_line] = None
+        self.account(drive_line, time - since, count)
+
+    def wake_coasting(self, drive_line: DriveLine, time: float):
+        """
+        :param time: время, до которого сдвигаются авто полосы
+        """
+        since, count, _ = self.coasting.pop(drive_line)
+        self.active[drive_line] = None
+        self.coast(drive_line, time - since, count)
+
+    def coast(self, drive_line: DriveLine, elapsed: float, count: int):
+        """
+        Сдвигает первые count авто полосы на путь, пройденный за elapsed секунд с наибольшей скоростью
+        """
+        if elapsed <= 0.0:
+            return
+        distance = drive_line.context.car_speed * elapsed
+        cars = drive_line.queue.cars
+        head = drive_line.queue.head
+        for i in range(count):
+            car = cars[head + i]
+            car.offset += distance
+            car.dirty = True
+        drive_line.dirty = True
+
+    def account(self, drive_line: DriveLine, elapsed: float, count: int):
+        """
+        Начисляет время простоя и задержки первым count авто полосы, не симулировавшимся elapsed секунд
+        (авто, въехавшие на полосу во время сна, стоят в конце очереди)
+        """
+        if elapsed <= 0.0:
+            return
+        cars = drive_line.queue.cars
+        head = drive_line.queue.head
+        for i in range(count):
+            car = cars[head + i]
+            car.wait_time += elapsed
+            if not self.is_blocked(drive_line, i):
+                car.delay_passed += elapsed
+
+    def is_blocked(self, drive_line: DriveLine, queue_position: int):
+        """
+        Стоящее авто не тронется, пока не тронется впереди идущее авто или не загорится зеленый
+        """
+        queue = drive_line.queue
+        i = queue.head + queue_position
+        car = queue.cars[i]
+        if queue_position:
+            leader = queue.cars[i - 1]
+            return leader.state == Car.STATE_STOPPED and car.offset >= leader.offset - CAR_GAP
+        return car.offset >= drive_line.length and not drive_line.can_release()
+
+    def try_sleep(self, drive_line: DriveLine, time: float):
+        """
+        Усыпляет полосу, если все авто на ней стоят; при окончании задержки стоящего авто планируется пробуждение
+        """
+        queue = drive_line.queue
+        cars = queue.cars
+        head = queue.head
+        if drive_line.mesoscopic and len(cars) > head:
+            # время выезда авто мезоскопической полосы отсчитывается по шагам полосы
+            return
+        wake_time = None
+        for i in range(len(cars) - head):
+            car = cars[head + i]
+            if car.state != Car.STATE_STOPPED:
+                return
+            if self.is_blocked(drive_line, i):
+                continue
+            if not i and car.offset >= drive_line.length:
+                # авто у стоп-линии на зеленый ждет освобождения следующей полосы
+                return
+            restart_time = time + drive_line.context.car_delay - car.delay_passed
+            if wake_time is None or restart_time < wake_time:
+                wake_time = restart_time
+        self.sleeping[drive_line] = (time, len(queue), wake_time)
+        self.active.pop(drive_line, None)
+        if wake_time is not None:
+            self.events.push(wake_time, self.EVENT_WAKE, drive_line)
+
+    def try_coast(self, drive_line: DriveLine, time: float):
+        """
+        Останавливает симуляцию полосы, если все авто на ней едут с наибольшей скоростью и не догоняют
+        впереди идущих; пробуждение планируется на время, когда головное авто доедет до конца полосы
+        """
+        queue = drive_line.queue
+        cars = queue.cars
+        head = queue.head
+        if len(cars) == head or drive_line.mesoscopic:
+            return
+        car_speed = drive_line.context.car_speed
+        for i in range(len(cars) - head):
+            car = cars[head + i]
+            if car.state != Car.STATE_RUNNING or car.speed != car_speed:
+                return
+            if i and car.offset >= cars[head + i - 1].offset - CAR_GAP - self.COAST_MARGIN:
+                return
+        wake_time = time + (drive_line.length - cars[head].offset - self.COAST_MARGIN) / car_speed
+        self.coasting[drive_line] = (time, len(cars) - head, wake_time)
+        self.active.pop(drive_line, None)
+        self.events.push(wake_time, self.EVENT_WAKE, drive_line)
+
+    def simulate(self, timedelta: float, **kwargs):
+        if not self.compiled:
+            self.compile()
+        start = self.time
+        end = start + timedelta
+        delayed = []
+        for event_time, kind, target in self.events.pop_until(end + self.TIME_EPSILON):
+            if kind == self.EVENT_WAKE:
+                entry = self.sleeping.get(target)
+                # событие устарело, если полоса просыпалась и засыпала снова
+                if entry and entry[2] == event_time:
+                    self.wake(target, start)
+                entry = self.coasting.get(target)
+                if entry and entry[2] == event_time:
+                    self.wake_coasting(target, start)
+            else:
+                delayed.append((kind, target))
+
+        metrics = self.metrics
+        if metrics is not None:
+            started = time.perf_counter()
+        pending = [self.order[drive_line] for drive_line in self.active]
+        heapq.heapify(pending)
+        self.step_lanes(pending, start, end, timedelta, self.road_lanes_count)
+        if metrics is not None:
+            roads_done = time.perf_counter()
+            metrics.observe('road_lanes', roads_done - started)
+        self.step_lanes(pending, start, end, timedelta, len(self.lanes))
+
+        # светофоры и появление авто - после движения, как в ObjectEngine
+        for kind, target in delayed:
+            if kind == self.EVENT_SWITCH:
+                target.switch_state()
+                target.switch_time_passed = 0.0
+                self.events.push(end + target.time_to_switch, self.EVENT_SWITCH, target)
+                for drive_line in target.incoming_lines:
+                    if drive_line in self.sleeping and drive_line.can_release():
+                        self.wake(drive_line, end)
+            elif kind == self.EVENT_SPAWN:
+                self.events.push(end + target.context.spawn_interval, self.EVENT_SPAWN, target)
+                if target in self.coasting:
+                    # свободное место в начале полосы зависит от положения последнего авто
+                    self.wake_coasting(target, end)
+                if target.can_recv():
+                    if target in self.sleeping:
+                        self.wake(target, end)
+                    target.spawn_car()
+        if metrics is not None:
+            cross_roads_done = time.perf_counter()
+            metrics.observe('cross_roads', cross_roads_done - roads_done)
+        if self.router:
+            self.router.simulate(timedelta)
+            if metrics is not None:
+                metrics.observe('router', time.perf_counter() - cross_roads_done)
+        self.time = end
+
+    def step_lanes(self, pending: list, start: float, end: float, timedelta: float, limit: int):
+        """
+        Шаг неспящих полос из кучи pending с порядковыми номерами меньше limit
+        """
+        while pending and pending[0] < limit:
+            i = heapq.heappop(pending)
+            drive_line = self.lanes[i]
+            paths = drive_line.paths
+            if self.coasting and self.may_release(drive_line, timedelta):
+                # авто может въехать на следующую полосу: ее авто должны быть на своих местах
+                for j in range(len(paths)):
+                    if paths[j] in self.coasting:
+                        k = self.order[paths[j]]
+                        self.wake_coasting(paths[j], start if k > i else end)
+                        if k > i:
+                            heapq.heappush(pending, k)
+            drive_line.simulate_cars(timedelta)
+            for j in range(len(paths)):
+                entry = self.sleeping.get(paths[j])
+                if entry and entry[1] != len(paths[j].queue.cars) - paths[j].queue.head:
+                    # на спящую полосу въехало авто; полоса раньше текущей в этом шаге уже не симулируется
+                    k = self.order[paths[j]]
+                    self.wake(paths[j], start if k > i else end)
+                    if k > i:
+                        heapq.heappush(pending, k)
+            self.try_sleep(drive_line, end)
+            if drive_line in self.active:
+                self.try_coast(drive_line, end)
+
+    @staticmethod
+    def may_release(drive_line: DriveLine, timedelta: float):
+        """
+        Может ли головное авто полосы уехать с нее на этом шаге
+        """
+        queue = drive_line.queue
+        if len(queue.cars) == queue.head:
+            return False
+        car = queue.cars[queue.head]
+        if drive_line.mesoscopic:
+            return car.exit_time <= drive_line.meso_time + timedelta
+        return car.offset + car.speed * timedelta >= drive_line.length
+
+    def next_event_time(self):
+        """
+        :return: время ближайшего события, если все полосы спят, иначе None
+        """
+        if not self.compiled or self.active:
+            return None
+        return self.events.next_time()
+
+    def advance(self, timedelta: float):
+        """
+        Перемотка времени без симуляции, допустима только до ближайшего события
+        """
+        next_time = self.next_event_time()
+        if next_time is None and self.compiled and self.active:
+            raise ValueError('Model is not idle')
+        if next_time is not None and self.time + timedelta >= next_time:
+            raise ValueError('Cannot advance past the next event')
+        if self.router:
+            self.router.simulate(timedelta)
+        self.time += timedelta
+
+    def flush(self):
+        """
+        Начисляет простой авто спящих полос и сдвигает авто полос без взаимодействия до текущего времени
+        """
+        for drive_line, (since, count, wake_time) in self.sleeping.items():
+            self.account(drive_line, self.time - since, count)
+            self.sleeping[drive_line] = (self.time, count, wake_time)
+        for drive_line, (since, count, wake_time) in self.coasting.items():
+            self.coast(drive_line, self.time - since, count)
+            self.coasting[drive_line] = (self.time, count, wake_time)
+
+    def store_timers(self):
+        """
+        Записывает в перекрестки и полосы время, прошедшее с последнего переключения и появления авто:
+        движок отсчитывает его только в очереди событий
+        """
+        for event_time, _, kind, target in self.events.heap:
+            if kind == self.EVENT_SWITCH:
+                target.switch_time_passed = target.time_to_switch - (event_time - self.time)
+            elif kind == self.EVENT_SPAWN:
+                target.time_passed = target.context.spawn_interval - (event_time - self.time)
+
+    def export_state(self, lanes: List[DriveLine]):
+        self.flush()
+        self.store_timers()
+        return super().export_state(lanes)
+
+    def import_state(self, lanes: List[DriveLine], state: dict):
+        # простой авто спящих полос уже учтен в контрольной точке, таймеры - в перекрестках и полосах
+        self.sleeping = {}
+        self.coasting = {}
+        self.events = EventQueue()
+        self.time = state['time']
+        super().import_state(lanes, state)
+
+    def lane_stats(self, lanes: List[DriveLine]):
+        self.flush()
+        return super().lane_stats(lanes)
+
+    def set_mesoscopic(self, drive_lines: List[DriveLine], enabled: bool):
+        for drive_line in drive_lines:
+            if drive_line in self.sleeping:
+                self.wake(drive_line, self.time)
+            if drive_line in self.coasting:
+                self.wake_coasting(drive_line, self.time)
+        super().set_mesoscopic(drive_lines, enabled)
+
+    def admit_cars(self, drive_lines: List[DriveLine], destinations: List[DriveLine]):
+        for drive_line in drive_lines:
+            if drive_line in self.coasting:
+                self.wake_coasting(drive_line, self.time)
+        admitted = super().admit_cars(drive_lines, destinations)
+        for i in range(len(drive_lines)):
+            # на спящую полосу въехало авто
+            if admitted[i] and drive_lines[i] in self.sleeping:
+                self.wake(drive_lines[i], self.time)
+        return admitted
+
+    def car_arrays(self, drive_lines: List[DriveLine] = None):
+        self.flush()
+        return super().car_arrays(drive_lines)
+
+    def get_cars(self):
+        self.flush()
+        return super().get_cars()
+
+    def collect_changes(self):
+        self.flush()
+        return super().collect_changes()
+
+    def switch_signals(self, cross_roads: List[CrossRoad]):
+        super().switch_signals(cross_roads)
+        for j in range(len(cross_roads)):
+            for drive_line in cross_roads[j].incoming_lines:
+                if drive_line in self.sleeping and drive_line.can_release():
+                    self.wake(drive_line, self.time)
+
+    def stats(self):
+        self.flush()
+        return super().stats()
@@ -0,0 +1,62 @@
+"""
+Бинарный формат кадра состояния модели.
+
+Все значения little-endian. Заголовок (32 байта):
+    magic        4s   b'TMFR'
+    version      u16  FRAME_VERSION
+    flags        u16  зарезервировано
+    tick         i64  номер шага
+    time         f64  время симуляции, секунды
+    cars         u32  количество авто
+    semaphores   u32  количество светофоров
+За заголовком подряд идут массивы:
+    car_ids u32[cars], car_x f32[cars], car_y f32[cars], car_lanes u32[cars],
+    semaphore_ids u32[semaphores], semaphore_states u8[semaphores]
+"""
+import struct
+
+import numpy as np
+
+FRAME_MAGIC = b'TMFR'
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('<4sHHqdII')
+
+CAR_COLUMNS = (
+    ('car_ids', np.dtype('<u4')),
+    ('car_x', np.dtype('<f4')),
+    ('car_y', np.dtype('<f4')),
+    ('car_lanes', np.dtype('<u4')),
+)
+SEMAPHORE_COLUMNS = (
+    ('semaphore_ids', np.dtype('<u4')),
+    ('semaphore_states', np.dtype('u1')),
+)
+
+
+def encode_frame(tick: int, time: float, car_ids, car_x, car_y, car_lanes, semaphore_ids, semaphore_states) -> bytes:
+    cars = len(car_ids)
+    semaphores = len(semaphore_ids)
+    parts = [FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, 0, tick, time, cars, semaphores)]
+    for (_, dtype), values in zip(CAR_COLUMNS, (car_ids, car_x, car_y, car_lanes)):
+        parts.append(np.asarray(values).astype(dtype, copy=False).tobytes())
+    for (_, dtype), values in zip(SEMAPHORE_COLUMNS, (semaphore_ids, semaphore_states)):
+        parts.append(np.asarray(values).astype(dtype, copy=False).tobytes())
+    return b''.join(parts)
+
+
+def decode_frame(data) -> dict:
+    """
+    Разбор кадра без копирования: массивы являются представлениями над data
+    """
+    magic, version, _, tick, time, cars, semaphores = FRAME_HEADER.unpack_from(data, 0)
+    if magic != FRAME_MAGIC:
+        raise ValueError('Not a traffic model frame')
+    if version != FRAME_VERSION:
+        raise ValueError('Unsupported frame version {}'.format(version))
+    frame = {'tick': tick, 'time': time}
+    offset = FRAME_HEADER.size
+    for columns, count in ((CAR_COLUMNS, cars), (SEMAPHORE_COLUMNS, semaphores)):
+        for name, dtype in columns:
+            frame[name] = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += dtype.itemsize * count
+    return frame
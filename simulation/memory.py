@@ -0,0 +1,94 @@
+"""
+Оценка памяти модели: байт на авто и на полосу.
+
+Для объектов учитывается сам объект и принадлежащие ему значения (числа, списки, точки геометрии);
+ссылки на другие объекты модели (авто, полосы, дороги, перекрестки, светофоры) и общие словари
+движка не учитываются. Для VectorizedEngine учитываются массивы авто и полос.
+"""
+import sys
+
+import numpy as np
+
+from bases import RoadPart, CrossRoad
+from bases.car import Car
+from bases.context import ModelContext
+from bases.road import DriveLine, Semaphore
+from .simulate import CityModel
+
+MODEL_TYPES = (Car, DriveLine, Semaphore, RoadPart, CrossRoad, ModelContext)
+
+
+def slot_names(cls):
+    names = []
+    for klass in cls.__mro__:
+        slots = klass.__dict__.get('__slots__', ())
+        names.extend([slots] if isinstance(slots, str) else slots)
+    return names
+
+
+def object_size(obj, seen: set) -> int:
+    """
+    Размер объекта вместе с принадлежащими ему значениями; объекты из seen не учитываются повторно
+    """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple, set)):
+        values = list(obj)
+    elif isinstance(obj, np.ndarray):
+        return obj.nbytes + size
+    else:
+        values = [getattr(obj, name) for name in slot_names(type(obj)) if hasattr(obj, name)]
+        if hasattr(obj, '__dict__'):
+            size += sys.getsizeof(obj.__dict__)
+            values.extend(vars(obj).values())
+    for value in values:
+        # None, bool и небольшие int - общие объекты интерпретатора
+        if value is None or isinstance(value, (bool, dict, MODEL_TYPES)):
+            continue
+        if isinstance(value, int) and -5 <= value <= 256:
+            continue
+        size += object_size(value, seen)
+    return size
+
+
+def memory_report(model: CityModel) -> dict:
+    """
+    :return: количество авто и полос, байт на авто и на полосу, размер пула авто
+    """
+    from .vectorized import VectorizedEngine
+
+    engine = model.engine
+    lanes = model.get_drive_lines()
+    seen = set()
+    lane_bytes = 0
+    for drive_line in lanes:
+        lane_bytes += object_size(drive_line, seen)
+
+    if isinstance(engine, VectorizedEngine):
+        cars = engine.count
+        car_bytes = sum(getattr(engine, name).nbytes for name, _, _ in engine.CAR_FIELDS)
+        if engine.compiled:
+            for name in dir(engine):
+                if name.startswith('lane_') and isinstance(getattr(engine, name), np.ndarray):
+                    lane_bytes += getattr(engine, name).nbytes
+    else:
+        cars = 0
+        car_bytes = 0
+        for drive_line in lanes:
+            for car in drive_line.queue:
+                cars += 1
+                car_bytes += object_size(car, seen)
+
+    pool_bytes = 0
+    for car in model.context.car_pool:
+        pool_bytes += object_size(car, seen)
+    return {
+        'cars': cars,
+        'bytes_per_car': car_bytes / cars if cars else 0.0,
+        'lanes': len(lanes),
+        'bytes_per_lane': lane_bytes / len(lanes) if lanes else 0.0,
+        'pooled_cars': len(model.context.car_pool),
+        'pool_bytes': pool_bytes,
+    }
@@ -0,0 +1,265 @@
+"""
+Замеры времени фаз шага и показатели модели.
+
+Фазы, которые замеряются, если у модели есть Metrics (CityModel.set_metrics):
+    tick          шаг целиком (Scheduler)
+    road_lanes    полосы дорог (ObjectEngine, EventEngine)
+    cross_roads   полосы перекрестков и светофоры (у VectorizedEngine - только светофоры)
+    lanes         все полосы (VectorizedEngine)
+    router        пересчет весов маршрутизации
+    signal_control  решения simulation.signals
+    to_dict       подготовка состояния модели для публикации
+    json          кодирование в JSON
+    viewports     подготовка кадров областей просмотра (simulation.viewports)
+    publish       отправка в Redis
+    gc            паузы сборщика мусора
+Каждая фаза - скользящая гистограмма последних window замеров. Раз в report_interval секунд
+(по часам) снимок показателей записывается в ключ Redis METRICS_KEY в JSON и в текстовом виде
+отдается по HTTP (MetricsServer). В Redis снимок записывает отдельный поток: поток симуляции не ждет
+Redis, а ошибки записи только считаются (счетчик metrics_errors). Если предыдущий снимок еще не записан,
+он заменяется новым (счетчик metrics_dropped). Без Metrics замеры не выполняются.
+"""
+import gc
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+METRICS_KEY = 'traffic_model_metrics'
+# границы корзин гистограмм, секунды
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 1 / 60, 0.025, 0.05, 0.1, 0.25)
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class RollingHistogram:
+    """
+    Последние size значений в кольцевом буфере; распределение считается только при отчете
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.values = [0.0] * size
+        self.count = 0  # всего значений с начала работы
+
+    def add(self, value: float):
+        self.values[self.count % self.size] = value
+        self.count += 1
+
+    def summary(self):
+        window = np.array(self.values[:min(self.count, self.size)])
+        if not len(window):
+            return {'count': self.count}
+        summary = {
+            'count': self.count,
+            'mean': float(window.mean()),
+            'max': float(window.max()),
+        }
+        for quantile in QUANTILES:
+            summary['p{}'.format(int(quantile * 100))] = float(np.quantile(window, quantile))
+        counts = np.searchsorted(np.sort(window), BUCKETS, side='right')
+        summary['buckets'] = [[BUCKETS[i], int(counts[i])] for i in range(len(BUCKETS))]
+        return summary
+
+
+class Metrics:
+    DEFAULT_WINDOW = 600
+    DEFAULT_REPORT_INTERVAL = 1.0
+
+    def __init__(
+            self,
+            redis_instance=None,
+            window: int = DEFAULT_WINDOW,
+            report_interval: float = DEFAULT_REPORT_INTERVAL,
+            clock=time.perf_counter,
+    ):
+        """
+        :param redis_instance: куда записывать снимки показателей, None - не записывать
+        :param window: сколько последних замеров каждой фазы учитывается в гистограмме
+        """
+        self.redis_instance = redis_instance
+        self.window = window
+        self.report_interval = report_interval
+        self.clock = clock
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.next_report = None
+        self.gc_started = None
+        self.snapshot = {}
+        self.text = ''
+        # запись снимков в Redis из отдельного потока
+        self.condition = threading.Condition()
+        self.pending = None  # JSON снимка, еще не записанный в Redis
+        self.running = False
+        self.thread = None
+        self.errors = 0
+        self.dropped = 0
+        self.last_error = None
+
+    def observe(self, name: str, seconds: float):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = RollingHistogram(self.window)
+        histogram.add(seconds)
+
+    def increment(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value):
+        self.gauges[name] = value
+
+    def watch_gc(self):
+        """
+        Замер пауз сборщика мусора через gc.callbacks
+        """
+        if self.gc_callback not in gc.callbacks:
+            gc.callbacks.append(self.gc_callback)
+
+    def unwatch_gc(self):
+        if self.gc_callback in gc.callbacks:
+            gc.callbacks.remove(self.gc_callback)
+
+    def gc_callback(self, phase: str, info: dict):
+        if phase == 'start':
+            self.gc_started = time.perf_counter()
+        elif self.gc_started is not None:
+            self.observe('gc', time.perf_counter() - self.gc_started)
+            self.increment('gc_collections_{}'.format(info['generation']))
+            self.gc_started = None
+
+    def tick(self, model):
+        """
+        Вызывается после каждого шага; раз в report_interval секунд собирает снимок показателей
+        """
+        now = self.clock()
+        if self.next_report is None:
+            self.next_report = now + self.report_interval
+            return
+        if now < self.next_report:
+            return
+        self.next_report = now + self.report_interval
+        self.report(model)
+
+    def report(self, model):
+        stats = model.stats()
+        self.set_gauge('cars', stats['cars'])
+        self.set_gauge('stopped', stats['stopped'])
+        self.set_gauge('model_time', stats['time'])
+        if 'demand_waiting' in stats:
+            self.set_gauge('demand_waiting', stats['demand_waiting'])
+        active = getattr(model.engine, 'active', None)
+        if active is not None:
+            self.set_gauge('active_lanes', len(active))
+        with self.condition:
+            self.set_gauge('metrics_errors', self.errors)
+            self.set_gauge('metrics_dropped', self.dropped)
+        snapshot = {
+            'phases': {name: histogram.summary() for name, histogram in self.histograms.items()},
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+        }
+        # ссылки заменяются целиком, поток HTTP-сервера читает их без блокировки
+        self.snapshot = snapshot
+        self.text = self.to_text(snapshot)
+        if self.redis_instance is not None:
+            if not self.thread:
+                self.start()
+            data = json.dumps(snapshot)
+            with self.condition:
+                if self.pending is not None:
+                    self.dropped += 1
+                self.pending = data
+                self.condition.notify()
+
+    def start(self):
+        if self.thread:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='metrics-writer', daemon=True)
+        self.thread.start()
+
+    def close(self, timeout: float = None):
+        """
+        Останавливает поток записи после записи последнего снимка
+        """
+        if not self.thread:
+            return
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(timeout)
+        self.thread = None
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and self.pending is None:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                data = self.pending
+                self.pending = None
+            try:
+                self.redis_instance.set(METRICS_KEY, data)
+            except Exception as e:
+                # недоступный Redis не должен останавливать симуляцию; снимок пропускается
+                with self.condition:
+                    self.errors += 1
+                    self.last_error = repr(e)
+
+    @staticmethod
+    def to_text(snapshot: dict) -> str:
+        lines = []
+        for name in sorted(snapshot['phases']):
+            summary = snapshot['phases'][name]
+            lines.append('traffic_phase_seconds_count{{phase="{}"}} {}'.format(name, summary['count']))
+            if 'mean' not in summary:
+                continue
+            for key in ['mean', 'max'] + ['p{}'.format(int(quantile * 100)) for quantile in QUANTILES]:
+                lines.append('traffic_phase_seconds{{phase="{}",stat="{}"}} {:.9f}'.format(name, key, summary[key]))
+            for bound, count in summary['buckets']:
+                lines.append('traffic_phase_seconds_bucket{{phase="{}",le="{:g}"}} {}'.format(name, bound, count))
+        for name in sorted(snapshot['counters']):
+            lines.append('traffic_{} {}'.format(name, snapshot['counters'][name]))
+        for name in sorted(snapshot['gauges']):
+            lines.append('traffic_{} {}'.format(name, snapshot['gauges'][name]))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """
+    HTTP-сервер в отдельном потоке: GET /metrics - последний снимок показателей в текстовом виде
+    """
+
+    def __init__(self, metrics: Metrics, host: str = '127.0.0.1', port: int = 9100):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.text.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True)
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
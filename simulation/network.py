@@ -0,0 +1,287 @@
+"""
+Загрузка сети дорог из JSON-описания.
+
+Описание:
+    {
+        "nodes": [
+            {"id": "c0", "x": 0.0, "y": 0.0, "time_to_switch": 30.0, "phase": "y", "offset": 0.0}
+        ],
+        "roads": [
+            {"id": "r0", "from": "c0", "to": [17.5, 0.0], "spawn": "backward", "angle": 1.5708}
+        ]
+    }
+
+Конец дороги задается либо точкой [x, y], либо id узла - тогда дорога начинается на расстоянии
+CROSS_ROAD_HALF_SIZE от центра узла. Узел, к которому подходит 3 или 4 дороги, становится перекрестком,
+у узла с 1 или 2 дорогами дороги заканчиваются; список дорог узла можно задать явно полем "roads".
+spawn - направление полосы, на которой появляются авто (forward - от from к to, backward - обратно).
+phase - полосы, которым изначально горит зеленый (x или y), offset - начальное значение switch_time_passed.
+
+Описание компилируется в плоские таблицы (полосы, пути между полосами, дороги, фазы перекрестков),
+которые кешируются на диске по хешу описания, поэтому повторный запуск не выполняет геометрических
+расчетов. Id объектов назначаются по порядку в таблицах и не меняются между запусками.
+"""
+import gc
+import hashlib
+import json
+import os
+import pickle
+from typing import Union
+
+from bases import settings
+from bases.primitives import Point, Line
+from bases.context import ModelContext, current_context, DEFAULT_TIME_SWITCH
+from bases.road import RoadPart, CrossRoad, DriveLine
+from .scenarios import CROSS_ROAD_HALF_SIZE
+from .simulate import CityModel
+
+COMPILER_VERSION = 2
+PHASES = {'x': CrossRoad.ENABLED_X_LINES, 'y': CrossRoad.ENABLED_Y_LINES}
+SPAWN_DIRECTIONS = {'forward': True, 'backward': False, None: None}
+
+
+def resolve_point(value, nodes: dict, towards):
+    """
+    :param towards: точка или id узла на другом конце дороги
+    """
+    if not isinstance(value, str):
+        return Point(float(value[0]), float(value[1]))
+    node = nodes[value]
+    if isinstance(towards, str):
+        target = nodes[towards]
+        target_x, target_y = target['x'], target['y']
+    else:
+        target_x, target_y = towards
+    dx = target_x - node['x']
+    dy = target_y - node['y']
+    length = (dx * dx + dy * dy) ** 0.5
+    if not length:
+        raise ValueError('Road ends must not coincide')
+    return Point(node['x'] + dx / length * CROSS_ROAD_HALF_SIZE, node['y'] + dy / length * CROSS_ROAD_HALF_SIZE)
+
+
+def compile_network(description: dict) -> dict:
+    """
+    Строит объекты модели по описанию и раскладывает их в таблицы
+    """
+    # объекты компиляции временные и не должны занимать id контекста модели
+    with ModelContext().activate():
+        return build_tables(description)
+
+
+def build_tables(description: dict) -> dict:
+    nodes = {node['id']: node for node in description.get('nodes', [])}
+    node_roads = {node_id: list(nodes[node_id].get('roads', [])) for node_id in nodes}
+    road_names = []
+    roads = []
+    for i, road_description in enumerate(description['roads']):
+        name = road_description.get('id', i)
+        start = road_description['from']
+        end = road_description['to']
+        spawn = road_description.get('spawn')
+        if spawn not in SPAWN_DIRECTIONS:
+            raise ValueError('Unknown spawn direction {}'.format(spawn))
+        roads.append(RoadPart(
+            point_1=resolve_point(start, nodes, end),
+            point_2=resolve_point(end, nodes, start),
+            auto_create_for_direction=SPAWN_DIRECTIONS[spawn],
+            rotation_angle=road_description.get('angle'),
+        ))
+        road_names.append(name)
+        for end_point in (start, end):
+            if isinstance(end_point, str) and name not in node_roads[end_point]:
+                node_roads[end_point].append(name)
+
+    road_index = {road_names[i]: i for i in range(len(road_names))}
+    cross_roads = []
+    phases = []
+    for node_id, node in nodes.items():
+        # к узлу с 1 или 2 дорогами перекресток не строится: дороги просто заканчиваются у узла
+        if len(node_roads[node_id]) < 3:
+            continue
+        if len(node_roads[node_id]) > 4:
+            raise ValueError('Node {} has {} roads, max is 4'.format(node_id, len(node_roads[node_id])))
+        cross_road = CrossRoad(
+            roads=[roads[road_index[name]] for name in node_roads[node_id]],
+            position=Point(float(node['x']), float(node['y'])),
+        )
+        cross_roads.append(cross_road)
+        phases.append({
+            'name': node_id,
+            'time_to_switch': float(node.get('time_to_switch', DEFAULT_TIME_SWITCH)),
+            'state': PHASES[node.get('phase', 'y')],
+            'switch_time_passed': float(node.get('offset', 0.0)),
+        })
+
+    lanes = []
+    for road in roads:
+        lanes.extend(road.forward_road_lines)
+        lanes.extend(road.backward_road_lines)
+    for cross_road in cross_roads:
+        lanes.extend(cross_road.lines)
+    lane_index = {lanes[i]: i for i in range(len(lanes))}
+    road_position = {roads[i]: i for i in range(len(roads))}
+
+    def indices(drive_lines):
+        return [lane_index[drive_line] for drive_line in drive_lines]
+
+    return {
+        'version': COMPILER_VERSION,
+        # x1, y1, x2, y2, длина, единичный вектор x, y, direction, auto_add
+        'lanes': [
+            [
+                drive_line.line.p1.x, drive_line.line.p1.y, drive_line.line.p2.x, drive_line.line.p2.y,
+                drive_line.length, drive_line.line_vector.x, drive_line.line_vector.y,
+                drive_line.direction, drive_line.auto_add_car,
+            ]
+            for drive_line in lanes
+        ],
+        'paths': [indices(drive_line.paths) for drive_line in lanes],
+        'roads': [
+            {
+                'name': road_names[i],
+                'p1': [roads[i].line.p1.x, roads[i].line.p1.y],
+                'p2': [roads[i].line.p2.x, roads[i].line.p2.y],
+                'angle': roads[i].rotation_angle,
+                'lines': indices(roads[i].forward_road_lines + roads[i].backward_road_lines),
+            }
+            for i in range(len(roads))
+        ],
+        'cross_roads': [
+            {
+                'name': phases[i]['name'],
+                'position': [cross_roads[i].position.x, cross_roads[i].position.y],
+                'roads': [road_position[road] for road in cross_roads[i].roads],
+                'incoming': indices(cross_roads[i].incoming_lines),
+                'outcoming': indices(cross_roads[i].outcoming_lines),
+                'x_lines': indices(cross_roads[i].x_vector_lines),
+                'y_lines': indices(cross_roads[i].y_vector_lines),
+                'lines': indices(cross_roads[i].lines),
+                'time_to_switch': phases[i]['time_to_switch'],
+                'state': phases[i]['state'],
+                'switch_time_passed': phases[i]['switch_time_passed'],
+            }
+            for i in range(len(cross_roads))
+        ],
+    }
+
+
+def build_objects(compiled: dict):
+    """
+    Создает полосы, дороги и перекрестки по скомпилированным таблицам без геометрических расчетов
+    в текущем контексте модели (bases.context.current_context)
+    :return: полосы, дороги, перекрестки в порядке таблиц; id объекта - номер строки таблицы + 1
+    """
+    lanes = []
+    for i, (x1, y1, x2, y2, length, vector_x, vector_y, direction, auto_add) in enumerate(compiled['lanes']):
+        drive_line = DriveLine(direction=direction, auto_add=auto_add)
+        drive_line.set_geometry(Line(Point(x1, y1), Point(x2, y2)), length, Point(vector_x, vector_y))
+        drive_line.id = i + 1
+        lanes.append(drive_line)
+    for i, paths in enumerate(compiled['paths']):
+        lanes[i].paths = [lanes[j] for j in paths]
+
+    roads = []
+    for i, road_table in enumerate(compiled['roads']):
+        road = RoadPart(
+            point_1=Point(*road_table['p1']),
+            point_2=Point(*road_table['p2']),
+            lines=[lanes[j] for j in road_table['lines']],
+            rotation_angle=road_table['angle'],
+            place_lines=False,
+        )
+        road.id = i + 1
+        roads.append(road)
+
+    cross_roads = []
+    semaphore_id = 0
+    for i, table in enumerate(compiled['cross_roads']):
+        cross_road = CrossRoad.from_lines(
+            roads=[roads[j] for j in table['roads']],
+            position=Point(*table['position']),
+            incoming_lines=[lanes[j] for j in table['incoming']],
+            outcoming_lines=[lanes[j] for j in table['outcoming']],
+            x_vector_lines=[lanes[j] for j in table['x_lines']],
+            y_vector_lines=[lanes[j] for j in table['y_lines']],
+            lines=[lanes[j] for j in table['lines']],
+        )
+        cross_road.id = i + 1
+        for drive_line in cross_road.incoming_lines:
+            semaphore_id += 1
+            drive_line.semaphore.id = semaphore_id
+        cross_road.time_to_switch = table['time_to_switch']
+        if cross_road.state != table['state']:
+            cross_road.switch_state()
+        cross_road.switch_time_passed = table['switch_time_passed']
+        cross_roads.append(cross_road)
+
+    # новые объекты не должны получать id, совпадающие с id загруженной сети
+    current_context().reserve_ids(
+        road_count=len(roads),
+        cross_road_count=len(cross_roads),
+        drive_line_count=len(lanes),
+        semaphore_count=semaphore_id,
+    )
+    return lanes, roads, cross_roads
+
+
+def instantiate(compiled: dict, engine: int = CityModel.ENGINE_OBJECT, seed: int = None) -> CityModel:
+    """
+    Создает модель по скомпилированным таблицам без геометрических расчетов
+    """
+    lanes, roads, cross_roads = build_objects(compiled)
+    simulation_model = CityModel(engine=engine, seed=seed)
+    for i in range(len(roads)):
+        simulation_model.add_road(roads[i])
+    for i in range(len(cross_roads)):
+        simulation_model.add_cross_road(cross_roads[i])
+    return simulation_model
+
+
+def network_key(description: dict) -> str:
+    data = json.dumps({'version': COMPILER_VERSION, 'network': description}, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def read_description(source: Union[str, dict]) -> dict:
+    if isinstance(source, dict):
+        return source
+    with open(source) as f:
+        return json.load(f)
+
+
+def load_compiled(source: Union[str, dict], cache_dir: str = settings.NETWORK_CACHE_DIR) -> dict:
+    """
+    :param source: путь к файлу описания или само описание
+    :param cache_dir: каталог кеша скомпилированных сетей, None - без кеша
+    """
+    description = read_description(source)
+    if not cache_dir:
+        return compile_network(description)
+    path = os.path.join(cache_dir, network_key(description) + '.pickle')
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    compiled = compile_network(description)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return compiled
+
+
+def load_network(
+        source: Union[str, dict],
+        engine: int = CityModel.ENGINE_OBJECT,
+        seed: int = None,
+        cache_dir: str = settings.NETWORK_CACHE_DIR,
+) -> CityModel:
+    # сборщик мусора на создании десятков тысяч объектов только тратит время
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return instantiate(load_compiled(source, cache_dir), engine=engine, seed=seed)
+    finally:
+        if gc_enabled:
+            gc.enable()
@@ -0,0 +1,282 @@
+"""
+Публикация состояния модели в Redis.
+
+FullPublisher каждый раз записывает полный снимок модели в ключ traffic_model_data.
+
+BinaryPublisher каждый раз записывает кадр в бинарном формате (см. simulation.frames)
+в ключ traffic_model_frame.
+
+DeltaPublisher записывает статическую часть (дороги, перекрестки, светофоры) один раз в ключ
+traffic_model_topology вместе с номером версии, а каждый шаг отправляет в канал traffic_model_delta
+только изменения: появившиеся, переместившиеся и покинувшие модель авто, переключившиеся светофоры.
+Периодически вместо изменений публикуется полный кадр (ключ traffic_model_keyframe и тот же канал).
+Подключившийся клиент читает topology и keyframe, после чего применяет изменения с tick больше,
+чем у прочитанного кадра.
+
+Публикация делится на подготовку (prepare - сериализация модели в команды Redis, выполняется в потоке
+симуляции, пока модель не изменилась) и отправку команд. AsyncPublisher отправляет команды из отдельного
+потока, чтобы задержки Redis не влияли на шаг симуляции.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+from .simulate import CityModel
+
+
+def send_commands(redis_instance, commands, metrics=None):
+    """
+    :param commands: команды Redis - кортежи (имя метода, ключ или канал, значение), отправляются одним пакетом
+    :param metrics: simulation.metrics.Metrics для замера времени отправки, None - без замера
+    """
+    started = time.perf_counter()
+    pipeline = redis_instance.pipeline(transaction=False)
+    for method, key, value in commands:
+        getattr(pipeline, method)(key, value)
+    pipeline.execute()
+    if metrics is not None:
+        metrics.observe('publish', time.perf_counter() - started)
+
+
+class FullPublisher:
+    DATA_KEY = 'traffic_model_data'
+
+    def __init__(self, redis_instance, metrics=None):
+        self.redis_instance = redis_instance
+        self.metrics = metrics
+
+    def prepare(self, model: CityModel):
+        started = time.perf_counter()
+        data = model.to_dict()
+        encoding = time.perf_counter()
+        encoded = json.dumps(data)
+        if self.metrics is not None:
+            self.metrics.observe('to_dict', encoding - started)
+            self.metrics.observe('json', time.perf_counter() - encoding)
+        return [('set', self.DATA_KEY, encoded)]
+
+    def publish(self, model: CityModel):
+        send_commands(self.redis_instance, self.prepare(model), self.metrics)
+
+
+class BinaryPublisher:
+    FRAME_KEY = 'traffic_model_frame'
+
+    def __init__(self, redis_instance, metrics=None):
+        self.redis_instance = redis_instance
+        self.metrics = metrics
+
+    def prepare(self, model: CityModel):
+        started = time.perf_counter()
+        frame = model.to_frame()
+        if self.metrics is not None:
+            self.metrics.observe('to_dict', time.perf_counter() - started)
+        return [('set', self.FRAME_KEY, frame)]
+
+    def publish(self, model: CityModel):
+        send_commands(self.redis_instance, self.prepare(model), self.metrics)
+
+
+class DeltaPublisher:
+    TOPOLOGY_KEY = 'traffic_model_topology'
+    KEYFRAME_KEY = 'traffic_model_keyframe'
+    DELTA_CHANNEL = 'traffic_model_delta'
+    DEFAULT_KEYFRAME_INTERVAL = 300  # полный кадр раз в 300 публикаций (5 секунд при 60 Гц)
+    INCREMENTAL = True  # кадр - изменения относительно предыдущего (см. AsyncPublisher)
+
+    def __init__(self, redis_instance, keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL, metrics=None):
+        self.redis_instance = redis_instance
+        self.keyframe_interval = keyframe_interval
+        self.metrics = metrics
+        self.topology_version = None
+        self.frames_since_keyframe = 0
+
+    def prepare(self, model: CityModel):
+        started = time.perf_counter()
+        topology = None
+        keyframe = False
+        if model.topology_version != self.topology_version:
+            self.topology_version = model.topology_version
+            topology = model.topology_to_dict()
+            keyframe = True
+        if self.frames_since_keyframe >= self.keyframe_interval:
+            keyframe = True
+
+        # признаки изменений сбрасываются и при публикации полного кадра
+        changes = model.collect_changes()
+        if keyframe:
+            changes = model.keyframe_to_dict()
+            self.frames_since_keyframe = 0
+        else:
+            self.frames_since_keyframe += 1
+        encoding = time.perf_counter()
+
+        commands = []
+        if topology is not None:
+            commands.append(('set', self.TOPOLOGY_KEY, json.dumps(topology)))
+        frame = json.dumps(changes)
+        if keyframe:
+            commands.append(('set', self.KEYFRAME_KEY, frame))
+        commands.append(('publish', self.DELTA_CHANNEL, frame))
+        if self.metrics is not None:
+            self.metrics.observe('to_dict', encoding - started)
+            self.metrics.observe('json', time.perf_counter() - encoding)
+        return commands
+
+    def frame_dropped(self, commands):
+        """
+        Изменения из неотправленного кадра потеряны: следующим публикуется полный кадр
+        """
+        self.frames_since_keyframe = self.keyframe_interval
+        for method, key, value in commands:
+            if key == self.TOPOLOGY_KEY:
+                self.topology_version = None
+
+    def publish(self, model: CityModel):
+        send_commands(self.redis_instance, self.prepare(model), self.metrics)
+
+
+class AsyncPublisher:
+    """
+    Отправка подготовленных кадров в Redis из отдельного потока.
+
+    В потоке симуляции publish только подготавливает кадр (publisher.prepare) и кладет его в очередь
+    на queue_size кадров. Поток отправки забирает все накопившиеся кадры и отправляет их одним пакетом.
+    Если Redis не успевает и очередь заполнена, самый старый кадр выбрасывается (publisher.frame_dropped,
+    если есть), а симуляция не ждет. Соединения берутся из пула redis_instance.
+
+    Кадры publisher с INCREMENTAL (DeltaPublisher) без потерянного кадра бесполезны, поэтому при потере
+    кадра выбрасываются и все кадры после него, уже стоящие в очереди или подготавливаемые в этот момент:
+    следующим отправляется полный кадр.
+    """
+    DEFAULT_QUEUE_SIZE = 4
+    ERROR_DELAY = 1.0  # пауза после ошибки отправки, секунд
+
+    queue: deque
+
+    def __init__(self, publisher, redis_instance, queue_size: int = DEFAULT_QUEUE_SIZE):
+        """
+        :param publisher: FullPublisher, BinaryPublisher, DeltaPublisher или simulation.viewports.ViewportPublisher
+        """
+        if queue_size < 1:
+            raise ValueError('Queue size must be positive')
+        self.publisher = publisher
+        self.redis_instance = redis_instance
+        self.queue_size = queue_size
+        self.queue = deque()
+        self.lost = []  # выброшенные и неотправленные кадры, о которых еще не сообщено publisher
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.prepared = 0
+        self.published = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self.max_send_time = 0.0
+
+    def start(self):
+        if self.thread:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='redis-publisher', daemon=True)
+        self.thread.start()
+
+    def close(self, timeout: float = None):
+        """
+        Останавливает поток отправки после отправки уже подготовленных кадров
+        """
+        if not self.thread:
+            return
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(timeout)
+        self.thread = None
+
+    def publish(self, model: CityModel):
+        if not self.thread:
+            self.start()
+        with self.condition:
+            lost = self.lost
+            self.lost = []
+            dropped = self.dropped
+        # publisher меняет свое состояние только в потоке симуляции
+        frame_dropped = getattr(self.publisher, 'frame_dropped', None)
+        if frame_dropped:
+            for commands in lost:
+                frame_dropped(commands)
+        metrics = getattr(self.publisher, 'metrics', None)
+        if lost and metrics is not None:
+            metrics.increment('frames_dropped', len(lost))
+        commands = self.publisher.prepare(model)
+        incremental = getattr(self.publisher, 'INCREMENTAL', False)
+        with self.condition:
+            self.prepared += 1
+            if incremental and (self.dropped != dropped or len(self.queue) >= self.queue_size):
+                # кадр подготовлен после потерянного или вытесняет кадр из очереди: изменения из очереди
+                # и этого кадра без потерянного не применить, следующий кадр будет полным
+                self.drop_queued()
+                self.lost.append(commands)
+                self.dropped += 1
+                return
+            if len(self.queue) >= self.queue_size:
+                self.lost.append(self.queue.popleft())
+                self.dropped += 1
+            self.queue.append(commands)
+            self.condition.notify()
+
+    def drop_queued(self):
+        """
+        Выбрасывает все кадры очереди; вызывается под condition
+        """
+        self.lost.extend(self.queue)
+        self.dropped += len(self.queue)
+        self.queue.clear()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                frames = list(self.queue)
+                self.queue.clear()
+            commands = []
+            for frame in frames:
+                commands.extend(frame)
+            started = time.perf_counter()
+            try:
+                send_commands(self.redis_instance, commands, getattr(self.publisher, 'metrics', None))
+            except Exception as e:
+                # кадры не отправлены; ошибка сети не должна останавливать публикацию
+                with self.condition:
+                    self.errors += 1
+                    self.dropped += len(frames)
+                    self.lost.extend(frames)
+                    if getattr(self.publisher, 'INCREMENTAL', False):
+                        self.drop_queued()
+                    self.last_error = repr(e)
+                    running = self.running
+                if running:
+                    time.sleep(self.ERROR_DELAY)
+                continue
+            elapsed = time.perf_counter() - started
+            with self.condition:
+                self.published += len(frames)
+                if elapsed > self.max_send_time:
+                    self.max_send_time = elapsed
+
+    def stats(self):
+        with self.condition:
+            return {
+                'prepared': self.prepared,
+                'published': self.published,
+                'dropped': self.dropped,
+                'queued': len(self.queue),
+                'errors': self.errors,
+                'last_error': self.last_error,
+                'max_send_time': self.max_send_time,
+            }
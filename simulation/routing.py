@@ -0,0 +1,198 @@
+"""
+Маршрутизация авто к пункту назначения.
+
+Пункт назначения - полоса-выезд из модели (полоса без путей дальше). Граф - полосы и их paths,
+вес полосы - время проезда: длина / car_speed контекста полосы плюс QUEUE_PENALTY за каждое стоящее авто.
+
+При компиляции для каждого выезда строится таблица следующей полосы (next hop) по времени
+проезда свободной сети. Раз в reweight_interval секунд модельного времени веса пересчитываются
+по очередям на полосах; если они изменились больше чем на tolerance, таблицы всех выездов с новыми
+весами строятся в фоне по rebuild_batch таблиц за шаг и заменяют текущие разом, когда готовы все.
+Выбор следующей полосы - только обращение к таблице по (полоса, выезд), без поиска пути.
+"""
+import heapq
+from array import array
+from typing import Dict, List
+
+from bases.road import DriveLine
+
+NO_HOP = -1
+
+
+class Router:
+    DEFAULT_REWEIGHT_INTERVAL = 30.0
+    DEFAULT_REBUILD_BATCH = 16
+    DEFAULT_TOLERANCE = 0.1
+    QUEUE_PENALTY = 2.0  # секунд ожидания на каждое стоящее на полосе авто
+
+    lanes: List[DriveLine]
+    index: Dict[DriveLine, int]
+    destinations: List[int]  # индексы полос-выездов
+    static: List[array]  # next hop по свободной сети для каждого выезда
+    tables: List[array]  # next hop по текущим весам для каждого выезда
+
+    def __init__(
+            self,
+            reweight_interval: float = DEFAULT_REWEIGHT_INTERVAL,
+            rebuild_batch: int = DEFAULT_REBUILD_BATCH,
+            tolerance: float = DEFAULT_TOLERANCE,
+    ):
+        """
+        :param reweight_interval: период пересчета весов в секундах модельного времени, None - не пересчитывать
+        :param rebuild_batch: сколько таблиц строится за шаг после пересчета весов, None - все сразу
+        :param tolerance: относительное изменение веса полосы, после которого таблицы строятся заново
+        """
+        if rebuild_batch is not None and rebuild_batch < 1:
+            raise ValueError('Rebuild batch must be positive')
+        self.reweight_interval = reweight_interval
+        self.rebuild_batch = rebuild_batch
+        self.tolerance = tolerance
+        self.lanes = []
+        self.index = {}
+        self.destinations = []
+        self.destination_index = {}
+        self.reverse = []
+        self.free_weights = []
+        self.weights = []
+        self.static = []
+        self.tables = []
+        self.pending_weights = None  # веса таблиц, которые строятся; None - построение не идет
+        self.pending_tables = []
+        self.reachable = {}
+        self.time_passed = 0.0
+        self.reweights = 0
+
+    def compile(self, lanes: List[DriveLine]):
+        """
+        Строит граф полос и таблицы next hop по свободной сети; вызывается при изменении топологии
+        """
+        self.lanes = lanes
+        self.index = {lanes[i]: i for i in range(len(lanes))}
+        self.reverse = [[] for _ in range(len(lanes))]
+        self.destinations = []
+        for i in range(len(lanes)):
+            paths = lanes[i].paths
+            if not paths:
+                self.destinations.append(i)
+            for j in range(len(paths)):
+                target = self.index.get(paths[j])
+                if target is not None:
+                    self.reverse[target].append(i)
+        self.destination_index = {lanes[self.destinations[k]]: k for k in range(len(self.destinations))}
+        self.free_weights = [lanes[i].length / lanes[i].context.car_speed for i in range(len(lanes))]
+        self.weights = self.free_weights
+        self.static = [self.shortest_tree(destination, self.free_weights) for destination in self.destinations]
+        self.tables = self.static
+        self.pending_weights = None
+        self.pending_tables = []
+        self.reachable = {}
+        for i in range(len(lanes)):
+            lanes[i].router = self
+
+    def shortest_tree(self, destination: int, weights: List[float]) -> array:
+        """
+        Дейкстра по обратным ребрам от выезда
+        :return: для каждой полосы индекс следующей полосы на кратчайшем пути, NO_HOP - пути нет
+        """
+        count = len(self.lanes)
+        distance = [float('inf')] * count
+        next_hop = array('i', [NO_HOP]) * count
+        distance[destination] = weights[destination]
+        heap = [(distance[destination], destination)]
+        while heap:
+            current, i = heapq.heappop(heap)
+            if current > distance[i]:
+                continue
+            previous = self.reverse[i]
+            for j in range(len(previous)):
+                k = previous[j]
+                candidate = current + weights[k]
+                if candidate < distance[k]:
+                    distance[k] = candidate
+                    next_hop[k] = i
+                    heapq.heappush(heap, (candidate, k))
+        return next_hop
+
+    def next_lane(self, drive_line: DriveLine, destination: DriveLine):
+        """
+        :return: следующая полоса на пути к destination, None - выезд недостижим
+        """
+        k = self.destination_index.get(destination)
+        if k is None:
+            return None
+        j = self.tables[k][self.index[drive_line]]
+        return self.lanes[j] if j != NO_HOP else None
+
+    def choose_destination(self, drive_line: DriveLine):
+        """
+        :return: случайный выезд, достижимый с полосы, None - недостижимых нет
+        """
+        destinations = self.reachable.get(drive_line)
+        if destinations is None:
+            i = self.index[drive_line]
+            destinations = [
+                self.lanes[self.destinations[k]] for k in range(len(self.destinations))
+                if self.static[k][i] != NO_HOP
+            ]
+            self.reachable[drive_line] = destinations
+        if not destinations:
+            return None
+        return destinations[drive_line.context.random.randint(0, len(destinations) - 1)]
+
+    def simulate(self, timedelta: float):
+        if self.reweight_interval is None:
+            return
+        self.time_passed += timedelta
+        if self.time_passed >= self.reweight_interval:
+            self.time_passed = 0.0
+            self.reweight()
+        if self.pending_weights is not None:
+            self.rebuild(self.rebuild_batch)
+
+    def reweight(self):
+        """
+        Пересчет весов по очередям; таблицы строятся заново, только если веса заметно изменились
+        """
+        # сравнение с весами таблиц, которые уже строятся, чтобы не начинать построение заново без причины
+        reference = self.weights if self.pending_weights is None else self.pending_weights
+        weights = []
+        changed = False
+        for i in range(len(self.lanes)):
+            queue = self.lanes[i].queue
+            stopped = 0
+            for car in queue:
+                if car.state == car.STATE_STOPPED:
+                    stopped += 1
+            weight = self.free_weights[i] + stopped * self.QUEUE_PENALTY
+            if abs(weight - reference[i]) > self.tolerance * reference[i]:
+                changed = True
+            weights.append(weight)
+        if not changed:
+            return
+        self.pending_weights = weights
+        self.pending_tables = []
+
+    def rebuild(self, count: int = None):
+        """
+        Строит следующие count таблиц по pending_weights; когда готовы таблицы всех выездов,
+        они заменяют текущие
+        :param count: None - все оставшиеся таблицы
+        """
+        start = len(self.pending_tables)
+        end = len(self.destinations) if count is None else min(len(self.destinations), start + count)
+        for k in range(start, end):
+            self.pending_tables.append(self.shortest_tree(self.destinations[k], self.pending_weights))
+        if len(self.pending_tables) == len(self.destinations):
+            self.tables = self.pending_tables
+            self.weights = self.pending_weights
+            self.pending_weights = None
+            self.pending_tables = []
+            self.reweights += 1
+
+    def stats(self):
+        return {
+            'destinations': len(self.destinations),
+            'rebuilding': self.pending_weights is not None,
+            'rebuilt_tables': len(self.pending_tables),
+            'reweights': self.reweights,
+        }
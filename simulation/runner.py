@@ -0,0 +1,185 @@
+"""
+Пакетный запуск сценариев без публикации: модель строится по имени сценария, прогоняется
+заданное модельное время с фиксированным шагом и возвращает сводные показатели.
+Перебор параметров выполняется в пуле процессов или потоков (у каждой модели свой контекст
+bases.context.ModelContext), результаты кешируются на диске по хешу сценария и параметров.
+"""
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, List
+
+from bases import settings
+from bases.context import ModelContext
+from .scenarios import SCENARIOS
+from .scheduler import Scheduler
+from .simulate import CityModel
+
+RUNNER_VERSION = 2  # увеличивается при изменении модели, чтобы не использовать устаревший кеш
+
+# параметры сценария - параметры контекста модели
+PARAMETERS = ModelContext.PARAMETERS
+
+
+class Scenario:
+    name: str
+    duration: float
+    step: float
+    engine: int
+    seed: int
+    params: Dict[str, float]
+    sample_interval: float
+
+    def __init__(
+            self,
+            name: str = 'default',
+            duration: float = 3600.0,
+            step: float = Scheduler.DEFAULT_STEP,
+            engine: int = CityModel.ENGINE_OBJECT,
+            seed: int = 0,
+            params: Dict[str, float] = None,
+            sample_interval: float = 1.0,
+    ):
+        """
+        :param name: имя сценария из SCENARIOS
+        :param duration: длительность в секундах модельного времени
+        :param params: значения из PARAMETERS, например {'time_switch': 20.0}
+        :param sample_interval: период замера очередей в секундах модельного времени
+        """
+        if name not in SCENARIOS:
+            raise ValueError('Unknown scenario {}'.format(name))
+        params = dict(params or {})
+        for param in params:
+            if param not in PARAMETERS:
+                raise ValueError('Unknown parameter {}'.format(param))
+        self.name = name
+        self.duration = duration
+        self.step = step
+        self.engine = engine
+        self.seed = seed
+        self.params = params
+        self.sample_interval = sample_interval
+
+    def with_params(self, **params):
+        merged = dict(self.params)
+        merged.update(params)
+        return Scenario(
+            name=self.name,
+            duration=self.duration,
+            step=self.step,
+            engine=self.engine,
+            seed=self.seed,
+            params=merged,
+            sample_interval=self.sample_interval,
+        )
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'duration': self.duration,
+            'step': self.step,
+            'engine': self.engine,
+            'seed': self.seed,
+            'params': self.params,
+            'sample_interval': self.sample_interval,
+        }
+
+    def key(self):
+        data = json.dumps({'version': RUNNER_VERSION, 'scenario': self.to_dict()}, sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+
+def run_scenario(scenario: Scenario) -> dict:
+    """
+    Модель строится в своем контексте, поэтому сценарии можно запускать и в потоках одного процесса
+    """
+    samples = []
+    with ModelContext(seed=scenario.seed, **scenario.params).activate():
+        model = SCENARIOS[scenario.name](engine=scenario.engine, seed=scenario.seed)
+    scheduler = Scheduler(
+        model,
+        step=scenario.step,
+        mode=Scheduler.MODE_HEADLESS,
+        publish=lambda simulation_model: samples.append(simulation_model.stats()),
+        publish_rate=1.0 / scenario.sample_interval,
+    )
+    started = time.perf_counter()
+    scheduler.run(duration=scenario.duration)
+    wall_time = time.perf_counter() - started
+    stats = model.stats()
+    cleared = stats['cleared']
+    return {
+        'spawned': stats['spawned'],
+        'cleared': cleared,
+        'cars': stats['cars'],
+        'mean_wait_time': stats['cleared_wait_time'] / cleared if cleared else 0.0,
+        'mean_queue': sum(sample['stopped'] for sample in samples) / len(samples) if samples else 0.0,
+        'max_queue': max([sample['max_queue'] for sample in samples] + [0]),
+        'ticks': stats['tick'],
+        'wall_time': wall_time,
+    }
+
+
+def expand_grid(scenario: Scenario, grid: Dict[str, List[float]]) -> List[Scenario]:
+    """
+    Все сочетания значений параметров, например {'time_switch': [10, 20], 'car_speed': [1.5, 2.0]}
+    """
+    names = sorted(grid)
+    return [
+        scenario.with_params(**dict(zip(names, values)))
+        for values in itertools.product(*[grid[name] for name in names])
+    ]
+
+
+def load_cached(cache_dir: str, key: str):
+    path = os.path.join(cache_dir, key + '.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)['metrics']
+
+
+def store_cached(cache_dir: str, scenario: Scenario, metrics: dict):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, scenario.key() + '.json')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'scenario': scenario.to_dict(), 'metrics': metrics}, f)
+    os.replace(tmp_path, path)
+
+
+def run_sweep(
+        scenarios: List[Scenario],
+        workers: int = None,
+        cache_dir: str = settings.RUNNER_CACHE_DIR,
+        threads: bool = False,
+):
+    """
+    :param workers: количество процессов, None - по числу ядер
+    :param threads: запускать сценарии в потоках этого процесса вместо отдельных процессов
+    :param cache_dir: каталог кеша результатов, None - без кеша
+    :return: список {'scenario', 'metrics', 'cached'} в порядке scenarios
+    """
+    results = [None] * len(scenarios)
+    pending = []
+    for i in range(len(scenarios)):
+        metrics = load_cached(cache_dir, scenarios[i].key()) if cache_dir else None
+        if metrics is not None:
+            results[i] = {'scenario': scenarios[i].to_dict(), 'metrics': metrics, 'cached': True}
+        else:
+            pending.append(i)
+
+    if pending:
+        executor_class = ThreadPoolExecutor if threads else ProcessPoolExecutor
+        with executor_class(max_workers=workers) as executor:
+            futures = {executor.submit(run_scenario, scenarios[i]): i for i in pending}
+            for future in as_completed(futures):
+                i = futures[future]
+                metrics = future.result()
+                if cache_dir:
+                    store_cached(cache_dir, scenarios[i], metrics)
+                results[i] = {'scenario': scenarios[i].to_dict(), 'metrics': metrics, 'cached': False}
+    return results
@@ -0,0 +1,184 @@
+import math
+
+from bases import RoadPart, CrossRoad
+from bases.car import Car, CAR_GAP
+from bases.primitives import Point
+from utils import gen_lines_around
+from .simulate import CityModel
+
+CROSS_ROAD_HALF_SIZE = 2.5  # расстояние от центра перекрестка до начала дороги
+
+
+def build_default_city(engine: int = CityModel.ENGINE_OBJECT, seed: int = None) -> CityModel:
+    """
+    Пять перекрестков: центральный (0, 0) и четыре вокруг него
+    """
+    roads = [
+        RoadPart(point_1=Point(2.5, 0.0), point_2=Point(17.5, 0.0)),
+        RoadPart(point_1=Point(-2.5, 0.0), point_2=Point(-17.5, 0.0), auto_create_for_direction=False),
+        RoadPart(
+            point_1=Point(x=0.0, y=-2.5),
+            point_2=Point(x=0.0, y=-17.5),
+            rotation_angle=math.pi/2,
+        ),
+        RoadPart(
+            point_1=Point(x=0.0, y=2.5),
+            point_2=Point(x=0.0, y=17.5),
+            rotation_angle=-math.pi/2,
+        ),
+    ]
+
+    line1, line2, line3, line4 = gen_lines_around(Point(0.0, 20.0))
+    roads.append(RoadPart(point_1=line1.p1, point_2=line1.p2))  # 4
+    roads.append(RoadPart(point_1=line2.p1, point_2=line2.p2, auto_create_for_direction=False))  # 5
+    roads.append(RoadPart(point_1=line4.p1, point_2=line4.p2, auto_create_for_direction=False, rotation_angle=math.pi/2))  # 6
+
+    line1, line2, line3, line4 = gen_lines_around(Point(0.0, -20.0))
+
+    roads.append(RoadPart(point_1=line1.p1, point_2=line1.p2, auto_create_for_direction=False))  # 7
+    roads.append(RoadPart(point_1=line2.p1, point_2=line2.p2, auto_create_for_direction=False))  # 8
+    roads.append(RoadPart(point_1=line3.p1, point_2=line3.p2, auto_create_for_direction=False, rotation_angle=math.pi/2))  # 9
+
+    line1, line2, line3, line4 = gen_lines_around(Point(20.0, 0.0))
+
+    roads.append(RoadPart(point_1=line1.p1, point_2=line1.p2, auto_create_for_direction=False))  # 10
+    roads.append(RoadPart(point_1=line3.p1, point_2=line3.p2, rotation_angle=math.pi/2))  # 11
+    roads.append(RoadPart(point_1=line4.p1, point_2=line4.p2, rotation_angle=math.pi/2))  # 12
+
+    line1, line2, line3, line4 = gen_lines_around(Point(20.0, 20.0))
+
+    roads.append(RoadPart(point_1=line1.p1, point_2=line1.p2, auto_create_for_direction=False))  # 13
+    roads.append(
+        RoadPart(
+            point_1=line4.p1, point_2=line4.p2, auto_create_for_direction=False, rotation_angle=math.pi/2
+        )
+    )  # 14
+
+    cross_roads = [
+        CrossRoad(position=Point(0.0, 0.0), roads=[roads[0], roads[1], roads[2], roads[3]]),
+        CrossRoad(position=Point(0.0, 20.0), roads=[roads[3], roads[4], roads[5], roads[6]]),
+        CrossRoad(position=Point(0.0, -20.0), roads=[roads[2], roads[7], roads[8], roads[9]]),
+        CrossRoad(position=Point(20.0, 0.0), roads=[roads[0], roads[10], roads[11], roads[12]]),
+        CrossRoad(position=Point(20.0, 20.0), roads=[roads[13], roads[4], roads[12], roads[14]]),
+    ]
+
+    simulation_model = CityModel(engine=engine, seed=seed)
+    for i in range(len(roads)):
+        simulation_model.add_road(roads[i])
+
+    for i in range(len(cross_roads)):
+        simulation_model.add_cross_road(cross_roads[i])
+
+    return simulation_model
+
+
+def build_grid_city(
+        rows: int,
+        cols: int,
+        spacing: float = 20.0,
+        t_junctions: bool = False,
+        engine: int = CityModel.ENGINE_OBJECT,
+        seed: int = None,
+) -> CityModel:
+    """
+    Прямоугольная сетка rows x cols перекрестков. С тех сторон, где у перекрестка нет соседа,
+    добавляются тупиковые въезды длиной в одну дорогу, на которых появляются авто.
+    :param spacing: расстояние между центрами соседних перекрестков
+    :param t_junctions: убрать лишние въезды, чтобы крайние перекрестки стали Т-образными
+    """
+    if rows < 1 or cols < 1:
+        raise ValueError('Grid must have at least one cross road')
+    half = CROSS_ROAD_HALF_SIZE
+    horizontal = {}  # (i, j) -> дорога между (i, j) и (i, j + 1)
+    vertical = {}  # (i, j) -> дорога между (i, j) и (i + 1, j)
+    roads = []
+    cross_roads = []
+    for i in range(rows):
+        for j in range(cols):
+            x = j * spacing
+            y = i * spacing
+            if j + 1 < cols:
+                horizontal[(i, j)] = RoadPart(
+                    point_1=Point(x + half, y), point_2=Point(x + spacing - half, y)
+                )
+                roads.append(horizontal[(i, j)])
+            if i + 1 < rows:
+                vertical[(i, j)] = RoadPart(
+                    point_1=Point(x, y + half), point_2=Point(x, y + spacing - half), rotation_angle=math.pi / 2
+                )
+                roads.append(vertical[(i, j)])
+
+    for i in range(rows):
+        for j in range(cols):
+            x = j * spacing
+            y = i * spacing
+            node_roads = []
+            # стороны без соседа: направление въезда и угол поворота дороги
+            free_sides = []
+            for key, side_roads, side in [
+                ((i, j), horizontal, ((1, 0), None)),
+                ((i, j - 1), horizontal, ((-1, 0), None)),
+                ((i, j), vertical, ((0, 1), math.pi / 2)),
+                ((i - 1, j), vertical, ((0, -1), math.pi / 2)),
+            ]:
+                if key in side_roads:
+                    node_roads.append(side_roads[key])
+                else:
+                    free_sides.append(side)
+            if t_junctions:
+                while free_sides and len(node_roads) + len(free_sides) > 3:
+                    free_sides.pop()
+            for (dx, dy), angle in free_sides:
+                # въезд: полоса к перекрестку (обратное направление) создает авто
+                stub = RoadPart(
+                    point_1=Point(x + dx * half, y + dy * half),
+                    point_2=Point(x + dx * (spacing - half), y + dy * (spacing - half)),
+                    auto_create_for_direction=False,
+                    rotation_angle=angle,
+                )
+                roads.append(stub)
+                node_roads.append(stub)
+            cross_roads.append(CrossRoad(position=Point(x, y), roads=node_roads))
+
+    simulation_model = CityModel(engine=engine, seed=seed)
+    for i in range(len(roads)):
+        simulation_model.add_road(roads[i])
+    for i in range(len(cross_roads)):
+        simulation_model.add_cross_road(cross_roads[i])
+    return simulation_model
+
+
+def populate_city(simulation_model: CityModel, density: float) -> int:
+    """
+    Расставляет неподвижные авто на полосах дорог
+    :param density: доля от наибольшего количества авто, помещающихся на полосе (0..1)
+    :return: количество добавленных авто
+    """
+    added = 0
+    for drive_line in simulation_model.get_drive_lines():
+        if not drive_line.road:
+            continue
+        count = int(int(drive_line.length // CAR_GAP) * density)
+        for k in range(count):
+            offset = drive_line.length - k * CAR_GAP
+            if not drive_line.can_recv() or offset < 0.0:
+                break
+            drive_line.add_car(Car.acquire(drive_line=drive_line, offset=offset))
+            added += 1
+    return added
+
+
+def build_default_grid(engine: int = CityModel.ENGINE_OBJECT, seed: int = None) -> CityModel:
+    return build_grid_city(4, 4, engine=engine, seed=seed)
+
+
+def build_default_t_grid(engine: int = CityModel.ENGINE_OBJECT, seed: int = None) -> CityModel:
+    return build_grid_city(4, 4, t_junctions=True, engine=engine, seed=seed)
+
+
+# сценарии, доступные по имени (в том числе в дочерних процессах пакетного запуска)
+SCENARIOS = {
+    'default': build_default_city,
+    'grid': build_default_grid,
+    'grid_t': build_default_t_grid,
+}
@@ -0,0 +1,205 @@
+import math
+import time
+from typing import Callable
+
+from .simulate import CityModel
+
+
+class Scheduler:
+    """
+    Запуск модели с фиксированным шагом симуляции.
+
+    Время, прошедшее по часам, накапливается в accumulator и расходуется целыми шагами step,
+    поэтому результат не зависит от загрузки машины. Публикация выполняется с отдельной частотой.
+    В MODE_HEADLESS шаги, в которых модель простаивает (см. CityModel.next_event_time), пропускаются.
+    """
+    MODE_REALTIME = 1  # симуляция идет со скоростью реального времени
+    MODE_SCALED = 2  # симуляция ускорена (или замедлена) в speed раз
+    MODE_HEADLESS = 3  # без ожидания, максимально быстро
+
+    DEFAULT_STEP = 1 / 60
+    DEFAULT_PUBLISH_RATE = 60.0
+    MAX_STEPS_PER_FRAME = 8  # при отставании больше этого числа шагов время сбрасывается
+
+    model: CityModel
+    step: float
+    mode: int
+    speed: float
+    publish_rate: float
+    accumulator: float
+    ticks: int
+    overruns: int
+    published: int
+
+    def __init__(
+            self,
+            model: CityModel,
+            step: float = DEFAULT_STEP,
+            mode: int = MODE_REALTIME,
+            speed: float = 1.0,
+            publish: Callable[[CityModel], None] = None,
+            publish_rate: float = DEFAULT_PUBLISH_RATE,
+            clock: Callable[[], float] = time.perf_counter,
+            sleep: Callable[[float], None] = time.sleep,
+            metrics=None,
+    ):
+        """
+        :param step: шаг симуляции в секундах модельного времени
+        :param speed: во сколько раз модельное время идет быстрее реального (только для MODE_SCALED)
+        :param publish: вызывается с моделью с частотой publish_rate
+        :param publish_rate: частота публикации в Гц; в MODE_HEADLESS - по модельному времени
+        :param metrics: simulation.metrics.Metrics - время шагов и отставание, None - без замеров
+        """
+        if step <= 0.0:
+            raise ValueError('Step must be positive')
+        if mode == self.MODE_REALTIME:
+            speed = 1.0
+        elif mode == self.MODE_SCALED:
+            if speed <= 0.0:
+                raise ValueError('Speed must be positive')
+        elif mode != self.MODE_HEADLESS:
+            raise ValueError('Unknown mode')
+        self.model = model
+        self.step = step
+        self.mode = mode
+        self.speed = speed
+        self.publish = publish
+        self.publish_rate = publish_rate
+        self.clock = clock
+        self.sleep = sleep
+        self.metrics = metrics
+        self.accumulator = 0.0
+        self.ticks = 0
+        self.overruns = 0  # шаги, выполнявшиеся дольше отведенного на них времени
+        self.dropped_time = 0.0  # модельное время, пропущенное из-за отставания
+        self.max_tick_time = 0.0
+        self.published = 0
+        self.skipped = 0  # шаги, пропущенные перемоткой простоя модели
+        self.running = False
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        return {
+            'ticks': self.ticks,
+            'time': self.model.time,
+            'overruns': self.overruns,
+            'dropped_time': self.dropped_time,
+            'max_tick_time': self.max_tick_time,
+            'published': self.published,
+            'skipped': self.skipped,
+        }
+
+    def run_tick(self, budget: float = None):
+        started = self.clock()
+        self.model.simulate(timedelta=self.step)
+        elapsed = self.clock() - started
+        self.ticks += 1
+        if elapsed > self.max_tick_time:
+            self.max_tick_time = elapsed
+        if budget is not None and elapsed > budget:
+            self.overruns += 1
+        if self.metrics is not None:
+            self.metrics.observe('tick', elapsed)
+            self.metrics.set_gauge('overruns', self.overruns)
+            self.metrics.set_gauge('skipped_ticks', self.skipped)
+            self.metrics.set_gauge('dropped_time', self.dropped_time)
+            self.metrics.tick(self.model)
+
+    def run(self, duration: float = None, max_ticks: int = None):
+        """
+        :param duration: длительность в секундах модельного времени, None - без ограничения
+        :param max_ticks: максимальное количество шагов, None - без ограничения
+        """
+        end_time = self.model.time + duration if duration is not None else None
+        end_tick = self.ticks + max_ticks if max_ticks is not None else None
+        self.running = True
+        if self.mode == self.MODE_HEADLESS:
+            self.run_headless(end_time, end_tick)
+        else:
+            self.run_realtime(end_time, end_tick)
+        self.running = False
+        return self.stats()
+
+    def is_finished(self, end_time: float, end_tick: int):
+        if not self.running:
+            return True
+        if end_tick is not None and self.ticks >= end_tick:
+            return True
+        # половина шага - запас на накопленную погрешность суммы времени
+        return end_time is not None and self.model.time >= end_time - self.step / 2
+
+    def do_publish(self):
+        if self.publish:
+            self.publish(self.model)
+            self.published += 1
+
+    def run_headless(self, end_time: float, end_tick: int):
+        publish_interval = 1.0 / self.publish_rate if self.publish and self.publish_rate else None
+        next_publish = self.model.time
+        while not self.is_finished(end_time, end_tick):
+            skip = self.idle_ticks(end_time, end_tick, next_publish if publish_interval is not None else None)
+            if skip:
+                self.model.fast_forward(skip, self.step)
+                self.ticks += skip
+                self.skipped += skip
+                continue
+            self.run_tick()
+            if publish_interval is not None and self.model.time >= next_publish:
+                self.do_publish()
+                next_publish += publish_interval
+
+    def idle_ticks(self, end_time: float, end_tick: int, next_publish: float):
+        """
+        :return: количество шагов, которые можно пропустить: модель простаивает, а шаги заканчиваются
+        раньше ближайшего события, публикации и конца запуска
+        """
+        target = self.model.next_event_time()
+        if target is None:
+            return 0
+        for time_limit in (end_time, next_publish):
+            if time_limit is not None and time_limit < target:
+                target = time_limit
+        if math.isinf(target):
+            # событий больше не будет (светофоры без таймера), пропуск ограничен только числом шагов
+            return max(end_tick - self.ticks, 0) if end_tick is not None else 0
+        ticks = math.ceil((target - self.model.time) / self.step - 1e-9) - 1
+        if end_tick is not None and ticks > end_tick - self.ticks:
+            ticks = end_tick - self.ticks
+        return max(ticks, 0)
+
+    def run_realtime(self, end_time: float, end_tick: int):
+        budget = self.step / self.speed  # реальное время, отведенное на один шаг
+        publish_interval = 1.0 / self.publish_rate if self.publish and self.publish_rate else None
+        prev_time = self.clock()
+        next_publish = prev_time
+        while not self.is_finished(end_time, end_tick):
+            current_time = self.clock()
+            self.accumulator += (current_time - prev_time) * self.speed
+            prev_time = current_time
+
+            steps = 0
+            while self.accumulator >= self.step and not self.is_finished(end_time, end_tick):
+                if steps >= self.MAX_STEPS_PER_FRAME:
+                    # модель не успевает за часами: лишнее время отбрасывается, чтобы не копить отставание
+                    self.dropped_time += self.accumulator
+                    self.accumulator = 0.0
+                    break
+                self.run_tick(budget)
+                self.accumulator -= self.step
+                steps += 1
+
+            current_time = self.clock()
+            if publish_interval is not None and current_time >= next_publish:
+                self.do_publish()
+                next_publish += publish_interval
+                if next_publish < current_time:
+                    next_publish = current_time + publish_interval
+
+            wake_time = prev_time + (self.step - self.accumulator) / self.speed
+            if publish_interval is not None and next_publish < wake_time:
+                wake_time = next_publish
+            sleep_time = wake_time - self.clock()
+            if sleep_time > 0.0:
+                self.sleep(sleep_time)
@@ -0,0 +1,376 @@
+"""
+Разбиение модели на участки, каждый участок симулируется в своем процессе.
+
+Участок - набор перекрестков (полосы сетки делятся по координате x). Полоса принадлежит участку
+перекрестка, к которому она подходит; полосы, которые ни к какому перекрестку не подходят, -
+участку перекрестка, от которого они отходят. Поэтому авто покидает участок только с полосы
+перекрестка на исходящую полосу дороги другого участка.
+
+В процессе участка такая исходящая полоса заменена на BoundaryLane: авто, выехавшие на нее,
+собираются и в конце шага передаются координатору, который отдает их участку-владельцу полосы.
+Проверка can_recv выполняется по положению последнего авто на полосе, полученному от владельца
+в конце предыдущего шага; если авто все же не помещается (на полосе появилось новое авто),
+оно ждет в очереди участка до освобождения полосы.
+
+Координатор (ShardedEngine) - движок CityModel: шаг симуляции выполняется всеми участками
+параллельно, снимки и изменения для публикации собираются с участков и объединяются.
+Топология у всех процессов одна - скомпилированные таблицы из simulation.network, id объектов
+совпадают; id новых авто участки выдают с шагом, равным количеству участков.
+"""
+import multiprocessing
+import signal
+from typing import List, Union
+
+import numpy as np
+
+from bases import RoadPart, CrossRoad, SimulateMixin
+from bases import settings
+from bases.car import Car, DEFAULT_CAR_LENGTH
+from bases.context import ModelContext
+from .engines import ObjectEngine
+from .network import build_objects, load_compiled
+from .simulate import CityModel
+
+
+def partition(compiled: dict, shards: int) -> List[int]:
+    """
+    :return: номер участка для каждого перекрестка; участки - полосы сетки по x примерно равного размера
+    """
+    cross_roads = compiled['cross_roads']
+    order = sorted(
+        range(len(cross_roads)), key=lambda k: (cross_roads[k]['position'][0], cross_roads[k]['position'][1])
+    )
+    owners = [0] * len(cross_roads)
+    for rank in range(len(order)):
+        owners[order[rank]] = rank * shards // len(order)
+    return owners
+
+
+def assign_lanes(compiled: dict, cross_road_owners: List[int]) -> List[int]:
+    """
+    :return: номер участка для каждой полосы
+    """
+    owners = [None] * len(compiled['lanes'])
+    for k, table in enumerate(compiled['cross_roads']):
+        for i in table['lines'] + table['incoming']:
+            owners[i] = cross_road_owners[k]
+    for k, table in enumerate(compiled['cross_roads']):
+        for i in table['outcoming']:
+            if owners[i] is None:
+                owners[i] = cross_road_owners[k]
+    return [owner if owner is not None else 0 for owner in owners]
+
+
+def car_state(car: Car):
+    return car.id, car.speed, car.state, car.delay_passed, car.wait_time
+
+
+class BoundaryLane:
+    """
+    Полоса другого участка в процессе участка: авто, выехавшие на нее, попадают в outbox
+    """
+    id: int
+    tail_offset: float  # положение последнего авто на полосе, None - полоса пуста
+
+    def __init__(self, drive_line_id: int, outbox: list):
+        self.id = drive_line_id
+        self.tail_offset = None
+        self.outbox = outbox
+
+    def can_recv(self):
+        return self.tail_offset is None or self.tail_offset > DEFAULT_CAR_LENGTH
+
+    def add_car(self, car: Car):
+        if not self.can_recv():
+            raise ValueError('Check before add!!!')
+        self.outbox.append((self.id, car_state(car)))
+        self.tail_offset = 0.0
+
+
+class ShardEngine(ObjectEngine):
+    """
+    Объектный движок одного участка: симулирует только свои полосы и перекрестки
+    """
+
+    def __init__(self, compiled: dict, lane_owners: List[int], cross_road_owners: List[int], shard: int):
+        lanes, roads, cross_roads = build_objects(compiled)
+        super().__init__(roads, [cross_roads[k] for k in range(len(cross_roads)) if cross_road_owners[k] == shard])
+        self.network_lanes = lanes  # все полосы сети по порядку таблицы, id полосы - индекс + 1
+        self.road_lines = []
+        for road in roads:
+            for drive_line in [road.get_first_line(True), road.get_first_line(False)]:
+                if drive_line and lane_owners[drive_line.id - 1] == shard:
+                    self.road_lines.append(drive_line)
+
+        self.outbox = []
+        self.boundary_lanes = {}  # id полосы другого участка -> BoundaryLane
+        exported = set()  # свои полосы, на которые въезжают авто других участков
+        for i in range(len(lanes)):
+            paths = lanes[i].paths
+            for j in range(len(paths)):
+                target = paths[j].id - 1
+                if lane_owners[i] == shard and lane_owners[target] != shard:
+                    if paths[j].id not in self.boundary_lanes:
+                        self.boundary_lanes[paths[j].id] = BoundaryLane(paths[j].id, self.outbox)
+                    paths[j] = self.boundary_lanes[paths[j].id]
+                elif lane_owners[i] != shard and lane_owners[target] == shard:
+                    exported.add(target)
+        self.exported_lanes = [lanes[i] for i in sorted(exported)]
+        self.pending = []  # (полоса, состояние авто) - переданные авто, еще не поместившиеся на полосу
+
+    def get_drive_lines(self):
+        drive_lines = list(self.road_lines)
+        for cross_road in self.cross_roads:
+            drive_lines.extend(cross_road.lines)
+        return drive_lines
+
+    def get_cars(self):
+        cars = []
+        for drive_line in self.get_drive_lines():
+            for car in drive_line.queue:
+                cars.append(car.to_dict())
+        return cars
+
+    def step(self, timedelta: float, tails: list):
+        """
+        :param tails: (id полосы, положение последнего авто) для полос других участков
+        :return: авто, покинувшие участок, - (id полосы, состояние авто)
+        """
+        for drive_line_id, offset in tails:
+            self.boundary_lanes[drive_line_id].tail_offset = offset
+        self.simulate(timedelta=timedelta)
+        outbox = list(self.outbox)
+        self.outbox.clear()
+        return outbox
+
+    def deliver(self, arrivals: list):
+        """
+        Размещает авто, переданные другими участками
+        :return: положения последних авто на полосах, куда въезжают авто других участков,
+        и переключившиеся светофоры
+        """
+        pending = self.pending + [(self.network_lanes[drive_line_id - 1], state) for drive_line_id, state in arrivals]
+        self.pending = []
+        blocked = set()
+        for drive_line, state in pending:
+            if drive_line in blocked or not drive_line.can_recv():
+                # порядок авто, ждущих одну полосу, сохраняется
+                blocked.add(drive_line)
+                self.pending.append((drive_line, state))
+                continue
+            car_id, speed, running_state, delay_passed, wait_time = state
+            car = Car.acquire(drive_line=drive_line, car_id=car_id)
+            car.speed = speed
+            car.state = running_state
+            car.delay_passed = delay_passed
+            car.wait_time = wait_time
+            car.spawned = False
+            drive_line.add_car(car)
+
+        tails = []
+        for drive_line in self.exported_lanes:
+            if drive_line in blocked:
+                tails.append((drive_line.id, 0.0))
+            elif drive_line.queue:
+                tails.append((drive_line.id, drive_line.queue[-1].offset))
+            else:
+                tails.append((drive_line.id, None))
+        semaphores = []
+        for cross_road in self.cross_roads:
+            cross_road.collect_changes(semaphores)
+        return tails, semaphores
+
+    def stats(self):
+        stats = super().stats()
+        stats['cars'] += len(self.pending)
+        return stats
+
+
+def run_shard(connection, compiled: dict, lane_owners: List[int], cross_road_owners: List[int], shard: int,
+              shards: int, seed: int = None):
+    """
+    Процесс участка: выполняет команды координатора (имя метода ShardEngine и аргументы), None - завершение
+    """
+    # Ctrl+C и SIGTERM, отправленные группе процессов, обрабатывает координатор: он завершает участки
+    # командой None после сохранения и закрытия публикации
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    context = ModelContext(
+        seed=None if seed is None else '{}:{}'.format(seed, shard), car_id_step=shards, car_count=shard + 1 - shards
+    )
+    with context.activate():
+        engine = ShardEngine(compiled, lane_owners, cross_road_owners, shard)
+    connection.send(True)
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            # координатор завершился, не закрыв участки
+            break
+        if message is None:
+            break
+        command, args = message
+        connection.send(getattr(engine, command)(*args))
+    connection.close()
+
+
+class ShardedEngine(SimulateMixin):
+    """
+    Координатор участков: движок CityModel, шаг которого выполняется процессами участков
+    """
+    roads: List[RoadPart]
+    cross_roads: List[CrossRoad]
+
+    def __init__(
+            self,
+            compiled: dict,
+            roads: List[RoadPart],
+            cross_roads: List[CrossRoad],
+            shards: int,
+            seed: int = None,
+            cross_road_owners: List[int] = None,
+    ):
+        """
+        :param roads: дороги и перекрестки модели координатора, по ним строится топология для публикации
+        :param cross_road_owners: номер участка для каждого перекрестка, None - partition()
+        """
+        if shards < 1:
+            raise ValueError('Required at least 1 shard')
+        self.roads = roads
+        self.cross_roads = cross_roads
+        self.shards = shards
+        self.cross_road_owners = cross_road_owners or partition(compiled, shards)
+        self.lane_owners = assign_lanes(compiled, self.cross_road_owners)
+        # участки, авто которых въезжают на полосу
+        self.feeders = [set() for _ in range(len(compiled['lanes']))]
+        for i, paths in enumerate(compiled['paths']):
+            for j in paths:
+                if self.lane_owners[j] != self.lane_owners[i]:
+                    self.feeders[j].add(self.lane_owners[i])
+        self.semaphores = {}
+        for cross_road in cross_roads:
+            for drive_line in cross_road.incoming_lines:
+                self.semaphores[drive_line.semaphore.id] = cross_road, drive_line.semaphore
+
+        self.tails = [[] for _ in range(shards)]
+        self.connections = []
+        self.processes = []
+        for shard in range(shards):
+            connection, child_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=run_shard,
+                args=(child_connection, compiled, self.lane_owners, self.cross_road_owners, shard, shards, seed),
+                daemon=True,
+            )
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+        for connection in self.connections:
+            connection.recv()
+        self.exchange([[] for _ in range(shards)])
+
+    def call(self, command: str, args_list: list = None) -> list:
+        """
+        Выполняет команду на всех участках параллельно
+        :param args_list: аргументы для каждого участка, None - без аргументов
+        """
+        for shard in range(self.shards):
+            self.connections[shard].send((command, args_list[shard] if args_list else ()))
+        return [connection.recv() for connection in self.connections]
+
+    def exchange(self, arrivals: list):
+        self.tails = [[] for _ in range(self.shards)]
+        results = self.call('deliver', [(arrivals[shard],) for shard in range(self.shards)])
+        for tails, semaphores in results:
+            for drive_line_id, offset in tails:
+                for shard in self.feeders[drive_line_id - 1]:
+                    self.tails[shard].append((drive_line_id, offset))
+            for semaphore_state in semaphores:
+                cross_road, semaphore = self.semaphores[semaphore_state['id']]
+                if semaphore_state['state'] == semaphore.GREEN:
+                    semaphore.enable()
+                else:
+                    semaphore.disable()
+                cross_road.dirty = True
+
+    def topology_changed(self):
+        # топология задается скомпилированными таблицами и после запуска участков не меняется
+        pass
+
+    def simulate(self, timedelta: float, **kwargs):
+        outboxes = self.call('step', [(timedelta, self.tails[shard]) for shard in range(self.shards)])
+        arrivals = [[] for _ in range(self.shards)]
+        for outbox in outboxes:
+            for drive_line_id, state in outbox:
+                arrivals[self.lane_owners[drive_line_id - 1]].append((drive_line_id, state))
+        self.exchange(arrivals)
+
+    def get_cars(self):
+        cars = []
+        for shard_cars in self.call('get_cars'):
+            cars.extend(shard_cars)
+        return cars
+
+    def collect_changes(self):
+        spawned = []
+        moved = []
+        removed = []
+        for shard_spawned, shard_moved, shard_removed in self.call('collect_changes'):
+            spawned.extend(shard_spawned)
+            moved.extend(shard_moved)
+            removed.extend(shard_removed)
+        return spawned, moved, removed
+
+    def car_arrays(self):
+        results = self.call('car_arrays')
+        return tuple(np.concatenate([result[i] for result in results]) for i in range(4))
+
+    def stats(self):
+        results = self.call('stats')
+        stats = dict(results[0])
+        for result in results[1:]:
+            for key, value in result.items():
+                if key == 'max_queue':
+                    stats[key] = max(stats[key], value)
+                else:
+                    stats[key] += value
+        return stats
+
+    def close(self, timeout: float = 5.0):
+        """
+        Завершает процессы участков; процесс, не завершившийся за timeout секунд, останавливается
+        """
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except OSError:
+                # процесс участка уже завершен
+                pass
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+        self.processes = []
+
+
+def load_sharded_network(
+        source: Union[str, dict],
+        shards: int,
+        seed: int = None,
+        cache_dir: str = settings.NETWORK_CACHE_DIR,
+) -> CityModel:
+    """
+    Модель по описанию сети (см. simulation.network), симулируемая в shards процессах
+    """
+    compiled = load_compiled(source, cache_dir)
+    lanes, roads, cross_roads = build_objects(compiled)
+    simulation_model = CityModel(engine=ShardedEngine(compiled, roads, cross_roads, shards, seed=seed))
+    for i in range(len(roads)):
+        simulation_model.add_road(roads[i])
+    for i in range(len(cross_roads)):
+        simulation_model.add_cross_road(cross_roads[i])
+    return simulation_model
@@ -0,0 +1,125 @@
+"""
+Управление светофорами нейросетью (neural.core.Network).
+
+Раз в decision_interval секунд модельного времени для всех перекрестков собирается матрица
+признаков (перекресток x признак) и считается одним проходом сети. Выход сети для перекрестка -
+желание переключить фазу: при значении больше threshold и фазе, длящейся не меньше
+min_phase_time, светофоры перекрестка переключаются. Переключение по таймеру
+(CrossRoad.time_to_switch) для управляемых перекрестков отключается.
+"""
+from typing import List
+
+import numpy as np
+
+from bases import CrossRoad
+from neural.core import Network
+
+
+class NeuralSignalController:
+    # стоящие авто на полосах x и y, время простоя на полосах x и y, горит ли зеленый полосам x, длительность фазы
+    FEATURES = 6
+    QUEUE_SCALE = 10.0  # нормировка признаков, чтобы значения были порядка единицы
+    WAIT_SCALE = 60.0
+    PHASE_SCALE = 60.0
+    DEFAULT_DECISION_INTERVAL = 1.0
+    DEFAULT_MIN_PHASE_TIME = 5.0
+    DEFAULT_THRESHOLD = 0.5
+
+    cross_roads: List[CrossRoad]
+    network: Network
+
+    def __init__(
+            self,
+            cross_roads: List[CrossRoad],
+            network: Network = None,
+            decision_interval: float = DEFAULT_DECISION_INTERVAL,
+            min_phase_time: float = DEFAULT_MIN_PHASE_TIME,
+            threshold: float = DEFAULT_THRESHOLD,
+    ):
+        """
+        :param network: сеть с FEATURES входами и одним выходом, None - случайно инициализированная сеть
+        """
+        if network is None:
+            network = Network([self.FEATURES, 8, 1])
+        if network.sizes[0] != self.FEATURES or network.sizes[-1] != 1:
+            raise ValueError('Network must have {} inputs and 1 output'.format(self.FEATURES))
+        self.cross_roads = list(cross_roads)
+        self.network = network
+        self.decision_interval = decision_interval
+        self.min_phase_time = min_phase_time
+        self.threshold = threshold
+        self.time_passed = 0.0
+        self.decisions = 0
+        self.switches = 0
+
+        # входящие полосы всех перекрестков подряд; группа полосы - номер перекрестка * 2 + ось (0 - x, 1 - y)
+        self.lanes = []
+        groups = []
+        for k in range(len(self.cross_roads)):
+            cross_road = self.cross_roads[k]
+            cross_road.time_to_switch = float('inf')
+            for drive_line in cross_road.x_vector_lines:
+                self.lanes.append(drive_line)
+                groups.append(k * 2)
+            for drive_line in cross_road.y_vector_lines:
+                self.lanes.append(drive_line)
+                groups.append(k * 2 + 1)
+        self.groups = np.array(groups, dtype=np.int64)
+        self.phase_time = np.zeros(len(self.cross_roads))
+        self.features = np.zeros((len(self.cross_roads), self.FEATURES), dtype=network.params.dtype)
+
+    def next_decision_time(self, time: float):
+        """
+        :param time: текущее модельное время
+        """
+        return time + self.decision_interval - self.time_passed
+
+    def simulate(self, model, timedelta: float):
+        """
+        :param model: CityModel, которой принадлежат перекрестки
+        """
+        self.time_passed += timedelta
+        self.phase_time += timedelta
+        if self.time_passed >= self.decision_interval:
+            self.time_passed = 0.0
+            self.decide(model)
+
+    def advance(self, timedelta: float):
+        """
+        Перемотка времени без решений, допустима только до ближайшего решения
+        """
+        if self.time_passed + timedelta >= self.decision_interval:
+            raise ValueError('Cannot advance past the next decision')
+        self.time_passed += timedelta
+        self.phase_time += timedelta
+
+    def collect_features(self, model):
+        count = len(self.cross_roads)
+        stopped, wait_time = model.lane_stats(self.lanes)
+        stopped = np.bincount(self.groups, weights=stopped, minlength=count * 2).reshape(count, 2)
+        wait_time = np.bincount(self.groups, weights=wait_time, minlength=count * 2).reshape(count, 2)
+        features = self.features
+        features[:, 0:2] = stopped / self.QUEUE_SCALE
+        features[:, 2:4] = wait_time / self.WAIT_SCALE
+        for k in range(count):
+            features[k, 4] = self.cross_roads[k].state == CrossRoad.ENABLED_X_LINES
+        features[:, 5] = self.phase_time / self.PHASE_SCALE
+        return features
+
+    def decide(self, model):
+        """
+        Один проход сети по всем перекресткам и переключение выбранных
+        """
+        if not self.cross_roads:
+            return
+        outputs = self.network.forward(self.collect_features(model))[:, 0]
+        switch = np.flatnonzero((outputs > self.threshold) & (self.phase_time >= self.min_phase_time))
+        self.decisions += 1
+        if not len(switch):
+            return
+        model.switch_signals([self.cross_roads[k] for k in switch.tolist()])
+        self.phase_time[switch] = 0.0
+        self.switches += len(switch)
+
+    def stats(self):
+        return {'decisions': self.decisions, 'switches': self.switches}
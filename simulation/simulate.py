@@ -1,48 +1,345 @@
+import time
 from typing import List
+
+import numpy as np
+
 from bases import RoadPart, CrossRoad, SimulateMixin
+from bases.context import ModelContext, current_context
+from .engines import ObjectEngine
+from .frames import encode_frame
 
 
 class CityModel(SimulateMixin):
+    ENGINE_OBJECT = 1  # объектный движок (эталонный)
+    ENGINE_NUMPY = 2  # векторизованный движок на массивах NumPy
+    ENGINE_EVENTS = 3  # объектный движок с очередью событий и спящими полосами
     __roads: List[RoadPart]
     __cross_roads: List[CrossRoad]
 
-    def __init__(self):
+    def __init__(self, engine=ENGINE_OBJECT, seed: int = None, context: ModelContext = None):
+        """
+        :param context: контекст, в котором построены дороги и перекрестки модели, None - текущий
+        """
+        self.context = current_context() if context is None else context
         self.__roads = []
         self.__cross_roads = []
+        self.tick = 0
+        self.time = 0.0
+        self.topology_version = 0  # меняется при добавлении дорог и перекрестков
+        if engine == self.ENGINE_OBJECT:
+            self.__engine = ObjectEngine(self.__roads, self.__cross_roads)
+        elif engine == self.ENGINE_NUMPY:
+            from .vectorized import VectorizedEngine
+            self.__engine = VectorizedEngine(self.__roads, self.__cross_roads, seed=seed, context=self.context)
+        elif engine == self.ENGINE_EVENTS:
+            from .events import EventEngine
+            self.__engine = EventEngine(self.__roads, self.__cross_roads)
+        elif not isinstance(engine, int):
+            # готовый движок со своей топологией, например simulation.sharding.ShardedEngine
+            self.__engine = engine
+        else:
+            raise ValueError('Unknown engine')
+        self.signal_controller = None
+        self.demand = None
+        self.metrics = None
+
+    @property
+    def engine(self):
+        return self.__engine
 
     def simulate(self, timedelta: float, **kwargs):
-        for j in range(len(self.__roads)):
-            road = self.__roads[j]
+        self.__engine.simulate(timedelta=timedelta)
+        if self.demand:
+            self.demand.simulate(self, timedelta)
+        if self.signal_controller:
+            started = time.perf_counter()
+            self.signal_controller.simulate(self, timedelta)
+            if self.metrics is not None:
+                self.metrics.observe('signal_control', time.perf_counter() - started)
+        self.tick += 1
+        self.time += timedelta
+
+    def next_event_time(self):
+        """
+        :return: модельное время ближайшего события, если до него состояние модели не меняется
+        (нет движущихся авто); None - модель нужно симулировать шаг за шагом
+        """
+        next_event_time = getattr(self.__engine, 'next_event_time', None)
+        time = next_event_time() if next_event_time else None
+        if time is not None and self.signal_controller:
+            time = min(time, self.signal_controller.next_decision_time(self.time))
+        if time is not None and self.demand:
+            arrival_time = self.demand.next_arrival_time()
+            time = None if arrival_time is None else min(time, arrival_time)
+        return time
+
+    def fast_forward(self, ticks: int, timedelta: float):
+        """
+        Пропуск ticks шагов, в течение которых модель не меняется (см. next_event_time)
+        """
+        self.__engine.advance(ticks * timedelta)
+        if self.signal_controller:
+            self.signal_controller.advance(ticks * timedelta)
+        self.tick += ticks
+        self.time += ticks * timedelta
+
+    def close(self):
+        """
+        Освобождает ресурсы движка (процессы участков simulation.sharding.ShardedEngine)
+        """
+        if hasattr(self.__engine, 'close'):
+            self.__engine.close()
+
+    def enable_routing(self, router=None):
+        """
+        Новые авто получают пункт назначения и едут к нему по таблицам маршрутизатора
+        :param router: simulation.routing.Router, None - с параметрами по умолчанию
+        """
+        if not hasattr(self.__engine, 'set_router'):
+            raise ValueError('Engine does not support routing')
+        if router is None:
+            from .routing import Router
+            router = Router()
+        self.__engine.set_router(router)
+        return router
+
+    def set_metrics(self, metrics):
+        """
+        :param metrics: simulation.metrics.Metrics - замеры времени фаз шага, None - без замеров
+        """
+        self.metrics = metrics
+        if hasattr(self.__engine, 'metrics'):
+            self.__engine.metrics = metrics
+
+    def enable_signal_control(self, network=None, **kwargs):
+        """
+        Светофоры всех перекрестков переключаются по решениям нейросети вместо таймера
+        :param network: neural.core.Network, None - случайно инициализированная сеть
+        :param kwargs: параметры simulation.signals.NeuralSignalController
+        """
+        if not hasattr(self.__engine, 'lane_stats') or not hasattr(self.__engine, 'switch_signals'):
+            raise ValueError('Engine does not support signal control')
+        from .signals import NeuralSignalController
+        self.signal_controller = NeuralSignalController(self.__cross_roads, network, **kwargs)
+        # событийный движок планирует переключения по таймеру при компиляции
+        self.__engine.topology_changed()
+        return self.signal_controller
+
+    def set_demand(self, demand):
+        """
+        Авто появляются по расписанию simulation.demand.Demand вместо встроенного появления на полосах
+        auto_add_car раз в spawn_interval секунд контекста
+        """
+        if not hasattr(self.__engine, 'admit_cars'):
+            raise ValueError('Engine does not support demand')
+        if demand.has_destinations and getattr(self.__engine, 'router', None) is None:
+            raise ValueError('Origin-destination demand needs routing')
+        for drive_line in self.get_drive_lines():
+            drive_line.auto_add_car = False
+        self.demand = demand
+        self.__engine.topology_changed()
+        return demand
+
+    def lane_stats(self, lanes):
+        """
+        :return: количество стоящих авто и суммарное время их простоя на каждой из lanes
+        """
+        return self.__engine.lane_stats(lanes)
+
+    def switch_signals(self, cross_roads: List[CrossRoad]):
+        self.__engine.switch_signals(cross_roads)
+
+    def set_mesoscopic(self, drive_lines, enabled: bool = True):
+        """
+        Авто на drive_lines симулируются мезоскопически (очередь со временем выезда) или снова поштучно
+        """
+        if not hasattr(self.__engine, 'set_mesoscopic'):
+            raise ValueError('Engine does not support mesoscopic lanes')
+        self.__engine.set_mesoscopic(drive_lines, enabled)
+
+    def export_state(self):
+        """
+        Динамическое состояние модели в виде массивов для контрольной точки (см. simulation.checkpoint)
+        """
+        if not hasattr(self.__engine, 'export_state'):
+            raise ValueError('Engine does not support checkpoints')
+        lanes = self.get_drive_lines()
+        state = self.__engine.export_state(lanes)
+        stats = self.__engine.stats()
+        state['tick'] = self.tick
+        state['time'] = self.time
+        state['spawned'] = stats['spawned']
+        state['cleared'] = stats['cleared']
+        state['cleared_wait_time'] = stats['cleared_wait_time']
+        state['lane_ids'] = np.array([drive_line.id for drive_line in lanes], dtype=np.int64)
+        state['lane_semaphore_state'] = np.array(
+            [drive_line.semaphore.state if drive_line.semaphore else 0 for drive_line in lanes], dtype=np.int8
+        )
+        state['lane_semaphore_time'] = np.array(
+            [drive_line.semaphore.time_passed if drive_line.semaphore else 0.0 for drive_line in lanes]
+        )
+        cross_roads = self.__cross_roads
+        state['cross_road_state'] = np.array([cross_road.state for cross_road in cross_roads], dtype=np.int8)
+        state['cross_road_switch_time_passed'] = np.array(
+            [cross_road.switch_time_passed for cross_road in cross_roads]
+        )
+        state['cross_road_time_to_switch'] = np.array([cross_road.time_to_switch for cross_road in cross_roads])
+        return state
+
+    def import_state(self, state: dict):
+        """
+        Восстановление состояния из export_state в модель с той же топологией
+        """
+        if not hasattr(self.__engine, 'import_state'):
+            raise ValueError('Engine does not support checkpoints')
+        lanes = self.get_drive_lines()
+        cross_roads = self.__cross_roads
+        if len(state['lane_ids']) != len(lanes) or len(state['cross_road_state']) != len(cross_roads) \
+                or state['lane_ids'].tolist() != [drive_line.id for drive_line in lanes]:
+            raise ValueError('Checkpoint does not match the model topology')
+        semaphore_state = state['lane_semaphore_state'].tolist()
+        semaphore_time = state['lane_semaphore_time'].tolist()
+        for i in range(len(lanes)):
+            semaphore = lanes[i].semaphore
+            if semaphore:
+                semaphore.state = semaphore_state[i]
+                semaphore.time_passed = semaphore_time[i]
+                semaphore.dirty = True
+        cross_road_state = state['cross_road_state'].tolist()
+        switch_time_passed = state['cross_road_switch_time_passed'].tolist()
+        time_to_switch = state['cross_road_time_to_switch'].tolist()
+        for j in range(len(cross_roads)):
+            cross_roads[j].state = cross_road_state[j]
+            cross_roads[j].switch_time_passed = switch_time_passed[j]
+            cross_roads[j].time_to_switch = time_to_switch[j]
+            cross_roads[j].dirty = True
+        self.__engine.import_state(lanes, state)
+        self.tick = state['tick']
+        self.time = state['time']
+        # подписчики получают полный кадр, как после изменения топологии
+        self.topology_version += 1
+
+    def get_drive_lines(self):
+        """
+        Полосы, участвующие в симуляции: первые полосы дорог и полосы перекрестков
+        """
+        drive_lines = []
+        for road in self.__roads:
             for drive_line in [road.get_first_line(True), road.get_first_line(False)]:
-                drive_line.simulate(timedelta=timedelta)
-        for j in range(len(self.__cross_roads)):
-            self.__cross_roads[j].simulate(timedelta=timedelta)
+                if drive_line:
+                    drive_lines.append(drive_line)
+        for cross_road in self.__cross_roads:
+            drive_lines.extend(cross_road.lines)
+        return drive_lines
 
-    def to_dict(self):
-        cars = []
+    def get_cross_roads(self) -> List[CrossRoad]:
+        return list(self.__cross_roads)
+
+    def stats(self):
+        stats = self.__engine.stats()
+        stats['tick'] = self.tick
+        stats['time'] = self.time
+        if self.signal_controller:
+            stats.update(self.signal_controller.stats())
+        if self.demand:
+            stats.update(self.demand.stats())
+        return stats
+
+    def get_semaphores(self):
         semaphores = []
-        cross_roads = []
         for road in self.__roads:
             road_semaphores = road.get_semaphores()
             for semaphore in road_semaphores:
                 semaphores.append(semaphore)
-            road_cars = road.get_cars()
-            for car in road_cars:
-                cars.append(car)
-        for cross_road in self.__cross_roads:
-            cross_roads.append(cross_road.to_dict())
-            cross_road_cars = cross_road.get_cars()
-            for car in cross_road_cars:
-                cars.append(car)
+        return semaphores
+
+    def to_dict(self):
+        return {
+            'roads': [road.to_dict() for road in self.__roads],
+            'cars': self.__engine.get_cars(),
+            'semaphores': self.get_semaphores(),
+            'crossRoads': [cross_road.to_dict() for cross_road in self.__cross_roads],
+        }
+
+    def semaphore_arrays(self):
+        """
+        :return: id и состояния светофоров в виде массивов
+        """
+        ids = []
+        states = []
+        for road in self.__roads:
+            for drive_line in [road.get_first_line(True), road.get_first_line(False)]:
+                if drive_line and drive_line.semaphore:
+                    ids.append(drive_line.semaphore.id)
+                    states.append(drive_line.semaphore.state)
+        return np.array(ids, dtype=np.int64), np.array(states, dtype=np.int8)
+
+    def to_frame(self) -> bytes:
+        """
+        Состояние модели в бинарном формате (см. simulation.frames)
+        """
+        car_ids, car_x, car_y, car_lanes = self.__engine.car_arrays()
+        semaphore_ids, semaphore_states = self.semaphore_arrays()
+        return encode_frame(
+            self.tick, self.time, car_ids, car_x, car_y, car_lanes, semaphore_ids, semaphore_states
+        )
+
+    def topology_to_dict(self):
+        """
+        Статическая часть модели: дороги, перекрестки и расположение светофоров
+        """
         return {
+            'version': self.topology_version,
             'roads': [road.to_dict() for road in self.__roads],
-            'cars': cars,
+            'semaphores': self.get_semaphores(),
+            'crossRoads': [cross_road.to_dict() for cross_road in self.__cross_roads],
+        }
+
+    def keyframe_to_dict(self):
+        """
+        Полное динамическое состояние модели: все авто и состояния светофоров
+        """
+        return {
+            'tick': self.tick,
+            'time': self.time,
+            'version': self.topology_version,
+            'keyframe': True,
+            'cars': self.__engine.get_cars(),
+            'semaphores': [
+                {'id': semaphore['id'], 'state': semaphore['state']} for semaphore in self.get_semaphores()
+            ],
+        }
+
+    def collect_changes(self):
+        """
+        Изменения с момента последнего вызова: появившиеся, переместившиеся и покинувшие модель авто,
+        переключившиеся светофоры. Признаки изменений сбрасываются.
+        """
+        spawned, moved, removed = self.__engine.collect_changes()
+        semaphores = []
+        for cross_road in self.__cross_roads:
+            cross_road.collect_changes(semaphores)
+        return {
+            'tick': self.tick,
+            'time': self.time,
+            'version': self.topology_version,
+            'keyframe': False,
+            'spawned': spawned,
+            'moved': moved,
+            'removed': removed,
             'semaphores': semaphores,
-            'crossRoads': cross_roads,
         }
 
     def add_road(self, road: RoadPart):
+        if road.context is not self.context:
+            raise ValueError('Road belongs to another model context')
         self.__roads.append(road)
+        self.topology_version += 1
+        self.__engine.topology_changed()
 
     def add_cross_road(self, cross_road: CrossRoad):
+        if cross_road.context is not self.context:
+            raise ValueError('Cross road belongs to another model context')
         self.__cross_roads.append(cross_road)
+        self.topology_version += 1
+        self.__engine.topology_changed()
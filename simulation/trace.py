@@ -0,0 +1,316 @@
+"""
+Запись хода симуляции на диск и воспроизведение записи.
+
+Файл записи - заголовок файла и следующие за ним блоки (chunk) по chunk_size кадров. Кадр - те же
+данные, что и в simulation.frames: номер шага, время, id, координаты и полосы авто, id и состояния
+светофоров. Внутри блока данные хранятся по столбцам, поэтому столбец всех кадров блока читается
+одним представлением над отображенным в память файлом.
+
+Все значения little-endian. Заголовок файла (8 байт):
+    magic        4s   b'TMTR'
+    version      u16  TRACE_VERSION
+    flags        u16  зарезервировано
+Заголовок блока (40 байт):
+    magic        4s   b'TMCK'
+    frames       u32  количество кадров
+    first_tick   i64  номер шага первого кадра
+    cars         u64  количество авто во всех кадрах блока
+    semaphores   u64  количество светофоров во всех кадрах блока
+    size         u64  размер блока без заголовка
+За заголовком блока подряд идут массивы, каждый дополнен до границы 8 байт:
+    ticks i64[frames], times f64[frames], car_starts u64[frames + 1], semaphore_starts u64[frames + 1],
+    car_ids u32[cars], car_x f32[cars], car_y f32[cars], car_lanes u32[cars],
+    semaphore_ids u32[semaphores], semaphore_states u8[semaphores]
+Авто кадра i - элементы с car_starts[i] по car_starts[i + 1] столбцов авто, светофоры - аналогично.
+
+Блоки пишутся отдельным потоком, шаг симуляции только копирует массивы кадра. Если диск не успевает
+и в очереди уже queue_size блоков, новый блок выбрасывается (счетчики dropped_chunks и dropped_frames),
+а симуляция не ждет; в записи остается пропуск по номерам шагов. Недописанный блок в конце файла
+(запись прервана) при чтении пропускается.
+"""
+import bisect
+import mmap
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+from .frames import CAR_COLUMNS, SEMAPHORE_COLUMNS, encode_frame
+from .simulate import CityModel
+
+TRACE_MAGIC = b'TMTR'
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct('<4sHH')
+CHUNK_MAGIC = b'TMCK'
+CHUNK_HEADER = struct.Struct('<4sIqQQQ')
+ALIGNMENT = 8
+
+INDEX_COLUMNS = (
+    ('ticks', np.dtype('<i8')),
+    ('times', np.dtype('<f8')),
+)
+START_COLUMNS = (
+    ('car_starts', np.dtype('<u8')),
+    ('semaphore_starts', np.dtype('<u8')),
+)
+
+
+def padding(size: int) -> int:
+    return -size % ALIGNMENT
+
+
+def chunk_layout(frames: int, cars: int, semaphores: int):
+    """
+    :return: (имя столбца, тип, количество элементов) в порядке записи в блоке
+    """
+    layout = []
+    for name, dtype in INDEX_COLUMNS:
+        layout.append((name, dtype, frames))
+    for name, dtype in START_COLUMNS:
+        layout.append((name, dtype, frames + 1))
+    for name, dtype in CAR_COLUMNS:
+        layout.append((name, dtype, cars))
+    for name, dtype in SEMAPHORE_COLUMNS:
+        layout.append((name, dtype, semaphores))
+    return layout
+
+
+class TraceRecorder:
+    """
+    Запись кадров модели в файл; record вызывается из потока симуляции (например, вместе с публикацией)
+    """
+    DEFAULT_CHUNK_SIZE = 600  # 10 секунд при 60 кадрах в секунду
+    DEFAULT_QUEUE_SIZE = 4
+
+    def __init__(self, path: str, chunk_size: int = DEFAULT_CHUNK_SIZE, queue_size: int = DEFAULT_QUEUE_SIZE):
+        """
+        :param queue_size: сколько блоков может ждать записи, прежде чем новые блоки начнут выбрасываться
+        """
+        if chunk_size < 1:
+            raise ValueError('Chunk size must be positive')
+        if queue_size < 1:
+            raise ValueError('Queue size must be positive')
+        self.path = path
+        self.chunk_size = chunk_size
+        self.file = open(path, 'wb')
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, 0))
+        self.frames = []
+        self.chunks = queue.Queue(maxsize=queue_size)
+        self.recorded = 0
+        self.written_chunks = 0
+        self.dropped_chunks = 0
+        self.dropped_frames = 0
+        self.thread = threading.Thread(target=self.run, name='trace-recorder', daemon=True)
+        self.thread.start()
+
+    def record(self, model: CityModel):
+        car_ids, car_x, car_y, car_lanes = model.engine.car_arrays()
+        semaphore_ids, semaphore_states = model.semaphore_arrays()
+        self.frames.append((
+            model.tick, model.time, car_ids, car_x, car_y, car_lanes, semaphore_ids, semaphore_states,
+        ))
+        self.recorded += 1
+        if len(self.frames) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Передает накопленные кадры потоку записи
+        """
+        if self.frames:
+            try:
+                self.chunks.put_nowait(self.frames)
+            except queue.Full:
+                self.dropped_chunks += 1
+                self.dropped_frames += len(self.frames)
+            self.frames = []
+
+    def close(self):
+        self.flush()
+        self.chunks.put(None)
+        self.thread.join()
+        self.file.close()
+
+    def run(self):
+        while True:
+            frames = self.chunks.get()
+            if frames is None:
+                return
+            self.file.write(self.encode_chunk(frames))
+            self.file.flush()
+            self.written_chunks += 1
+
+    @staticmethod
+    def encode_chunk(frames) -> bytes:
+        columns = {
+            'ticks': [frame[0] for frame in frames],
+            'times': [frame[1] for frame in frames],
+            'car_starts': np.concatenate(([0], np.cumsum([len(frame[2]) for frame in frames]))),
+            'semaphore_starts': np.concatenate(([0], np.cumsum([len(frame[6]) for frame in frames]))),
+        }
+        for k in range(len(CAR_COLUMNS)):
+            columns[CAR_COLUMNS[k][0]] = np.concatenate([frame[2 + k] for frame in frames])
+        for k in range(len(SEMAPHORE_COLUMNS)):
+            columns[SEMAPHORE_COLUMNS[k][0]] = np.concatenate([frame[6 + k] for frame in frames])
+        cars = int(columns['car_starts'][-1])
+        semaphores = int(columns['semaphore_starts'][-1])
+        parts = []
+        for name, dtype, count in chunk_layout(len(frames), cars, semaphores):
+            data = np.asarray(columns[name]).astype(dtype, copy=False).tobytes()
+            parts.append(data)
+            parts.append(b'\0' * padding(len(data)))
+        body = b''.join(parts)
+        header = CHUNK_HEADER.pack(CHUNK_MAGIC, len(frames), frames[0][0], cars, semaphores, len(body))
+        return header + body
+
+    def stats(self):
+        return {
+            'recorded': self.recorded,
+            'written_chunks': self.written_chunks,
+            'pending_chunks': self.chunks.qsize(),
+            'dropped_chunks': self.dropped_chunks,
+            'dropped_frames': self.dropped_frames,
+        }
+
+
+class TraceReader:
+    """
+    Чтение записи через отображение файла в память: при открытии читаются только заголовки блоков
+    """
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            # отображение закрывается сборщиком мусора вместе с последним массивом-представлением
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _ = TRACE_HEADER.unpack_from(self.data, 0)
+        if magic != TRACE_MAGIC:
+            raise ValueError('Not a traffic model trace')
+        if version != TRACE_VERSION:
+            raise ValueError('Unsupported trace version {}'.format(version))
+        self.chunks = []  # (смещение тела блока, кадров, авто, светофоров)
+        self.first_ticks = []
+        self.first_frames = []  # номер первого кадра блока среди всех кадров
+        self.frame_count = 0
+        offset = TRACE_HEADER.size
+        while offset + CHUNK_HEADER.size <= len(self.data):
+            magic, frames, first_tick, cars, semaphores, size = CHUNK_HEADER.unpack_from(self.data, offset)
+            body = offset + CHUNK_HEADER.size
+            if magic != CHUNK_MAGIC or body + size > len(self.data):
+                break
+            self.chunks.append((body, frames, cars, semaphores))
+            self.first_ticks.append(first_tick)
+            self.first_frames.append(self.frame_count)
+            self.frame_count += frames
+            offset = body + size
+        self.cache = (None, None)  # последний прочитанный блок
+
+    def __len__(self):
+        return self.frame_count
+
+    def chunk(self, k: int) -> dict:
+        """
+        Столбцы блока k - представления над файлом
+        """
+        if self.cache[0] == k:
+            return self.cache[1]
+        offset, frames, cars, semaphores = self.chunks[k]
+        columns = {}
+        for name, dtype, count in chunk_layout(frames, cars, semaphores):
+            columns[name] = np.frombuffer(self.data, dtype=dtype, count=count, offset=offset)
+            offset += dtype.itemsize * count + padding(dtype.itemsize * count)
+        self.cache = (k, columns)
+        return columns
+
+    def find(self, tick: int) -> int:
+        """
+        :return: номер первого кадра с номером шага не меньше tick, len(self) - таких кадров нет
+        """
+        k = bisect.bisect_right(self.first_ticks, tick) - 1
+        if k < 0:
+            return 0
+        ticks = self.chunk(k)['ticks']
+        i = int(np.searchsorted(ticks, tick))
+        return self.first_frames[k] + i
+
+    def frame(self, index: int) -> dict:
+        """
+        Кадр index в том же виде, что и simulation.frames.decode_frame
+        """
+        if index < 0 or index >= self.frame_count:
+            raise IndexError('Frame index out of range')
+        k = bisect.bisect_right(self.first_frames, index) - 1
+        columns = self.chunk(k)
+        i = index - self.first_frames[k]
+        car_start, car_end = int(columns['car_starts'][i]), int(columns['car_starts'][i + 1])
+        semaphore_start, semaphore_end = int(columns['semaphore_starts'][i]), int(columns['semaphore_starts'][i + 1])
+        frame = {'tick': int(columns['ticks'][i]), 'time': float(columns['times'][i])}
+        for name, _ in CAR_COLUMNS:
+            frame[name] = columns[name][car_start:car_end]
+        for name, _ in SEMAPHORE_COLUMNS:
+            frame[name] = columns[name][semaphore_start:semaphore_end]
+        return frame
+
+    def encoded_frame(self, index: int) -> bytes:
+        """
+        Кадр index в бинарном формате simulation.frames, как его публикует BinaryPublisher
+        """
+        frame = self.frame(index)
+        return encode_frame(
+            frame['tick'], frame['time'], frame['car_ids'], frame['car_x'], frame['car_y'], frame['car_lanes'],
+            frame['semaphore_ids'], frame['semaphore_states'],
+        )
+
+
+class TraceReplay:
+    """
+    Воспроизведение записи: кадры публикуются в ключ BinaryPublisher.FRAME_KEY с темпом,
+    соответствующим модельному времени кадров, ускоренным в speed раз
+    """
+
+    def __init__(self, reader: TraceReader, redis_instance, speed: float = 1.0, clock=time.perf_counter,
+                 sleep=time.sleep):
+        if speed <= 0.0:
+            raise ValueError('Speed must be positive')
+        self.reader = reader
+        self.redis_instance = redis_instance
+        self.speed = speed
+        self.clock = clock
+        self.sleep = sleep
+        self.position = 0
+        self.published = 0
+        self.running = False
+
+    def seek(self, tick: int):
+        self.position = self.reader.find(tick)
+
+    def stop(self):
+        self.running = False
+
+    def run(self, start_tick: int = None, end_tick: int = None):
+        """
+        :param start_tick: начать с первого кадра с номером шага не меньше start_tick, None - с текущей позиции
+        :param end_tick: закончить на кадре с номером шага не больше end_tick, None - до конца записи
+        """
+        from .publishing import BinaryPublisher
+
+        if start_tick is not None:
+            self.seek(start_tick)
+        self.running = True
+        started = None
+        first_time = 0.0
+        while self.running and self.position < len(self.reader):
+            frame = self.reader.frame(self.position)
+            if end_tick is not None and frame['tick'] > end_tick:
+                break
+            if started is None:
+                started = self.clock()
+                first_time = frame['time']
+            delay = started + (frame['time'] - first_time) / self.speed - self.clock()
+            if delay > 0.0:
+                self.sleep(delay)
+            self.redis_instance.set(BinaryPublisher.FRAME_KEY, self.reader.encoded_frame(self.position))
+            self.published += 1
+            self.position += 1
+        self.running = False
@@ -0,0 +1,561 @@
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from bases import RoadPart, CrossRoad, SimulateMixin
+from bases.car import Car, CAR_GAP, DEFAULT_CAR_LENGTH
+from bases.context import ModelContext, current_context
+from bases.road import DriveLine
+
+
+class VectorizedEngine(SimulateMixin):
+    """
+    Движок на массивах NumPy: состояние всех авто (полоса, смещение вдоль полосы, скорость,
+    состояние, задержка) хранится в плоских массивах, шаг выполняется пакетно для всех авто.
+
+    В отличие от ObjectEngine авто обновляются синхронно: каждое авто ориентируется
+    на положение лидера в начале шага, а не после его перемещения.
+    """
+    INITIAL_CAPACITY = 1024
+    # поля авто: имя массива, тип, значение по умолчанию
+    CAR_FIELDS = (
+        ('car_id', np.int64, 0),
+        ('lane', np.int32, 0),
+        ('offset', np.float64, 0.0),
+        ('speed', np.float64, 0.0),
+        ('state', np.int8, Car.STATE_STOPPED),
+        ('delay_passed', np.float64, 0.0),
+        ('wait_time', np.float64, 0.0),
+        ('seq', np.int64, 0),  # порядок въезда на полосу
+        ('next_lane', np.int32, -1),
+        ('dirty', np.bool_, True),  # положение изменилось с момента последней публикации
+        ('spawned', np.bool_, True),  # авто еще не публиковалось
+    )
+
+    roads: List[RoadPart]
+    cross_roads: List[CrossRoad]
+    lanes: List[DriveLine]
+    lane_index: Dict[DriveLine, int]
+    count: int
+
+    def __init__(
+            self, roads: List[RoadPart], cross_roads: List[CrossRoad], seed: int = None, context: ModelContext = None
+    ):
+        """
+        :param context: контекст модели - id новых авто и параметры движения, None - текущий
+        """
+        self.roads = roads
+        self.cross_roads = cross_roads
+        self.context = current_context() if context is None else context
+        self.rng = np.random.default_rng(seed)
+        self.lanes = []
+        self.lane_index = {}
+        self.compiled = False
+        self.count = 0
+        self.entry_seq = 0
+        self.removed_ids = []
+        self.spawned_count = 0
+        self.cleared_count = 0
+        self.cleared_wait_time = 0.0
+        self.metrics = None  # simulation.metrics.Metrics - время фаз шага, None - без замеров
+        self.allocate(self.INITIAL_CAPACITY)
+
+    def allocate(self, capacity: int):
+        self.capacity = capacity
+        for name, dtype, default in self.CAR_FIELDS:
+            setattr(self, name, np.full(capacity, default, dtype=dtype))
+
+    def grow(self, required: int):
+        if required <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < required:
+            capacity *= 2
+        n = self.count
+        old = [getattr(self, name) for name, _, _ in self.CAR_FIELDS]
+        self.allocate(capacity)
+        for i in range(len(self.CAR_FIELDS)):
+            getattr(self, self.CAR_FIELDS[i][0])[:n] = old[i][:n]
+
+    def topology_changed(self):
+        self.compiled = False
+
+    def compile(self):
+        lanes = []
+        for road in self.roads:
+            for drive_line in [road.get_first_line(True), road.get_first_line(False)]:
+                if drive_line:
+                    lanes.append(drive_line)
+        for cross_road in self.cross_roads:
+            lanes.extend(cross_road.lines)
+        lane_index = {lanes[i]: i for i in range(len(lanes))}
+
+        # после добавления дорог индексы полос меняются, авто переносятся на новые индексы
+        n = self.count
+        if n:
+            remap = np.array([lane_index[drive_line] for drive_line in self.lanes], dtype=np.int32)
+            self.lane[:n] = remap[self.lane[:n]]
+            has_next = self.next_lane[:n] >= 0
+            self.next_lane[:n][has_next] = remap[self.next_lane[:n][has_next]]
+
+        count = len(lanes)
+        self.lanes = lanes
+        self.lane_index = lane_index
+        self.lane_start_x = np.zeros(count)
+        self.lane_start_y = np.zeros(count)
+        self.lane_dir_x = np.zeros(count)
+        self.lane_dir_y = np.zeros(count)
+        self.lane_length = np.zeros(count)
+        self.lane_ids = np.array([drive_line.id for drive_line in lanes], dtype=np.int64)
+        self.lane_green = np.ones(count, dtype=bool)
+        self.lane_spawn_timer = np.zeros(count)
+        max_paths = max([len(drive_line.paths) for drive_line in lanes] + [1])
+        self.lane_paths = np.full((count, max_paths), -1, dtype=np.int32)
+        self.lane_path_count = np.zeros(count, dtype=np.int32)
+        signal_lanes = []
+        spawn_lanes = []
+        for i in range(count):
+            drive_line = lanes[i]
+            self.lane_start_x[i] = drive_line.start.x
+            self.lane_start_y[i] = drive_line.start.y
+            self.lane_dir_x[i] = drive_line.line_vector.x
+            self.lane_dir_y[i] = drive_line.line_vector.y
+            self.lane_length[i] = drive_line.length
+            for j in range(len(drive_line.paths)):
+                self.lane_paths[i, j] = lane_index[drive_line.paths[j]]
+            self.lane_path_count[i] = len(drive_line.paths)
+            if drive_line.semaphore:
+                signal_lanes.append(i)
+            if drive_line.auto_add_car:
+                spawn_lanes.append(i)
+                self.lane_spawn_timer[i] = drive_line.time_passed
+        self.signal_lanes = signal_lanes
+        self.spawn_lanes = np.array(spawn_lanes, dtype=np.int32)
+        # полосы перекрестков в порядке CrossRoad.lines и маски конфликтов (см. CrossRoad.build_conflicts)
+        self.lane_cross_road = np.full(count, -1, dtype=np.int32)
+        self.lane_conflicts = [0] * count
+        self.lane_conflict_bits = [0] * count
+        self.cross_road_lanes = []
+        for k in range(len(self.cross_roads)):
+            cross_road_lines = self.cross_roads[k].lines
+            indices = [lane_index[drive_line] for drive_line in cross_road_lines]
+            for j in range(len(indices)):
+                self.lane_cross_road[indices[j]] = k
+                self.lane_conflicts[indices[j]] = cross_road_lines[j].conflict_mask
+                self.lane_conflict_bits[indices[j]] = cross_road_lines[j].conflict_bit
+            self.cross_road_lanes.append(indices)
+        self.compiled = True
+        self.refresh_signals()
+
+        # авто, созданные объектным способом до запуска движка, переносятся в массивы
+        for i in range(count):
+            drive_line = lanes[i]
+            for car in drive_line.queue:
+                next_lane = lane_index[car.next_drive_line] if car.next_drive_line else -1
+                self.append_car(
+                    car_id=car.id,
+                    lane=i,
+                    offset=car.offset,
+                    speed=car.speed,
+                    state=car.state,
+                    delay_passed=car.delay_passed,
+                    wait_time=car.wait_time,
+                    next_lane=next_lane,
+                    dirty=car.dirty,
+                    spawned=car.spawned,
+                )
+                Car.recycle(car)
+            drive_line.queue.clear()
+
+    def refresh_signals(self):
+        for i in self.signal_lanes:
+            self.lane_green[i] = self.lanes[i].can_release()
+
+    def append_car(self, car_id, lane, offset=0.0, speed=0.0, state=Car.STATE_STOPPED, delay_passed=0.0,
+                   wait_time=0.0, next_lane=-1, dirty=True, spawned=True):
+        self.grow(self.count + 1)
+        i = self.count
+        self.car_id[i] = car_id
+        self.lane[i] = lane
+        self.offset[i] = offset
+        self.speed[i] = speed
+        self.state[i] = state
+        self.delay_passed[i] = delay_passed
+        self.wait_time[i] = wait_time
+        self.seq[i] = self.entry_seq
+        self.next_lane[i] = next_lane
+        self.dirty[i] = dirty
+        self.spawned[i] = spawned
+        self.entry_seq += 1
+        self.count += 1
+
+    def reorder(self, order):
+        """
+        Переставляет авто в порядке order; индексы, не вошедшие в order, удаляются
+        """
+        n = self.count
+        k = len(order)
+        for name, _, _ in self.CAR_FIELDS:
+            values = getattr(self, name)
+            values[:k] = values[:n][order]
+        self.count = k
+
+    def lane_tails(self):
+        """
+        Смещение последнего авто на каждой полосе (inf для пустых полос)
+        """
+        n = self.count
+        tails = np.full(len(self.lanes), np.inf)
+        np.minimum.at(tails, self.lane[:n], self.offset[:n])
+        return tails
+
+    def simulate(self, timedelta: float, **kwargs):
+        if not self.compiled:
+            self.compile()
+        metrics = self.metrics
+        if metrics is not None:
+            started = time.perf_counter()
+        self.move_cars(timedelta)
+        self.spawn_cars(timedelta)
+        if metrics is not None:
+            lanes_done = time.perf_counter()
+            # полосы дорог и перекрестков движутся одним пакетом
+            metrics.observe('lanes', lanes_done - started)
+        switched = False
+        for j in range(len(self.cross_roads)):
+            if self.cross_roads[j].simulate_signals(timedelta):
+                switched = True
+        if switched:
+            self.refresh_signals()
+        if metrics is not None:
+            metrics.observe('cross_roads', time.perf_counter() - lanes_done)
+
+    def move_cars(self, timedelta: float):
+        n = self.count
+        if not n:
+            return
+        # авто на каждой полосе упорядочены по времени въезда: первое в группе - головное
+        self.reorder(np.lexsort((self.seq[:n], self.lane[:n])))
+        lane = self.lane[:n]
+        offset = self.offset[:n]
+        speed = self.speed[:n]
+        state = self.state[:n]
+        delay_passed = self.delay_passed[:n]
+        next_lane = self.next_lane[:n]
+        previous_offset = offset.copy()
+
+        is_head = np.empty(n, dtype=bool)
+        is_head[0] = True
+        is_head[1:] = lane[1:] != lane[:-1]
+        has_leader = ~is_head
+        leader_offset = np.empty(n)
+        leader_offset[0] = 0.0
+        leader_offset[1:] = offset[:-1]
+        leader_state = np.empty(n, dtype=np.int8)
+        leader_state[0] = 0
+        leader_state[1:] = state[:-1]
+        limit = np.where(is_head, self.lane_length[lane], leader_offset - CAR_GAP)
+
+        stopped = state == Car.STATE_STOPPED
+        self.wait_time[:n][stopped] += timedelta
+        # авто стоит вплотную за остановившимся авто
+        blocked = has_leader & (leader_state == Car.STATE_STOPPED) & (offset >= limit)
+        waiting = stopped & ~blocked
+        delay_passed[waiting] += timedelta
+        context = self.context
+        started = waiting & (delay_passed >= context.car_delay)
+        delay_passed[started] = 0.0
+        state[started] = Car.STATE_RUNNING
+        active = ~blocked & (~stopped | started)
+
+        new_offset = offset + speed * timedelta
+        reached = active & (new_offset >= limit)
+        moving = active & ~reached
+        offset[moving] = new_offset[moving]
+        accelerate = moving & (speed < context.car_speed)
+        speed[accelerate] = np.minimum(speed[accelerate] + timedelta * context.car_acceleration, context.car_speed)
+        # авто останавливается у стоп-линии или на дистанции от впереди идущего авто
+        offset[reached] = np.maximum(offset[reached], limit[reached])
+        halted = reached
+
+        removed = np.zeros(n, dtype=bool)
+        candidates = np.flatnonzero(reached & is_head)
+        if len(candidates):
+            candidate_lanes = lane[candidates]
+            released = self.lane_green[candidate_lanes]
+            path_count = self.lane_path_count[candidate_lanes]
+            # тупиковая полоса: авто покидает модель
+            leaving = candidates[released & (path_count == 0)]
+            removed[leaving] = True
+            turning = candidates[released & (path_count > 0)]
+            need_path = turning[next_lane[turning] < 0]
+            if len(need_path):
+                choice = self.rng.integers(0, self.lane_path_count[lane[need_path]])
+                next_lane[need_path] = self.lane_paths[lane[need_path], choice]
+            targets = next_lane[turning]
+            can_recv = self.lane_tails()[targets] > DEFAULT_CAR_LENGTH
+            turning = turning[can_recv]
+            targets = targets[can_recv]
+            # на полосу за один шаг въезжает не больше одного авто
+            targets, first = np.unique(targets, return_index=True)
+            turning = turning[first]
+            admitted = self.admit_conflicts(targets, lane)
+            targets = targets[admitted]
+            turning = turning[admitted]
+            lane[turning] = targets
+            offset[turning] = 0.0
+            next_lane[turning] = -1
+            self.seq[:n][turning] = self.entry_seq + np.arange(len(turning))
+            self.entry_seq += len(turning)
+            halted[turning] = False
+            halted[leaving] = False
+
+        state[halted] = Car.STATE_STOPPED
+        speed[halted] = 0.0
+        self.dirty[:n] |= offset != previous_offset
+        if removed.any():
+            self.removed_ids.extend(self.car_id[:n][removed].tolist())
+            self.cleared_count += int(removed.sum())
+            self.cleared_wait_time += float(self.wait_time[:n][removed].sum())
+            self.reorder(np.flatnonzero(~removed))
+
+    def admit_conflicts(self, targets, lane):
+        """
+        Въезд на полосы перекрестков: полоса недоступна, если конфликтующая с ней полоса занята в начале шага
+        или на нее въезжает авто в этом шаге
+        :return: маска допущенных целевых полос
+        """
+        admitted = np.ones(len(targets), dtype=bool)
+        cross = np.flatnonzero(self.lane_cross_road[targets] >= 0)
+        if not len(cross):
+            return admitted
+        occupied_lanes = np.bincount(lane, minlength=len(self.lanes)) > 0
+        occupied = {}
+        for k in cross.tolist():
+            target = int(targets[k])
+            cross_road = int(self.lane_cross_road[target])
+            mask = occupied.get(cross_road)
+            if mask is None:
+                mask = 0
+                indices = self.cross_road_lanes[cross_road]
+                for j in range(len(indices)):
+                    if occupied_lanes[indices[j]]:
+                        mask |= 1 << j
+            if mask & self.lane_conflicts[target]:
+                admitted[k] = False
+            else:
+                mask |= self.lane_conflict_bits[target]
+            occupied[cross_road] = mask
+        return admitted
+
+    def spawn_cars(self, timedelta: float):
+        if not len(self.spawn_lanes):
+            return
+        self.lane_spawn_timer[self.spawn_lanes] += timedelta
+        due = self.spawn_lanes[self.lane_spawn_timer[self.spawn_lanes] >= self.context.spawn_interval]
+        if not len(due):
+            return
+        self.lane_spawn_timer[due] = 0.0
+        tails = self.lane_tails()
+        for i in due[tails[due] > DEFAULT_CAR_LENGTH]:
+            self.append_car(car_id=self.context.next_car_id(), lane=i)
+            self.spawned_count += 1
+
+    def admit_cars(self, drive_lines: List[DriveLine], destinations: List[DriveLine]):
+        """
+        То же, что ObjectEngine.admit_cars; маршрутизации нет, destinations не учитываются
+        """
+        if not self.compiled:
+            self.compile()
+        tails = self.lane_tails()
+        admitted = []
+        for drive_line in drive_lines:
+            i = self.lane_index[drive_line]
+            if tails[i] > DEFAULT_CAR_LENGTH:
+                self.append_car(car_id=self.context.next_car_id(), lane=i)
+                self.spawned_count += 1
+                tails[i] = 0.0
+                admitted.append(True)
+            else:
+                admitted.append(False)
+        return admitted
+
+    def stats(self):
+        """
+        :return: те же показатели, что и ObjectEngine.stats
+        """
+        if not self.compiled:
+            self.compile()
+        n = self.count
+        stopped = self.state[:n] == Car.STATE_STOPPED
+        queues = np.bincount(self.lane[:n][stopped], minlength=1)
+        return {
+            'cars': n,
+            'stopped': int(stopped.sum()),
+            'max_queue': int(queues.max()),
+            'spawned': self.spawned_count,
+            'cleared': self.cleared_count,
+            'cleared_wait_time': self.cleared_wait_time,
+            'wait_time': float(self.wait_time[:n].sum()),
+        }
+
+    def lane_stats(self, lanes: List[DriveLine]):
+        """
+        :return: те же массивы, что и ObjectEngine.lane_stats
+        """
+        if not self.compiled:
+            self.compile()
+        n = self.count
+        stopped = self.state[:n] == Car.STATE_STOPPED
+        lane = self.lane[:n][stopped]
+        counts = np.bincount(lane, minlength=len(self.lanes))
+        wait_time = np.bincount(lane, weights=self.wait_time[:n][stopped], minlength=len(self.lanes))
+        index = np.array([self.lane_index[drive_line] for drive_line in lanes], dtype=np.int64)
+        return counts[index].astype(float), wait_time[index]
+
+    def switch_signals(self, cross_roads: List[CrossRoad]):
+        for j in range(len(cross_roads)):
+            cross_roads[j].switch_state()
+            cross_roads[j].switch_time_passed = 0.0
+        if self.compiled:
+            self.refresh_signals()
+
+    def export_state(self, lanes: List[DriveLine]):
+        """
+        :return: те же массивы, что и ObjectEngine.export_state; счетчики по полосам не ведутся и равны нулю,
+        итоги записываются в заголовок контрольной точки (см. ObjectEngine.import_state)
+        """
+        if not self.compiled:
+            self.compile()
+        n = self.count
+        order = np.lexsort((self.seq[:n], self.lane[:n]))
+        index = np.array([self.lane_index[drive_line] for drive_line in lanes], dtype=np.int64)
+        # номера полос движка -> номера в lanes
+        position = np.full(len(self.lanes), -1, dtype=np.int32)
+        position[index] = np.arange(len(lanes), dtype=np.int32)
+        lane = position[self.lane[:n][order]]
+        order = order[np.argsort(lane, kind='stable')]
+        next_lane = self.next_lane[:n][order]
+        return {
+            'lane_cars': np.bincount(lane, minlength=len(lanes)).astype(np.int64),
+            'lane_time_passed': self.lane_spawn_timer[index],
+            'lane_spawned': np.zeros(len(lanes), dtype=np.int64),
+            'lane_removed': np.zeros(len(lanes), dtype=np.int64),
+            'lane_removed_wait_time': np.zeros(len(lanes)),
+            'car_ids': self.car_id[:n][order],
+            'car_offset': self.offset[:n][order],
+            'car_speed': self.speed[:n][order],
+            'car_state': self.state[:n][order],
+            'car_delay_passed': self.delay_passed[:n][order],
+            'car_wait_time': self.wait_time[:n][order],
+            'car_next_lane': np.where(next_lane >= 0, position[next_lane], -1).astype(np.int32),
+            'car_destination': np.full(n, -1, dtype=np.int32),
+        }
+
+    def import_state(self, lanes: List[DriveLine], state: dict):
+        """
+        Массивы авто заполняются из state целиком, без создания объектов
+        """
+        if not self.compiled:
+            self.compile()
+        index = np.array([self.lane_index[drive_line] for drive_line in lanes], dtype=np.int32)
+        n = len(state['car_ids'])
+        self.count = 0
+        self.grow(n)
+        self.car_id[:n] = state['car_ids']
+        self.lane[:n] = np.repeat(index, state['lane_cars'])
+        self.offset[:n] = state['car_offset']
+        self.speed[:n] = state['car_speed']
+        self.state[:n] = state['car_state']
+        self.delay_passed[:n] = state['car_delay_passed']
+        self.wait_time[:n] = state['car_wait_time']
+        self.seq[:n] = np.arange(n)
+        next_lane = state['car_next_lane']
+        self.next_lane[:n] = np.where(next_lane >= 0, index[next_lane], -1)
+        self.dirty[:n] = True
+        self.spawned[:n] = True
+        self.count = n
+        self.entry_seq = n
+        self.removed_ids = []
+        self.lane_spawn_timer[index] = state['lane_time_passed']
+        self.spawned_count = state['spawned']
+        self.cleared_count = state['cleared']
+        self.cleared_wait_time = state['cleared_wait_time']
+        self.refresh_signals()
+
+    def car_dicts(self, indices):
+        lane = self.lane[indices]
+        offset = self.offset[indices]
+        x = self.lane_start_x[lane] + self.lane_dir_x[lane] * offset
+        y = self.lane_start_y[lane] + self.lane_dir_y[lane] * offset
+        return [
+            {'id': car_id, 'position': {'x': car_x, 'y': car_y}}
+            for car_id, car_x, car_y in zip(self.car_id[indices].tolist(), x.tolist(), y.tolist())
+        ]
+
+    def car_arrays(self):
+        """
+        :return: id, x, y и id полосы всех авто в виде массивов
+        """
+        if not self.compiled:
+            self.compile()
+        n = self.count
+        lane = self.lane[:n]
+        offset = self.offset[:n]
+        return (
+            self.car_id[:n].copy(),
+            self.lane_start_x[lane] + self.lane_dir_x[lane] * offset,
+            self.lane_start_y[lane] + self.lane_dir_y[lane] * offset,
+            self.lane_ids[lane],
+        )
+
+    def lane_car_arrays(self, groups: List[List[DriveLine]]):
+        """
+        :param groups: списки полос
+        :return: для каждого списка - массивы car_arrays авто на его полосах
+        """
+        if not self.compiled:
+            self.compile()
+        n = self.count
+        lane = self.lane[:n]
+        # после переходов между полосами и появления авто порядок по полосам нарушен,
+        # сортировка выполняется один раз для всех списков
+        order = np.argsort(lane, kind='stable')
+        starts = np.zeros(len(self.lanes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(lane, minlength=len(self.lanes)), out=starts[1:])
+        results = []
+        for drive_lines in groups:
+            parts = [order[:0]]
+            for drive_line in drive_lines:
+                i = self.lane_index[drive_line]
+                if starts[i] != starts[i + 1]:
+                    parts.append(order[starts[i]:starts[i + 1]])
+            indices = np.concatenate(parts)
+            group_lane = lane[indices]
+            offset = self.offset[:n][indices]
+            results.append((
+                self.car_id[:n][indices],
+                self.lane_start_x[group_lane] + self.lane_dir_x[group_lane] * offset,
+                self.lane_start_y[group_lane] + self.lane_dir_y[group_lane] * offset,
+                self.lane_ids[group_lane],
+            ))
+        return results
+
+    def get_cars(self):
+        if not self.compiled:
+            self.compile()
+        return self.car_dicts(np.arange(self.count))
+
+    def collect_changes(self):
+        if not self.compiled:
+            self.compile()
+        n = self.count
+        dirty = self.dirty[:n]
+        spawned = self.spawned[:n]
+        spawned_cars = self.car_dicts(np.flatnonzero(dirty & spawned))
+        moved_cars = self.car_dicts(np.flatnonzero(dirty & ~spawned))
+        dirty[:] = False
+        spawned[:] = False
+        removed, self.removed_ids = self.removed_ids, []
+        return spawned_cars, moved_cars, removed
@@ -0,0 +1,283 @@
+"""
+Публикация кадров по областям просмотра.
+
+Клиент регистрирует область просмотра - прямоугольник (x1, y1, x2, y2) или список id перекрестков - в хеше
+Redis traffic_model_viewports: ключ - id клиента, значение - JSON {"bbox": [x1, y1, x2, y2]} или
+{"crossRoads": [id, ...]}. ViewportPublisher раз в refresh_interval секунд перечитывает хеш и на каждой
+публикации записывает клиенту кадр в бинарном формате simulation.frames (ключ traffic_model_frame:<id>)
+только с авто и светофорами его области.
+
+Авто движутся вдоль полос, поэтому пространственный индекс строится по полосам: SpatialGrid - равномерная
+сетка, в каждой ячейке которой перечислены пересекающие ее полосы. Индекс строится один раз при изменении
+топологии, а положение авто в нем поддерживает сам движок - очереди авто полос (DriveLine.queue,
+у VectorizedEngine - номер полосы авто). Полосы области находятся по сетке при регистрации, поэтому кадр
+клиента собирается только из авто его полос, а не из всех авто модели.
+"""
+import json
+import math
+import time
+from typing import List
+
+import numpy as np
+
+from bases.road import DriveLine
+from .frames import encode_frame
+from .publishing import send_commands
+from .simulate import CityModel
+
+
+def line_bbox(drive_line: DriveLine):
+    p1 = drive_line.line.p1
+    p2 = drive_line.line.p2
+    return min(p1.x, p2.x), min(p1.y, p2.y), max(p1.x, p2.x), max(p1.y, p2.y)
+
+
+def bbox_intersects(a, b) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class SpatialGrid:
+    """
+    Равномерная сетка с ячейками cell_size x cell_size: для каждой ячейки - полосы, пересекающие ее
+    """
+    DEFAULT_CELL_SIZE = 100.0
+
+    def __init__(self, drive_lines: List[DriveLine], cell_size: float = DEFAULT_CELL_SIZE):
+        if cell_size <= 0.0:
+            raise ValueError('Cell size must be positive')
+        self.cell_size = cell_size
+        self.cells = {}
+        for drive_line in drive_lines:
+            x1, y1, x2, y2 = line_bbox(drive_line)
+            for cx in range(self.cell(x1), self.cell(x2) + 1):
+                for cy in range(self.cell(y1), self.cell(y2) + 1):
+                    cell = self.cells.get((cx, cy))
+                    if cell is None:
+                        cell = self.cells[(cx, cy)] = []
+                    cell.append(drive_line)
+        # границы занятых ячеек: запрос большой области не перебирает пустые ячейки вне сети
+        self.bounds = None
+        if self.cells:
+            self.bounds = (
+                min(cx for cx, _ in self.cells), min(cy for _, cy in self.cells),
+                max(cx for cx, _ in self.cells), max(cy for _, cy in self.cells),
+            )
+
+    def cell(self, value: float) -> int:
+        return math.floor(value / self.cell_size)
+
+    def query(self, bbox) -> List[DriveLine]:
+        """
+        :param bbox: (x1, y1, x2, y2)
+        :return: полосы, пересекающие прямоугольник, в порядке первого появления в ячейках
+        """
+        found = {}
+        if self.bounds is None:
+            return []
+        min_x, min_y, max_x, max_y = self.bounds
+        for cx in range(max(self.cell(bbox[0]), min_x), min(self.cell(bbox[2]), max_x) + 1):
+            for cy in range(max(self.cell(bbox[1]), min_y), min(self.cell(bbox[3]), max_y) + 1):
+                for drive_line in self.cells.get((cx, cy), ()):
+                    if drive_line not in found and bbox_intersects(line_bbox(drive_line), bbox):
+                        found[drive_line] = None
+        return list(found)
+
+
+class Viewport:
+    """
+    Область просмотра клиента: прямоугольник или перекрестки
+    """
+    lanes: List[DriveLine]  # полосы, авто которых попадают в кадр
+    semaphore_lanes: List[DriveLine]  # полосы со светофорами, попадающими в кадр
+
+    def __init__(self, viewer_id: str, bbox=None, cross_roads: List[int] = None):
+        if (bbox is None) == (cross_roads is None):
+            raise ValueError('Viewport needs either bbox or cross roads')
+        if bbox is not None:
+            if len(bbox) != 4:
+                raise ValueError('Bounding box must be (x1, y1, x2, y2)')
+            bbox = (
+                min(bbox[0], bbox[2]), min(bbox[1], bbox[3]), max(bbox[0], bbox[2]), max(bbox[1], bbox[3])
+            )
+        self.viewer_id = viewer_id
+        self.bbox = bbox
+        self.cross_roads = cross_roads
+        self.lanes = []
+        self.semaphore_lanes = []
+        self.resolved = False
+
+    @classmethod
+    def from_json(cls, viewer_id: str, data: str):
+        data = json.loads(data)
+        if not isinstance(data, dict):
+            raise ValueError('Viewport must be a JSON object')
+        return cls(viewer_id, bbox=data.get('bbox'), cross_roads=data.get('crossRoads'))
+
+    def resolve(self, grid: SpatialGrid, cross_roads: dict):
+        """
+        Находит полосы области
+        :param cross_roads: перекрестки модели по id
+        """
+        if self.bbox is not None:
+            self.lanes = grid.query(self.bbox)
+            self.semaphore_lanes = [
+                drive_line for drive_line in self.lanes
+                if drive_line.semaphore and self.contains(drive_line.semaphore.position)
+            ]
+        else:
+            lanes = {}
+            semaphore_lanes = []
+            for cross_road_id in self.cross_roads:
+                cross_road = cross_roads.get(cross_road_id)
+                if cross_road is None:
+                    continue
+                for drive_line in cross_road.incoming_lines + cross_road.lines + cross_road.outcoming_lines:
+                    lanes[drive_line] = None
+                for drive_line in cross_road.incoming_lines:
+                    if drive_line.semaphore:
+                        semaphore_lanes.append(drive_line)
+            self.lanes = list(lanes)
+            self.semaphore_lanes = semaphore_lanes
+        self.resolved = True
+
+    def contains(self, point) -> bool:
+        bbox = self.bbox
+        return bbox[0] <= point.x <= bbox[2] and bbox[1] <= point.y <= bbox[3]
+
+    def frame(self, model: CityModel, car_ids, car_x, car_y, car_lanes) -> bytes:
+        """
+        :param car_ids, car_x, car_y, car_lanes: авто полос области (engine.lane_car_arrays)
+        """
+        if self.bbox is not None:
+            # полосы на границе области попадают в нее частично
+            bbox = self.bbox
+            inside = (car_x >= bbox[0]) & (car_x <= bbox[2]) & (car_y >= bbox[1]) & (car_y <= bbox[3])
+            car_ids, car_x, car_y, car_lanes = car_ids[inside], car_x[inside], car_y[inside], car_lanes[inside]
+        semaphore_ids = []
+        semaphore_states = []
+        for drive_line in self.semaphore_lanes:
+            semaphore_ids.append(drive_line.semaphore.id)
+            semaphore_states.append(drive_line.semaphore.state)
+        return encode_frame(
+            model.tick, model.time, car_ids, car_x, car_y, car_lanes,
+            np.array(semaphore_ids, dtype=np.int64), np.array(semaphore_states, dtype=np.int8),
+        )
+
+
+class ViewportPublisher:
+    """
+    Кадры областей просмотра клиентов; совместим с AsyncPublisher
+    """
+    VIEWPORTS_KEY = 'traffic_model_viewports'
+    FRAME_KEY_PREFIX = 'traffic_model_frame:'
+    DEFAULT_REFRESH_INTERVAL = 1.0
+
+    def __init__(
+            self,
+            redis_instance,
+            cell_size: float = SpatialGrid.DEFAULT_CELL_SIZE,
+            refresh_interval: float = DEFAULT_REFRESH_INTERVAL,
+            metrics=None,
+            clock=time.perf_counter,
+            level_of_detail=None,
+    ):
+        """
+        :param redis_instance: откуда читаются области и куда записываются кадры
+        :param refresh_interval: как часто перечитывать области из Redis, секунд; None - не читать
+        :param level_of_detail: simulation.detail.LevelOfDetail - полосы вне областей симулируются
+            мезоскопически, None - все полосы поштучно
+        """
+        self.redis_instance = redis_instance
+        self.cell_size = cell_size
+        self.refresh_interval = refresh_interval
+        self.metrics = metrics
+        self.clock = clock
+        self.viewports = {}
+        self.remote_ids = set()  # области, прочитанные из Redis
+        self.next_refresh = None
+        self.topology_version = None
+        self.grid = None
+        self.cross_roads = {}
+        self.refresh_errors = 0
+        self.level_of_detail = level_of_detail
+        self.detailed_viewers = None  # области, по которым последний раз выбирались наблюдаемые полосы
+
+    def subscribe(self, viewer_id: str, bbox=None, cross_roads: List[int] = None):
+        self.viewports[viewer_id] = Viewport(viewer_id, bbox=bbox, cross_roads=cross_roads)
+        self.remote_ids.discard(viewer_id)
+
+    def unsubscribe(self, viewer_id: str):
+        self.viewports.pop(viewer_id, None)
+        self.remote_ids.discard(viewer_id)
+
+    def refresh(self):
+        """
+        Перечитывает области клиентов из хеша VIEWPORTS_KEY
+        """
+        try:
+            registered = self.redis_instance.hgetall(self.VIEWPORTS_KEY)
+        except Exception:
+            # недоступный Redis не должен останавливать публикацию, остаются прежние области
+            self.refresh_errors += 1
+            return
+        remote_ids = set()
+        for viewer_id, data in registered.items():
+            if isinstance(viewer_id, bytes):
+                viewer_id = viewer_id.decode()
+            try:
+                viewport = Viewport.from_json(viewer_id, data)
+            except (ValueError, TypeError):
+                continue
+            if viewer_id in self.viewports and viewer_id not in self.remote_ids:
+                # область, зарегистрированная через subscribe, не заменяется
+                continue
+            remote_ids.add(viewer_id)
+            current = self.viewports.get(viewer_id)
+            if current is None or current.bbox != viewport.bbox or current.cross_roads != viewport.cross_roads:
+                self.viewports[viewer_id] = viewport
+        for viewer_id in self.remote_ids - remote_ids:
+            self.viewports.pop(viewer_id, None)
+        self.remote_ids = remote_ids
+
+    def prepare(self, model: CityModel):
+        started = time.perf_counter()
+        if self.refresh_interval is not None:
+            now = self.clock()
+            if self.next_refresh is None or now >= self.next_refresh:
+                self.next_refresh = now + self.refresh_interval
+                self.refresh()
+        if model.topology_version != self.topology_version:
+            self.topology_version = model.topology_version
+            self.grid = SpatialGrid(model.get_drive_lines(), self.cell_size)
+            self.cross_roads = {cross_road.id: cross_road for cross_road in model.get_cross_roads()}
+            for viewport in self.viewports.values():
+                viewport.resolved = False
+        viewports = list(self.viewports.values())
+        resolved = False
+        for viewport in viewports:
+            if not viewport.resolved:
+                viewport.resolve(self.grid, self.cross_roads)
+                resolved = True
+        if self.level_of_detail is not None and (resolved or set(self.viewports) != self.detailed_viewers):
+            self.detailed_viewers = set(self.viewports)
+            watched = []
+            for viewport in viewports:
+                watched.extend(viewport.lanes)
+            self.level_of_detail.update(watched)
+        commands = []
+        if viewports:
+            lane_car_arrays = getattr(model.engine, 'lane_car_arrays', None)
+            if lane_car_arrays is None:
+                raise ValueError('Engine does not support viewports')
+            arrays = lane_car_arrays([viewport.lanes for viewport in viewports])
+            for i in range(len(viewports)):
+                frame = viewports[i].frame(model, *arrays[i])
+                commands.append(('set', self.FRAME_KEY_PREFIX + viewports[i].viewer_id, frame))
+        if self.metrics is not None:
+            self.metrics.observe('viewports', time.perf_counter() - started)
+        return commands
+
+    def publish(self, model: CityModel):
+        commands = self.prepare(model)
+        if commands:
+            send_commands(self.redis_instance, commands, self.metrics)
@@ -0,0 +1,41 @@
+import argparse
+import json
+
+from simulation import CityModel
+from simulation.runner import Scenario, expand_grid, run_sweep
+from simulation.scenarios import SCENARIOS
+
+parser = argparse.ArgumentParser(description='Перебор параметров сценария в пуле процессов')
+parser.add_argument('--scenario', default='default', choices=sorted(SCENARIOS))
+parser.add_argument('--duration', type=float, default=3600.0, help='модельное время, секунды')
+parser.add_argument('--step', type=float, default=1 / 60)
+parser.add_argument('--engine', type=int, default=CityModel.ENGINE_OBJECT)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--workers', type=int, default=None)
+parser.add_argument('--no-cache', action='store_true')
+parser.add_argument('--time-switch', type=float, nargs='+')
+parser.add_argument('--car-speed', type=float, nargs='+')
+parser.add_argument('--spawn-interval', type=float, nargs='+')
+parser.add_argument('--output', help='файл для результатов в формате JSON')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    grid = {}
+    for param in ['time_switch', 'car_speed', 'spawn_interval']:
+        if getattr(args, param):
+            grid[param] = getattr(args, param)
+
+    base = Scenario(name=args.scenario, duration=args.duration, step=args.step, engine=args.engine, seed=args.seed)
+    kwargs = {'cache_dir': None} if args.no_cache else {}
+    results = run_sweep(expand_grid(base, grid), workers=args.workers, **kwargs)
+    for result in results:
+        metrics = result['metrics']
+        print(
+            result['scenario']['params'],
+            'spawned={spawned} cleared={cleared} mean_wait={mean_wait_time:.2f} '
+            'mean_queue={mean_queue:.2f} max_queue={max_queue}'.format(**metrics),
+            '(cached)' if result['cached'] else '',
+        )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)